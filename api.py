@@ -1,10 +1,22 @@
-from flask import Blueprint, jsonify, request, flash, redirect, url_for
-from models import db, User, Product, Expense, Sale, SaleTransaction, SyncMeta
+from flask import Blueprint, jsonify, request, flash, redirect, url_for, current_app
+from models import db, User, Product, Expense, Sale, SaleTransaction, SyncMeta, SyncJob, SyncShadow
 from datetime import datetime
+from utils.rollups import fold_rows
+from utils.catalog import catalog
+from utils.sync_worker import sync_worker, job_to_dict
+from utils import sync_codec
+from utils import change_log
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import json
+import logging
 import requests
-import pprint
+import threading
+import time
 
 api = Blueprint("api", __name__)
+logger = logging.getLogger(__name__)
 
 # ------------------------------------------------------------------
 # Helper utilities
@@ -55,6 +67,87 @@ def dict_to_model(model_cls, data):
     return model_cls(**kwargs)
 
 
+# Models in the same stage have no foreign keys between them and are
+# transferred concurrently; stages run in order so parents reach the other
+# side before the rows that reference them.
+SYNC_STAGES = [
+    ["User", "Product", "Expense"],
+    ["SaleTransaction"],
+    ["Sale"],
+]
+
+# A model is skipped for this run if one of the models it references failed
+SYNC_DEPENDS = {
+    "SaleTransaction": ["User"],
+    "Sale": ["User", "Product", "SaleTransaction"],
+}
+
+_http = None
+_http_lock = threading.Lock()
+
+
+def get_http():
+    """
+    Shared requests.Session: keep-alive connection pool plus retry with
+    backoff on connection errors and 5xx gateway responses.
+    """
+    global _http
+    with _http_lock:
+        if _http is None:
+            retry = Retry(
+                total=3,
+                backoff_factor=0.5,
+                status_forcelist=[502, 503, 504],
+                allowed_methods=["GET", "POST"],  # pushes are idempotent upserts by uuid
+            )
+            adapter = HTTPAdapter(pool_connections=len(MODEL_MAP), pool_maxsize=len(MODEL_MAP), max_retries=retry)
+            _http = requests.Session()
+            _http.mount("http://", adapter)
+            _http.mount("https://", adapter)
+        return _http
+
+
+def run_sync(task):
+    """
+    Run `task(model_name, model_cls) -> (rows, chunks, error)` for every
+    model, stage by stage, with the models of a stage in a thread pool.
+    Each worker gets its own app context (and so its own db session).
+    Returns (per-model stats, per-model errors).
+    """
+    app = current_app._get_current_object()
+
+    def run(model_name):
+        started = time.perf_counter()
+        with app.app_context():
+            try:
+                rows, chunks, error = task(model_name, MODEL_MAP[model_name])
+            except Exception as e:
+                db.session.rollback()
+                rows, chunks, error = 0, 0, str(e)
+        return model_name, rows, chunks, error, time.perf_counter() - started
+
+    stats, errors = {}, {}
+    with ThreadPoolExecutor(max_workers=app.config.get('SYNC_WORKERS', 3)) as pool:
+        for stage in SYNC_STAGES:
+            runnable = []
+            for model_name in stage:
+                failed = [dep for dep in SYNC_DEPENDS.get(model_name, []) if dep in errors]
+                if failed:
+                    errors[model_name] = f"Skipped: {', '.join(failed)} failed"
+                else:
+                    runnable.append(model_name)
+            for model_name, rows, chunks, error, elapsed in pool.map(run, runnable):
+                stats[model_name] = {
+                    "rows": rows,
+                    "chunks": chunks,
+                    "seconds": round(elapsed, 3),
+                    "rows_per_sec": round(rows / elapsed, 1) if elapsed and rows else 0,
+                }
+                if error:
+                    errors[model_name] = error
+    return stats, errors
+
+
 def get_last_sync(model_name):
     meta = SyncMeta.query.filter_by(model_name=model_name).first()
     return meta.last_sync if meta else datetime(2000, 1, 1)
@@ -70,178 +163,383 @@ def set_last_sync(model_name, ts):
     db.session.commit()
 
 
-# ------------------------------------------------------------------
-# 1. PUSH unsynced records TO server
-# ------------------------------------------------------------------
-@api.route("/sync/push", methods=["GET", "POST"])
-def push_all():
+def get_sync_meta(model_name):
+    meta = SyncMeta.query.filter_by(model_name=model_name).first()
+    if meta is None:
+        meta = SyncMeta(model_name=model_name, last_sync=datetime(2000, 1, 1), push_cursor=0)
+        db.session.add(meta)
+        db.session.commit()
+    return meta
+
+
+def mark_synced(model_cls, ids):
     """
-    Push unsynced *or* modified rows to the remote server.
+    Flag an acknowledged chunk as synced with one UPDATE ... WHERE id IN.
+    last_modified is written back unchanged so the onupdate hook does not
+    make the rows look modified again.
     """
-    SERVER = "http://localhost:5001/api/sync"
-    overall_errors = {}
+    table = model_cls.__table__
+    db.session.execute(
+        table.update()
+        .where(table.c.id.in_(ids))
+        .values(synced=True, last_modified=table.c.last_modified)
+    )
 
-    for model_name, model_cls in MODEL_MAP.items():
-        last_sync = get_last_sync(model_name)
-        # Fetch records that are either:
-        # - Never synced (synced=False)
-        # - OR modified after last sync
-        modified_rows = model_cls.query.filter(
-            (model_cls.synced == False) | (model_cls.last_modified > last_sync)
-        ).all()
 
-        if not modified_rows:
-            continue
+# Servers that rejected the columnar format; they get plain JSON from then on
+_json_only_servers = set()
+
+
+def wire_format(server):
+    configured = current_app.config.get('SYNC_WIRE_FORMAT', 'auto')  # auto, columnar, json
+    if configured == 'auto':
+        return 'json' if server in _json_only_servers else 'columnar'
+    return configured
+
+
+def wire_encoding(fmt):
+    """
+    Compression for request bodies: the best available codec, unless the
+    server only takes plain JSON or SYNC_COMPRESSION says otherwise.
+    """
+    configured = current_app.config.get('SYNC_COMPRESSION', 'auto')  # auto, zstd, gzip, none
+    if configured == 'none' or (fmt == 'json' and configured == 'auto'):
+        return None
+    if configured == 'auto':
+        return sync_codec.supported_encodings()[0]
+    return configured
+
+
+def deltas_enabled():
+    return current_app.config.get('SYNC_DELTAS', False)
+
+
+def load_shadows(model_name, uuids):
+    rows = db.session.query(SyncShadow.uuid, SyncShadow.digests).filter(
+        SyncShadow.model_name == model_name, SyncShadow.uuid.in_(uuids)
+    ).all()
+    return {r.uuid: json.loads(r.digests) for r in rows}
+
+
+def save_shadows(model_name, model_cls, rows):
+    """
+    Remember per-column digests of an acknowledged chunk (two statements).
+    """
+    uuids = [row.uuid for row in rows]
+    table = SyncShadow.__table__
+    db.session.execute(table.delete().where(table.c.model_name == model_name, table.c.uuid.in_(uuids)))
+    db.session.execute(table.insert(), [
+        {"model_name": model_name, "uuid": row.uuid,
+         "digests": json.dumps(sync_codec.row_digests(model_cls.__table__, row))}
+        for row in rows
+    ])
+    db.session.commit()
+
+
+def post_chunk(server, model_name, model_cls, chunk, checkpoint):
+    """
+    POST one chunk in the negotiated wire format. A server that answers the
+    columnar format with 400/415 is remembered as JSON-only and the chunk
+    is re-sent as plain JSON.
+    """
+    fmt = wire_format(server)
+    base = load_shadows(model_name, [row.uuid for row in chunk]) if fmt == 'columnar' and deltas_enabled() else None
+    body, headers = sync_codec.encode(model_cls.__table__, chunk, fmt, wire_encoding(fmt), model_to_dict, base)
+    headers["X-Sync-Checkpoint"] = checkpoint
+
+    r = get_http().post(
+        f"{server}/{ENDPOINT_MAP[model_name]}",
+        data=body,
+        headers=headers,
+        timeout=current_app.config.get('SYNC_TIMEOUT', 10)
+    )
+    if r.status_code in (400, 415) and fmt != 'json' and current_app.config.get('SYNC_WIRE_FORMAT', 'auto') == 'auto':
+        _json_only_servers.add(server)
+        return post_chunk(server, model_name, model_cls, chunk, checkpoint)
+    r.raise_for_status()
+    return len(body)
+
+
+# Servers without the tombstone endpoint; deletes are not sent to them
+_no_tombstone_servers = set()
 
-        payload = [model_to_dict(row) for row in modified_rows]
+
+def post_tombstones(server, model_name, uuids):
+    """
+    POST deleted uuids as {"deleted": [...]} to <endpoint>/delete. A server
+    answering 404/405 does not support deletes; it is remembered and the
+    tombstones are dropped, as deletes were never synced before.
+    """
+    if server in _no_tombstone_servers:
+        return
+    r = get_http().post(
+        f"{server}/{ENDPOINT_MAP[model_name]}/delete",
+        json={"deleted": uuids},
+        timeout=current_app.config.get('SYNC_TIMEOUT', 10)
+    )
+    if r.status_code in (404, 405):
+        _no_tombstone_servers.add(server)
+        logger.warning("Sync server %s does not accept deletes; %s tombstones dropped", server, model_name)
+        return
+    r.raise_for_status()
+
+
+def push_model(server, model_name, model_cls, chunk_size):
+    """
+    Push one model's change-log entries after SyncMeta.push_cursor, in seq
+    order, `chunk_size` entries at a time. Each chunk sends the current
+    version of the changed rows plus tombstones for deleted ones; once the
+    server acknowledges it the cursor moves to the chunk's last seq and the
+    acknowledged entries are compacted away in the same commit, so a failed
+    push resumes after the last acknowledged chunk.
+    Returns (rows pushed, chunks pushed, error or None).
+    """
+    meta = get_sync_meta(model_name)
+    rows_sent = chunks_sent = 0
+    while True:
+        entries = change_log.pending(model_name, meta.push_cursor or 0, chunk_size)
+        if not entries:
+            break
+
+        # Latest operation per row; a row changed several times is sent once
+        latest = {}
+        for entry in entries:
+            latest[entry.row_uuid] = entry.op
+        upserts = [u for u, op in latest.items() if op != 'delete']
+        deleted = [u for u, op in latest.items() if op == 'delete']
+        # A row deleted after this chunk's entries is not found; its tombstone follows
+        chunk = model_cls.query.filter(model_cls.uuid.in_(upserts)).order_by(model_cls.id).all() if upserts else []
 
         try:
-            r = requests.post(f"{SERVER}/{ENDPOINT_MAP[model_name]}", json=payload, timeout=10)
-            r.raise_for_status()
+            if chunk:
+                post_chunk(server, model_name, model_cls, chunk, f"{entries[0].seq}-{entries[-1].seq}")
+            if deleted:
+                post_tombstones(server, model_name, deleted)
         except Exception as e:
-            overall_errors[model_name] = str(e)
-            continue
-
-        # If successful, mark all as synced
-        for row in modified_rows:
-            row.synced = True
+            db.session.rollback()
+            return rows_sent, chunks_sent, str(e)
+
+        if chunk:
+            mark_synced(model_cls, [row.id for row in chunk])
+            if deltas_enabled():
+                save_shadows(model_name, model_cls, chunk)
+        if deleted:
+            shadows = SyncShadow.__table__
+            db.session.execute(shadows.delete().where(shadows.c.model_name == model_name, shadows.c.uuid.in_(deleted)))
+        meta.push_cursor = entries[-1].seq
+        change_log.compact(model_name, meta.push_cursor)
         db.session.commit()
+        # Drop the pushed objects so the session does not grow with the table
+        db.session.expunge_all()
+        meta = get_sync_meta(model_name)
 
-        # Update sync timestamp
-        set_last_sync(model_name, datetime.utcnow())
+        rows_sent += len(chunk) + len(deleted)
+        chunks_sent += 1
 
+    return rows_sent, chunks_sent, None
+
+
+# ------------------------------------------------------------------
+# 1. PUSH unsynced records TO server
+# ------------------------------------------------------------------
+def push_changes():
+    """
+    Push every model's pending change-log entries to the remote server,
+    chunk by chunk. Returns (per-model stats, per-model errors).
+    """
+    SERVER = current_app.config.get('SYNC_SERVER_URL', "http://localhost:5001/api/sync")
+    chunk_size = current_app.config.get('SYNC_CHUNK_SIZE', 500)
+    return run_sync(
+        lambda model_name, model_cls: push_model(SERVER, model_name, model_cls, chunk_size)
+    )
+
+
+@api.route("/sync/push", methods=["GET", "POST"])
+def push_all():
+    stats, overall_errors = push_changes()
     if overall_errors:
-        return jsonify({"message": "Push finished with errors", "details": overall_errors}), 207
-    return jsonify({"message": "Push completed"})
+        return jsonify({"message": "Push finished with errors", "details": overall_errors, "stats": stats}), 207
+    return jsonify({"message": "Push completed", "stats": stats})
 
 
 # ------------------------------------------------------------------
 # 2. PULL remote changes SINCE last sync
 # ------------------------------------------------------------------
 
-@api.route("/sync/pull", methods=["GET", "POST"])
-def pull_all():
-    SERVER = "http://localhost:5001/api/sync"
-    overall_errors = {}
+def coerce_row(model_cls, data):
+    """
+    Keep only real columns from a remote payload row and parse datetimes.
+    """
+    row = {}
+    for col in model_cls.__table__.columns:
+        name = col.name
+        if name in data:
+            val = data[name]
+            if isinstance(val, str) and col.type.python_type is datetime:
+                val = datetime.fromisoformat(val)
+            row[name] = val
+    return row
+
+
+def pull_batch(model_name, model_cls, remote_rows):
+    """
+    Apply one batch of remote rows with a fixed number of statements:
+    one query prefetches the local rows for every incoming uuid, one query
+    finds conflicting Users, then all inserts and all updates go out as two
+    executemany statements. Returns the number of rows written.
+    """
+    table = model_cls.__table__
+    incoming = {}
+    for data in remote_rows:
+        row = coerce_row(model_cls, data)
+        if data.get("__delta__"):
+            row["__delta__"] = True
+        current = incoming.get(row["uuid"])
+        if current is None or row["last_modified"] > current["last_modified"]:
+            incoming[row["uuid"]] = row
+
+    existing = {
+        r["uuid"]: dict(r)
+        for r in db.session.execute(table.select().where(table.c.uuid.in_(incoming.keys()))).mappings()
+    }
+
+    inserts, updates, replaced = [], [], []
+    for uuid, row in incoming.items():
+        local = existing.get(uuid)
+        delta = row.pop("__delta__", False)
+        if local is None:
+            if not delta:  # a field-level delta cannot create a row
+                inserts.append(row)
+        elif local["last_modified"] is None or row["last_modified"] > local["last_modified"]:
+            update = {k: v for k, v in row.items() if k != "id"}
+            update["id"] = local["id"]
+            updates.append(update)
+            replaced.append(local)
+
+    if model_name == "User" and inserts:
+        # Skip new users whose email/username is already taken locally
+        taken = db.session.query(User.email, User.username).filter(
+            User.email.in_([r.get("email") for r in inserts]) |
+            User.username.in_([r.get("username") for r in inserts])
+        ).all()
+        emails = {t.email for t in taken}
+        usernames = {t.username for t in taken}
+        inserts = [r for r in inserts if r.get("email") not in emails and r.get("username") not in usernames]
+
+    if inserts:
+        db.session.execute(table.insert(), inserts)
+    if updates:
+        db.session.bulk_update_mappings(model_cls, updates)
+
+    fold_rows(model_cls, replaced, inserts + [dict(local, **u) for local, u in zip(replaced, updates)])
+    return len(inserts) + len(updates)
+
 
-    for model_name, model_cls in MODEL_MAP.items():
-        since = get_last_sync(model_name).isoformat()
+def pull_model(server, model_name, model_cls, batch_size):
+    """
+    Fetch one model's remote changes since the last sync and apply them
+    batch by batch. Returns (rows written, batches, error or None).
+    """
+    since = get_last_sync(model_name).isoformat()
+    headers = {}
+    if wire_format(server) == 'columnar':
+        headers["Accept"] = f"{sync_codec.COLUMNAR_TYPE}, {sync_codec.JSON_TYPE};q=0.5"
+    headers["Accept-Encoding"] = ", ".join(sync_codec.supported_encodings())
+    try:
+        r = get_http().get(f"{server}/{ENDPOINT_MAP[model_name]}", params={"since": since}, headers=headers,
+                           timeout=current_app.config.get('SYNC_TIMEOUT', 10))
+        r.raise_for_status()
+        # requests/urllib3 already undid Content-Encoding
+        remote_rows = sync_codec.decode(r.content, r.headers.get("Content-Type"))
+    except Exception as e:
+        return 0, 0, str(e)
+
+    written = batches = 0
+    errors = []
+    newest = None  # highest last_modified among the applied batches
+    for i in range(0, len(remote_rows), batch_size):
+        batch = remote_rows[i:i + batch_size]
         try:
-            r = requests.get(f"{SERVER}/{ENDPOINT_MAP[model_name]}", params={"since": since}, timeout=10)
-            r.raise_for_status()
-            remote_rows = r.json()
+            written += pull_batch(model_name, model_cls, batch)
+            db.session.commit()
+            if model_cls is Product:
+                catalog.invalidate()  # bulk writes skip the ORM events
+            batches += 1
         except Exception as e:
-            overall_errors[model_name] = str(e)
+            db.session.rollback()
+            errors.append(str(e))
             continue
-        pp = pprint.PrettyPrinter(indent=2)
-
-        if model_name == "Sale":
-            pp.pprint(model_cls)  # or print(json.dumps(payload, indent=2))
-
-        changes = False
-        for data in remote_rows:
-            row = model_cls.query.filter_by(uuid=data["uuid"]).first()
-            remote_lm = datetime.fromisoformat(data["last_modified"])
-
-            if row:
-                if remote_lm > row.last_modified:
-                    for col in model_cls.__table__.columns:
-                        name = col.name
-                        if name in data:
-                            val = data[name]
-                            if isinstance(col.type.python_type, type) and col.type.python_type is datetime:
-                                val = datetime.fromisoformat(val)
-                            setattr(row, name, val)
-                    changes = True
-            else:
-                # Check for potential uniqueness conflicts before insert
-                try:
-                    conflict = None
-                    if model_name == "User":
-                        if "email" in data:
-                            conflict = model_cls.query.filter_by(email=data["email"]).first()
-                        if not conflict and "username" in data:
-                            conflict = model_cls.query.filter_by(username=data["username"]).first()
-
-                    if conflict:
-                        # Skip insert if conflict exists
-                        continue
-
-                    new_obj = dict_to_model(model_cls, data)
-                    db.session.add(new_obj)
-                    changes = True
-
-                except Exception as e:
-                    overall_errors.setdefault(model_name, []).append(str(e))
-                    continue
-
-        if changes:
-            db.session.commit()
-            set_last_sync(model_name, datetime.utcnow())
+        for row in batch:
+            ts = row.get("last_modified")
+            ts = datetime.fromisoformat(ts) if isinstance(ts, str) else ts
+            if ts and (newest is None or ts > newest):
+                newest = ts
+
+    # Only a fully applied pull moves the cursor, and only as far as the
+    # server's own timestamps: rows of a failed batch must be pulled again
+    if not errors and newest is not None:
+        set_last_sync(model_name, max(newest, get_last_sync(model_name)))
+    return written, batches, errors or None
+
+
+def pull_changes():
+    """
+    Pull remote changes since the last sync for every model.
+    Returns (per-model stats, per-model errors).
+    """
+    SERVER = current_app.config.get('SYNC_SERVER_URL', "http://localhost:5001/api/sync")
+    batch_size = current_app.config.get('SYNC_CHUNK_SIZE', 500)
+    return run_sync(
+        lambda model_name, model_cls: pull_model(SERVER, model_name, model_cls, batch_size)
+    )
 
+
+@api.route("/sync/pull", methods=["GET", "POST"])
+def pull_all():
+    stats, overall_errors = pull_changes()
     if overall_errors:
-        return jsonify({"message": "Pull finished with errors", "details": overall_errors}), 207
-    return jsonify({"message": "Pull completed"})
+        return jsonify({"message": "Pull finished with errors", "details": overall_errors, "stats": stats}), 207
+    return jsonify({"message": "Pull completed", "stats": stats})
 
-"""
-@api.route("/sync/full", methods=["GET", "POST"])
-def sync_full():
-    # Push local unsynced data to remote server
-    push_response = push_all()
-    if push_response.status_code != 200:
-        #return jsonify({"message": "Push failed", "details": push_response.get_json()}), 500
-        flash("❌ Sync failed during push: {}".format(push_response.get_json().get("message", "Unknown error")), "danger")
-        return redirect(url_for('backup.backup_page'))
-
-    # Pull remote updates since last sync
-    pull_response = pull_all()
-    if pull_response.status_code not in [200, 207]:
-        #return jsonify({"message": "Pull failed", "details": pull_response.get_json()}), 500
-        flash("❌ Sync failed during pull: {}".format(pull_response.get_json().get("message", "Unknown error")), "danger")
-        return redirect(url_for('backup.backup_page'))
-
-    #return jsonify({"message": "Full sync completed"}), 200
-    flash("✅ Full sync completed successfully!", "success")
-    return redirect(url_for('backup.backup_page'))
-"""
+def run_full_sync(progress):
+    """
+    Background job body: push, then pull (see utils/sync_worker.py).
+    A push with errors stops the run, as the old synchronous flow did.
+    """
+    progress("Pushing local changes")
+    push_stats, push_errors = push_changes()
+    if push_errors:
+        return {"push": push_stats}, {"push": push_errors}, False
+
+    progress("Pulling remote changes")
+    pull_stats, pull_errors = pull_changes()
+    errors = {"pull": pull_errors} if pull_errors else {}
+    return {"push": push_stats, "pull": pull_stats}, errors, True
 
-from flask import flash, redirect, url_for
-import requests
 
 @api.route("/sync/full", methods=["GET", "POST"])
 def sync_full():
-    try:
-        # Push local unsynced data to remote server
-        push_response = push_all()
-        if isinstance(push_response, tuple):
-            push_response, push_status = push_response
-        else:
-            push_status = push_response.status_code
-
-        if push_status != 200:
-            flash("❌ Sync failed during push: {}".format(getattr(push_response, 'message', 'Server error')), "danger")
-            return redirect(url_for('backup.backup_page'))
-
-        # Pull remote updates since last sync
-        pull_response = pull_all()
-        if isinstance(pull_response, tuple):
-            pull_response, pull_status = pull_response
-        else:
-            pull_status = pull_response.status_code
-
-        if pull_status not in [200, 207]:
-            flash("❌ Sync failed during pull: {}".format(getattr(pull_response, 'message', 'Server error')), "danger")
-            return redirect(url_for('backup.backup_page'))
-
-    except requests.exceptions.ConnectionError:
-        flash("❌ No internet connection. Please check your network and try again.", "danger")
-        return redirect(url_for('backup.backup_page'))
-
-    except Exception as e:
-        flash("❌ An unexpected error occurred during sync: {}".format(str(e)), "danger")
-        return redirect(url_for('backup.backup_page'))
-
-    flash("✅ Full sync completed successfully!", "success")
+    """
+    Queue a full sync for the background worker and return immediately.
+    """
+    job = sync_worker.enqueue()
+    if request.accept_mimetypes.best == 'application/json':
+        return jsonify(job_to_dict(job)), 202
+    flash("🔄 Sync started. Progress is shown below.", "info")
     return redirect(url_for('backup.backup_page'))
 
 
+@api.route("/sync/status")
+def sync_status():
+    """
+    Current/most recent sync job plus the last finished one, for polling.
+    """
+    latest = SyncJob.query.order_by(SyncJob.id.desc()).first()
+    last_finished = SyncJob.query.filter(SyncJob.status.in_(['done', 'failed'])) \
+        .order_by(SyncJob.id.desc()).first()
+    return jsonify({
+        "current": job_to_dict(latest),
+        "last_finished": job_to_dict(last_finished),
+        "auto_interval": current_app.config.get('SYNC_INTERVAL', 0),
+        "pending_changes": change_log.backlog(),
+    })
@@ -3,17 +3,34 @@ from flask_migrate import Migrate
 from models import db, Product, Sale, Expense, User,  SaleTransaction
 from flask_login import LoginManager, current_user, login_user, login_required, logout_user, current_user
 from werkzeug.security import generate_password_hash, check_password_hash
-from api import api 
-from backup import backup_bp
+from api import api, run_full_sync, MODEL_MAP, model_to_dict
+from backup import backup_bp, backup_scheduler, write_backup
 from routes import admin, sales, expenses, products, reports, auth, dashboard
+from utils.rollups import rebuild_rollups
+from utils.query_plans import explain_hot_queries
+from utils.sync_worker import sync_worker
+from utils.database import configure_database, init_engine
+from utils.metrics import metrics
+from utils import barcode as barcode_assets
+from utils.product_import import import_products
+from utils import sync_codec
+from utils import change_log
+from utils.reconcile import reconcile
+import click
+import json
+import time
 
 app = Flask(__name__)
 app.secret_key = 'dev-secret-key-1234'  # Change this!
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///inventory.db'
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+configure_database(app)  # DATABASE_URL, pool sizing, SQLite pragmas (utils/database.py)
 
 db.init_app(app)
+init_engine(app, db)
 migrate = Migrate(app, db)
+sync_worker.init_app(app, run_full_sync)
+backup_scheduler.init_app(app)
+metrics.init_app(app)  # request/SQL/render timings, /metrics (utils/metrics.py)
 
 # Register blueprint
 app.register_blueprint(api)
@@ -34,6 +51,80 @@ login_manager.login_view = 'auth.login'
 def load_user(user_id):
     return User.query.get(int(user_id))
 
+@app.cli.command('rebuild-rollups')
+def rebuild_rollups_command():
+    """Backfill the daily/monthly sales and expense rollup tables."""
+    db.create_all()
+    rebuild_rollups()
+    print("Rollups rebuilt.")
+
+@app.cli.command('check-query-plans')
+def check_query_plans_command():
+    """Fail if any hot route query is planned as a full table scan."""
+    failed = False
+    for label, (plan, scans) in explain_hot_queries().items():
+        print(f"{'FAIL' if scans else 'ok  '} {label}")
+        for step in plan:
+            print(f"       {step}")
+        failed = failed or bool(scans)
+    if failed:
+        raise SystemExit(1)
+
+@app.cli.command('backup-now')
+def backup_now_command():
+    """Write a rotating backup snapshot into the backups folder."""
+    metrics = write_backup()
+    print(json.dumps(metrics))
+
+@app.cli.command('sync-wire-stats')
+@click.option('--rows', default=10000, help='Rows per model to encode.')
+def sync_wire_stats_command(rows):
+    """Compare sync payload bytes and encode/decode time per wire format."""
+    for model_name, model_cls in MODEL_MAP.items():
+        sample = model_cls.query.limit(rows).all()
+        if not sample:
+            continue
+        print(f"{model_name} ({len(sample)} rows)")
+        for r in sync_codec.measure(model_cls.__table__, sample, model_to_dict):
+            print(f"  {r['format']:<9} {r['encoding']:<9} {r['bytes']:>10} B  "
+                  f"encode {r['encode_ms']:>7} ms  decode {r['decode_ms']:>7} ms")
+
+@app.cli.command('prerender-barcodes')
+@click.option('--size', default='screen', type=click.Choice(sorted(barcode_assets.SIZES)), help='Image size preset.')
+@click.option('--symbology', default=barcode_assets.DEFAULT_SYMBOLOGY, help='Barcode symbology.')
+@click.option('--workers', default=None, type=int, help='Render processes (default: CPU count).')
+def prerender_barcodes_command(size, symbology, workers):
+    """Render every product's barcode image into the cache ahead of a label run."""
+    values = [b for (b,) in db.session.query(Product.barcode).filter(Product.barcode.isnot(None))]
+    started = time.perf_counter()
+    counts = barcode_assets.prerender(values, symbology, size, workers)
+    print(f"{len(values)} barcodes: {counts['rendered']} rendered, {counts['cached']} already cached, "
+          f"{counts['failed']} failed in {time.perf_counter() - started:.1f}s")
+
+@app.cli.command('import-products')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--stock-mode', default='add', type=click.Choice(['add', 'set']), help='Add to or replace stock.')
+@click.option('--chunk-size', default=2000, help='Rows per transaction.')
+@click.option('--errors', 'error_report', default=None, help='Write rejected rows to this CSV.')
+def import_products_command(path, stock_mode, chunk_size, error_report):
+    """Bulk add/restock products from a CSV or XLSX file and report rows/sec."""
+    print(json.dumps(import_products(path, stock_mode, chunk_size, error_report)))
+
+@app.cli.command('sync-requeue')
+@click.option('--all', 'everything', is_flag=True, help='Queue every row, not just unsynced ones.')
+def sync_requeue_command(everything):
+    """Queue rows in the sync change log, e.g. for a new sync server."""
+    print(json.dumps(change_log.enqueue_unsynced(everything=everything)))
+
+@app.cli.command('sync-reconcile')
+@click.option('--repair/--check', default=False, help='Repair differences or only report them (default).')
+def sync_reconcile_command(repair):
+    """Compare every synced table with the server via Merkle trees."""
+    stats, errors = reconcile(repair=repair)
+    print(json.dumps({'stats': stats, 'errors': errors}))
+    if errors:
+        raise SystemExit(1)
+
 #@app.before_first_request
 def create_tables():
     db.create_all()
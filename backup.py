@@ -1,80 +1,476 @@
-from flask import Blueprint, render_template, send_file, request, redirect, flash, url_for, current_app
+from flask import Blueprint, render_template, request, redirect, flash, url_for, current_app, Response, jsonify
+from models import db
+from utils.rollups import rebuild_rollups
+from utils.catalog import catalog
+from utils.metrics import metrics as job_metrics
+from utils.product_search import FTS_TABLE
+from datetime import datetime
+import glob
+import gzip
+import json
+import logging
 import os
 import sqlite3
 import shutil
+import subprocess
+import tempfile
+import threading
+import time
+import zlib
 from werkzeug.utils import secure_filename
 
+logger = logging.getLogger(__name__)
+
 #backup_bp = Blueprint("backup", __name__)
 backup_bp = Blueprint('backup', __name__, url_prefix='/backup')
 
+# Backup file per backend: a gzipped SQLite snapshot, or a pg_dump archive
+# (custom format, already compressed) restored with pg_restore.
+BACKUP_EXTENSIONS = {
+    'sqlite': '.db.gz',
+    'postgresql': '.dump',
+}
+
+
+def backend():
+    return db.engine.dialect.name
+
+
+def live_db_path():
+    return db.engine.url.database
+
+
+def backup_dir():
+    path = current_app.config.get('BACKUP_DIR') or os.path.join(current_app.instance_path, 'backups')
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def snapshot_db(dest_path):
+    """
+    Take a consistent copy of the live database with VACUUM INTO, which
+    writes a compacted copy as of one read transaction. In WAL mode a
+    reader never blocks the tills' writes, and unlike the online backup
+    API the copy does not restart when another connection writes, so it
+    always finishes. `dest_path` must not exist or be empty.
+    Returns metrics for the run.
+    """
+    started = time.perf_counter()
+    source = sqlite3.connect(live_db_path())
+    try:
+        source.execute('VACUUM INTO ?', (dest_path,))
+    finally:
+        source.close()
+
+    return {
+        'snapshot_seconds': round(time.perf_counter() - started, 3),
+        'steps': 1,  # a single pass, whatever the write traffic
+        'db_bytes': os.path.getsize(dest_path),
+    }
+
+
+def _pg_command(tool, *args):
+    """
+    Command line and environment for a PostgreSQL client tool against the
+    live database. The password goes in the environment, not argv.
+    """
+    path = shutil.which(tool)
+    if path is None:
+        raise RuntimeError(f"{tool} was not found on PATH; it is needed to back up PostgreSQL")
+    url = db.engine.url
+    dsn = url.set(drivername='postgresql', password=None).render_as_string(hide_password=False)
+    env = dict(os.environ)
+    if url.password:
+        env['PGPASSWORD'] = url.password
+    return [path, *args, '--dbname', dsn], env
+
+
+def pg_dump(dest_path):
+    """
+    Consistent dump of the live PostgreSQL database (pg_dump runs in one
+    snapshot transaction, so sales keep being written meanwhile).
+    """
+    started = time.perf_counter()
+    command, env = _pg_command('pg_dump', '--format=custom', '--no-owner', '--file', dest_path)
+    subprocess.run(command, env=env, check=True, capture_output=True)
+    return {
+        'snapshot_seconds': round(time.perf_counter() - started, 3),
+        'db_bytes': os.path.getsize(dest_path),
+    }
+
+
+def pg_restore(source_path):
+    """
+    Replace the live PostgreSQL data with a pg_dump archive, in one
+    transaction, then rebuild the rollups.
+    """
+    started = time.perf_counter()
+    command, env = _pg_command('pg_restore', '--clean', '--if-exists', '--no-owner',
+                               '--single-transaction', source_path)
+    db.session.remove()
+    result = subprocess.run(command, env=env, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1] if result.stderr.strip() else 'pg_restore failed')
+    catalog.invalidate()
+    rebuild_rollups()
+    return {'seconds': round(time.perf_counter() - started, 3)}
+
+
+def file_chunks(path, chunk_size=64 * 1024):
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            yield chunk
+
+
+def gzip_chunks(path, chunk_size=64 * 1024):
+    """
+    Yield `path` gzip-compressed, chunk by chunk.
+    """
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits=31 -> gzip container
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            data = compressor.compress(chunk)
+            if data:
+                yield data
+    yield compressor.flush()
+
+
+def write_backup():
+    """
+    Snapshot the live database into backup_dir() as a .db.gz file, prune
+    old files beyond BACKUP_RETENTION and log the run's metrics.
+    """
+    started = time.perf_counter()
+    stamp = datetime.utcnow().strftime('%Y%m%d-%H%M%S')
+    target = os.path.join(backup_dir(), f'inventory-{stamp}{BACKUP_EXTENSIONS[backend()]}')
+
+    if backend() == 'postgresql':
+        metrics = pg_dump(target)
+    else:
+        fd, snapshot = tempfile.mkstemp(suffix='.db', dir=backup_dir())
+        os.close(fd)
+        try:
+            metrics = snapshot_db(snapshot)
+            with open(target, 'wb') as out:
+                for chunk in gzip_chunks(snapshot):
+                    out.write(chunk)
+        finally:
+            os.remove(snapshot)
+
+    metrics.update({
+        'file': os.path.basename(target),
+        'finished': datetime.utcnow().isoformat(timespec='seconds'),
+        'gz_bytes': os.path.getsize(target),
+        'total_seconds': round(time.perf_counter() - started, 3),
+    })
+    job_metrics.observe_job('backup', metrics['total_seconds'])
+    prune_backups()
+    with open(os.path.join(backup_dir(), 'backup_log.jsonl'), 'a') as log:
+        log.write(json.dumps(metrics) + '\n')
+    return metrics
+
+
+def prune_backups():
+    keep = current_app.config.get('BACKUP_RETENTION', 7)
+    files = sorted(glob.glob(os.path.join(backup_dir(), f'inventory-*{BACKUP_EXTENSIONS[backend()]}')))
+    for path in files[:-keep] if keep else []:
+        os.remove(path)
+
+
+def recent_backups(limit=10):
+    path = os.path.join(backup_dir(), 'backup_log.jsonl')
+    if not os.path.exists(path):
+        return []
+    with open(path) as f:
+        lines = f.readlines()[-limit:]
+    return [json.loads(line) for line in reversed(lines)]
+
+
+class BackupScheduler:
+    """
+    Daemon thread writing a rotating backup every BACKUP_INTERVAL seconds
+    (0 = off). Started lazily on the first request.
+    """
+
+    def __init__(self):
+        self.app = None
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.app = app
+        app.config.setdefault('BACKUP_INTERVAL', 0)
+        app.config.setdefault('BACKUP_RETENTION', 7)
+
+        @app.before_request
+        def _ensure_backup_scheduler():
+            self.start()
+
+    def start(self):
+        if not self.app.config['BACKUP_INTERVAL'] or (self._thread and self._thread.is_alive()):
+            return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._loop, name='backup-scheduler', daemon=True)
+                self._thread.start()
+
+    def _loop(self):
+        while True:
+            time.sleep(self.app.config['BACKUP_INTERVAL'])
+            try:
+                with self.app.app_context():
+                    metrics = write_backup()
+                    logger.info("Scheduled backup %s written in %ss", metrics['file'], metrics['total_seconds'])
+            except Exception:
+                logger.exception("Scheduled backup failed")
+
+
+backup_scheduler = BackupScheduler()
+
+
+# ----------------------------------------------------------------------
+# Import
+# ----------------------------------------------------------------------
+IMPORT_BATCH_SIZE = 5000
+
+# Rebuilt from the imported data rather than copied (rollups), or local
+# state that must not be restored from another machine (sync jobs).
+IMPORT_SKIP_TABLES = {'sales_rollup', 'expense_rollup', 'sync_job'}
+
+import_progress = {}
+_import_lock = threading.Lock()
+
+
+def _quote(name):
+    return '"' + name.replace('"', '""') + '"'
+
+
+def _report(**values):
+    with _import_lock:
+        import_progress.update(values)
+
+
+def _table_columns(conn, table):
+    return [row[1] for row in conn.execute(f'PRAGMA table_info({_quote(table)})')]
+
+
+def import_snapshot(source_path, batch_size=None):
+    """
+    Replace the live data with the contents of the SQLite file at
+    `source_path`.
+
+    Only tables and columns present in the live schema are copied; columns
+    are matched by name, so a backup from an older or newer schema version
+    still imports (missing columns get their defaults). Tables are cleared
+    children first and filled parents first (metadata FK order) inside one
+    transaction, streaming `batch_size` rows at a time so memory stays flat
+    whatever the size of the backup. Rollups are rebuilt afterwards.
+    Returns metrics for the run; progress is published in `import_progress`.
+    """
+    batch_size = batch_size or current_app.config.get('IMPORT_BATCH_SIZE', IMPORT_BATCH_SIZE)
+    started = time.perf_counter()
+    tables = [t.name for t in db.metadata.sorted_tables if t.name not in IMPORT_SKIP_TABLES]
+
+    source = sqlite3.connect(f'file:{source_path}?mode=ro', uri=True)
+    dest = sqlite3.connect(live_db_path(), isolation_level=None)
+    try:
+        source_tables = {row[0] for row in source.execute("SELECT name FROM sqlite_master WHERE type='table'")}
+        plan = []
+        for table in tables:
+            if table not in source_tables:
+                continue
+            live_columns = _table_columns(dest, table)
+            columns = [c for c in _table_columns(source, table) if c in live_columns]
+            total = source.execute(f'SELECT COUNT(*) FROM {_quote(table)}').fetchone()[0]
+            plan.append((table, columns, total))
+
+        with _import_lock:
+            import_progress.clear()
+        _report(status='running', table=None, done=0, total=sum(p[2] for p in plan),
+                started=datetime.utcnow().isoformat(timespec='seconds'), error=None)
+
+        # Pragmas for the duration of the import. Foreign keys and the
+        # journal mode can only be changed outside a transaction. A WAL
+        # database is left in WAL; otherwise the rollback journal is
+        # truncated rather than deleted on commit.
+        journal_mode = dest.execute('PRAGMA journal_mode').fetchone()[0]
+        synchronous = dest.execute('PRAGMA synchronous').fetchone()[0]
+        dest.execute('PRAGMA foreign_keys = OFF')
+        if journal_mode.lower() != 'wal':
+            dest.execute('PRAGMA journal_mode = TRUNCATE')
+        dest.execute('PRAGMA synchronous = OFF')
+        dest.execute('PRAGMA cache_size = -65536')  # 64 MB
+        dest.execute('PRAGMA temp_store = MEMORY')
+
+        counts, done = {}, 0
+        try:
+            dest.execute('BEGIN IMMEDIATE')
+            for table in reversed(tables):
+                if table in source_tables:
+                    dest.execute(f'DELETE FROM {_quote(table)}')
+
+            for table, columns, total in plan:
+                _report(table=table)
+                counts[table] = 0
+                if not columns:
+                    continue
+                column_list = ','.join(_quote(c) for c in columns)
+                cursor = source.execute(f'SELECT {column_list} FROM {_quote(table)}')
+                insert = (f'INSERT INTO {_quote(table)} ({column_list}) '
+                          f'VALUES ({",".join("?" * len(columns))})')
+                while True:
+                    rows = cursor.fetchmany(batch_size)
+                    if not rows:
+                        break
+                    dest.executemany(insert, rows)
+                    counts[table] += len(rows)
+                    done += len(rows)
+                    _report(done=done)
+            dest.execute('COMMIT')
+        except Exception:
+            dest.execute('ROLLBACK')
+            raise
+        finally:
+            dest.execute(f'PRAGMA synchronous = {synchronous}')
+            if journal_mode.lower() != 'wal':
+                dest.execute(f'PRAGMA journal_mode = {journal_mode}')
+            dest.execute('PRAGMA foreign_keys = ON')
+
+        orphans = len(dest.execute('PRAGMA foreign_key_check').fetchall())
+    except Exception as e:
+        _report(status='failed', error=str(e))
+        raise
+    finally:
+        dest.close()
+        source.close()
+
+    # The ORM session may still hold rows from before the import
+    db.session.remove()
+    catalog.invalidate()
+    _report(table='rollups')
+    rebuild_rollups()
+
+    metrics = {
+        'rows': done,
+        'tables': counts,
+        'skipped_tables': sorted(t for t in source_tables - set(db.metadata.tables)
+                                 if t != 'alembic_version' and not t.startswith(('sqlite_', FTS_TABLE))),
+        'fk_violations': orphans,
+        'seconds': round(time.perf_counter() - started, 3),
+    }
+    metrics['rows_per_sec'] = round(done / metrics['seconds']) if metrics['seconds'] else done
+    job_metrics.observe_job('backup_import', metrics['seconds'])
+    _report(status='done', table=None, metrics=metrics)
+    return metrics
+
 
 @backup_bp.route("/", methods=["GET"])
 def backup_page():
-    return render_template("backup.html")
+    return render_template("backup.html", backups=recent_backups(), extension=BACKUP_EXTENSIONS[backend()])
 
 @backup_bp.route("/export", methods=["GET"])
 def export_db():
-    db_path = os.path.join(current_app.instance_path, "inventory.db")
-    
-    if not os.path.exists(db_path):
+    stamp = datetime.utcnow().strftime('%Y%m%d-%H%M%S')
+
+    if backend() == 'postgresql':
+        fd, dump = tempfile.mkstemp(suffix='.dump', dir=backup_dir())
+        os.close(fd)
+        try:
+            metrics = pg_dump(dump)
+        except Exception:
+            os.remove(dump)
+            raise
+        logger.info("Backup dump for download: %s", metrics)
+
+        def generate_dump():
+            try:
+                yield from file_chunks(dump)
+            finally:
+                os.remove(dump)
+
+        return Response(
+            generate_dump(),
+            mimetype='application/octet-stream',
+            headers={'Content-Disposition': f'attachment; filename=inventory_backup-{stamp}.dump'}
+        )
+
+    if not os.path.exists(live_db_path()):
         return "Database not found", 404
-    
-    return send_file(db_path, as_attachment=True, download_name="inventory_backup.db")
+
+    # Consistent snapshot first, then stream it gzip-compressed
+    fd, snapshot = tempfile.mkstemp(suffix='.db', dir=backup_dir())
+    os.close(fd)
+    try:
+        metrics = snapshot_db(snapshot)
+    except Exception:
+        os.remove(snapshot)
+        raise
+    logger.info("Backup snapshot for download: %s", metrics)
+
+    def generate():
+        try:
+            yield from gzip_chunks(snapshot)
+        finally:
+            os.remove(snapshot)
+
+    return Response(
+        generate(),
+        mimetype='application/gzip',
+        headers={'Content-Disposition': f'attachment; filename=inventory_backup-{stamp}.db.gz'}
+    )
 
 @backup_bp.route('/import', methods=['GET', 'POST'])
 def import_backup():
     if request.method == 'POST':
         file = request.files['file']
-        if file and file.filename.endswith('.db'):
-            temp_path = os.path.join(current_app.instance_path, 'temp_import.db')
-            file.save(temp_path)
+        if file and backend() == 'postgresql' and file.filename.endswith('.dump'):
+            fd, temp_path = tempfile.mkstemp(suffix='.dump', dir=current_app.instance_path)
+            os.close(fd)
+            try:
+                file.save(temp_path)
+                metrics = pg_restore(temp_path)
+                logger.info("Backup restored: %s", metrics)
+                flash(f"Backup imported successfully in {metrics['seconds']}s", "success")
+            except Exception as e:
+                logger.exception("Backup import failed")
+                flash(f"Import failed: {e}", "danger")
+            finally:
+                os.remove(temp_path)
 
-            # Live DB path
-            live_db_path = os.path.join(current_app.instance_path, 'inventory.db')
+            return redirect(url_for('backup.import_backup'))
 
+        if file and backend() == 'sqlite' and file.filename.endswith(('.db', '.db.gz')):
+            fd, temp_path = tempfile.mkstemp(suffix='.db', dir=current_app.instance_path)
+            os.close(fd)
             try:
-                # Open connections
-                source_conn = sqlite3.connect(temp_path)
-                dest_conn = sqlite3.connect(live_db_path)
-
-                source_cursor = source_conn.cursor()
-                dest_cursor = dest_conn.cursor()
-
-                # Disable foreign key checks
-                dest_cursor.execute('PRAGMA foreign_keys = OFF')
-
-                # Get all table names
-                source_cursor.execute("SELECT name FROM sqlite_master WHERE type='table';")
-                tables = source_cursor.fetchall()
-
-                for (table_name,) in tables:
-                    if table_name.startswith("sqlite_"):
-                        continue  # skip internal SQLite tables
-
-                    # Optional: Clear existing data
-                    dest_cursor.execute(f'DELETE FROM {table_name}')
-
-                    # Copy data
-                    rows = source_cursor.execute(f'SELECT * FROM {table_name}').fetchall()
-                    if rows:
-                        # Get column count
-                        columns = [desc[0] for desc in source_cursor.description]
-                        placeholders = ','.join(['?'] * len(columns))
-                        dest_cursor.executemany(
-                            f'INSERT INTO {table_name} ({",".join(columns)}) VALUES ({placeholders})',
-                            rows
-                        )
-
-                dest_conn.commit()
-                flash("Backup imported successfully", "success")
+                if file.filename.endswith('.gz'):
+                    with gzip.open(file.stream) as src, open(temp_path, 'wb') as dst:
+                        shutil.copyfileobj(src, dst, 1024 * 1024)
+                else:
+                    file.save(temp_path)
+
+                metrics = import_snapshot(temp_path)
+                logger.info("Backup imported: %s", metrics)
+                flash(f"Backup imported successfully: {metrics['rows']} rows from "
+                      f"{len(metrics['tables'])} tables in {metrics['seconds']}s", "success")
             except Exception as e:
+                logger.exception("Backup import failed")
                 flash(f"Import failed: {e}", "danger")
             finally:
-                source_conn.close()
-                dest_conn.close()
                 os.remove(temp_path)
 
             return redirect(url_for('backup.import_backup'))
 
-    return render_template('backup.html')
+    return render_template('backup.html', backups=recent_backups(), extension=BACKUP_EXTENSIONS[backend()])
+
 
+@backup_bp.route('/import/status', methods=['GET'])
+def import_status():
+    with _import_lock:
+        return jsonify(dict(import_progress))
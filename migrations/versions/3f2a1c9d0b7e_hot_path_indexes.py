@@ -0,0 +1,144 @@
+"""hot path indexes and rollup tables
+
+Adds the indexes used by the dashboard date filters, sales_list grouping,
+receipts, sync push and product search, plus the sales/expense rollup
+tables. Databases created with db.create_all() already have all of these,
+so every step is skipped when the object already exists. Rollup tables
+created here are filled from the existing sales and expenses, as
+`flask rebuild-rollups` would.
+
+Revision ID: 3f2a1c9d0b7e
+Revises:
+Create Date: 2026-10-17 09:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3f2a1c9d0b7e'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+SYNCED_TABLES = ['user', 'product', 'expense', 'sale', 'sale_transaction']
+
+INDEXES = [
+    # (name, table, columns)
+    ('ix_sale_timestamp', 'sale', ['timestamp']),
+    ('ix_sale_product_id', 'sale', ['product_id']),
+    ('ix_sale_transaction_id_timestamp', 'sale', ['transaction_id', 'timestamp']),
+    ('ix_sale_transaction_timestamp', 'sale_transaction', ['timestamp']),
+    ('ix_expense_expense_date', 'expense', ['expense_date']),
+    ('ix_sync_meta_model_name', 'sync_meta', ['model_name']),
+] + [
+    (f'ix_{table}_last_modified', table, ['last_modified']) for table in SYNCED_TABLES
+] + [
+    (f'ix_{table}_synced_last_modified', table, ['synced', 'last_modified']) for table in SYNCED_TABLES
+]
+
+# Bucket label formats per period: (SQLite strftime, PostgreSQL to_char),
+# as utils.database.day_bucket/month_bucket compile them at this revision
+BUCKET_FORMATS = {
+    'day': ('%Y-%m-%d', 'YYYY-MM-DD'),
+    'month': ('%Y-%m', 'YYYY-MM'),
+}
+
+
+def _existing_tables():
+    return set(sa.inspect(op.get_bind()).get_table_names())
+
+
+def _existing_indexes(table):
+    return {ix['name'] for ix in sa.inspect(op.get_bind()).get_indexes(table)}
+
+
+def _bucket(column, period):
+    sqlite_format, postgresql_format = BUCKET_FORMATS[period]
+    if op.get_bind().dialect.name == 'postgresql':
+        return sa.func.to_char(column, postgresql_format)
+    return sa.func.strftime(sqlite_format, column)
+
+
+def _backfill_sales_rollup():
+    sale = sa.table('sale', sa.column('id'), sa.column('timestamp'), sa.column('product_id'),
+                    sa.column('payment_type'), sa.column('total_price'), sa.column('cost_price'),
+                    sa.column('quantity'))
+    rollup = sa.table('sales_rollup', *(sa.column(c) for c in (
+        'period', 'bucket', 'product_id', 'payment_type', 'revenue', 'cogs', 'quantity', 'sale_count')))
+    for period in BUCKET_FORMATS:
+        bucket = _bucket(sale.c.timestamp, period)
+        payment_type = sa.func.coalesce(sale.c.payment_type, '')
+        select = sa.select(
+            sa.literal(period), bucket, sale.c.product_id, payment_type,
+            sa.func.coalesce(sa.func.sum(sale.c.total_price), 0),
+            sa.func.coalesce(sa.func.sum(sale.c.cost_price * sale.c.quantity), 0),
+            sa.func.coalesce(sa.func.sum(sale.c.quantity), 0),
+            sa.func.count(sale.c.id),
+        ).where(
+            sale.c.timestamp.isnot(None), sale.c.product_id.isnot(None)
+        ).group_by(bucket, sale.c.product_id, payment_type)
+        op.execute(rollup.insert().from_select([c.name for c in rollup.c], select))
+
+
+def _backfill_expense_rollup():
+    expense = sa.table('expense', sa.column('id'), sa.column('expense_date'), sa.column('amount'))
+    rollup = sa.table('expense_rollup', *(sa.column(c) for c in ('period', 'bucket', 'amount', 'expense_count')))
+    for period in BUCKET_FORMATS:
+        bucket = _bucket(expense.c.expense_date, period)
+        select = sa.select(
+            sa.literal(period), bucket,
+            sa.func.coalesce(sa.func.sum(expense.c.amount), 0),
+            sa.func.count(expense.c.id),
+        ).where(expense.c.expense_date.isnot(None)).group_by(bucket)
+        op.execute(rollup.insert().from_select([c.name for c in rollup.c], select))
+
+
+def upgrade():
+    tables = _existing_tables()
+
+    if 'sales_rollup' not in tables:
+        op.create_table(
+            'sales_rollup',
+            sa.Column('id', sa.Integer(), nullable=False),
+            sa.Column('period', sa.String(length=5), nullable=False),
+            sa.Column('bucket', sa.String(length=10), nullable=False),
+            sa.Column('product_id', sa.Integer(), nullable=False),
+            sa.Column('payment_type', sa.String(length=50), nullable=False),
+            sa.Column('revenue', sa.Float(), nullable=False),
+            sa.Column('cogs', sa.Float(), nullable=False),
+            sa.Column('quantity', sa.Integer(), nullable=False),
+            sa.Column('sale_count', sa.Integer(), nullable=False),
+            sa.PrimaryKeyConstraint('id'),
+            sa.UniqueConstraint('period', 'bucket', 'product_id', 'payment_type', name='uq_sales_rollup_key')
+        )
+        _backfill_sales_rollup()
+    if 'expense_rollup' not in tables:
+        op.create_table(
+            'expense_rollup',
+            sa.Column('id', sa.Integer(), nullable=False),
+            sa.Column('period', sa.String(length=5), nullable=False),
+            sa.Column('bucket', sa.String(length=10), nullable=False),
+            sa.Column('amount', sa.Float(), nullable=False),
+            sa.Column('expense_count', sa.Integer(), nullable=False),
+            sa.PrimaryKeyConstraint('id'),
+            sa.UniqueConstraint('period', 'bucket', name='uq_expense_rollup_key')
+        )
+        _backfill_expense_rollup()
+
+    for name, table, columns in INDEXES:
+        if name not in _existing_indexes(table):
+            op.create_index(name, table, columns)
+
+    # The inspector does not report expression indexes on SQLite
+    op.execute('CREATE INDEX IF NOT EXISTS ix_product_name_lower ON product (lower(name))')
+
+
+def downgrade():
+    op.drop_index('ix_product_name_lower', table_name='product')
+    for name, table, _ in reversed(INDEXES):
+        op.drop_index(name, table_name=table)
+    op.drop_table('expense_rollup')
+    op.drop_table('sales_rollup')
@@ -0,0 +1,34 @@
+"""sync shadow digests for delta pushes
+
+Revision ID: 5d0b8e3f7a19
+Revises: c7e9f1a24d68
+Create Date: 2026-10-17 12:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5d0b8e3f7a19'
+down_revision = 'c7e9f1a24d68'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    if 'sync_shadow' in sa.inspect(op.get_bind()).get_table_names():
+        return
+    op.create_table(
+        'sync_shadow',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('model_name', sa.String(length=40), nullable=False),
+        sa.Column('uuid', sa.String(length=36), nullable=False),
+        sa.Column('digests', sa.Text(), nullable=False),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('model_name', 'uuid', name='uq_sync_shadow_row')
+    )
+
+
+def downgrade():
+    op.drop_table('sync_shadow')
@@ -0,0 +1,31 @@
+"""sync push checkpoint
+
+Revision ID: 8b41d7e2c5a3
+Revises: 3f2a1c9d0b7e
+Create Date: 2026-10-17 10:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8b41d7e2c5a3'
+down_revision = '3f2a1c9d0b7e'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    columns = {c['name'] for c in sa.inspect(op.get_bind()).get_columns('sync_meta')}
+    with op.batch_alter_table('sync_meta') as batch_op:
+        if 'push_cursor' not in columns:
+            batch_op.add_column(sa.Column('push_cursor', sa.Integer(), nullable=True))
+        if 'push_started' not in columns:
+            batch_op.add_column(sa.Column('push_started', sa.DateTime(), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('sync_meta') as batch_op:
+        batch_op.drop_column('push_started')
+        batch_op.drop_column('push_cursor')
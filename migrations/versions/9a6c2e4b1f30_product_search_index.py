@@ -0,0 +1,51 @@
+"""product full-text search index (SQLite FTS5 trigram)
+
+Revision ID: 9a6c2e4b1f30
+Revises: 5d0b8e3f7a19
+Create Date: 2026-10-17 12:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9a6c2e4b1f30'
+down_revision = '5d0b8e3f7a19'
+branch_labels = None
+depends_on = None
+
+# Copy of utils.product_search.FTS_DDL at this revision
+FTS_DDL = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS product_fts USING fts5("
+    "name, barcode, content='product', content_rowid='id', tokenize='trigram')",
+    """CREATE TRIGGER IF NOT EXISTS product_fts_ai AFTER INSERT ON product BEGIN
+        INSERT INTO product_fts(rowid, name, barcode) VALUES (new.id, new.name, new.barcode);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS product_fts_ad AFTER DELETE ON product BEGIN
+        INSERT INTO product_fts(product_fts, rowid, name, barcode) VALUES ('delete', old.id, old.name, old.barcode);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS product_fts_au AFTER UPDATE OF name, barcode ON product BEGIN
+        INSERT INTO product_fts(product_fts, rowid, name, barcode) VALUES ('delete', old.id, old.name, old.barcode);
+        INSERT INTO product_fts(rowid, name, barcode) VALUES (new.id, new.name, new.barcode);
+    END""",
+]
+
+
+def upgrade():
+    bind = op.get_bind()
+    if bind.dialect.name != 'sqlite':
+        return  # other backends search with ILIKE
+    if 'product_fts' in sa.inspect(bind).get_table_names():
+        return
+    for statement in FTS_DDL:
+        op.execute(statement)
+    op.execute("INSERT INTO product_fts(product_fts) VALUES ('rebuild')")
+
+
+def downgrade():
+    if op.get_bind().dialect.name != 'sqlite':
+        return
+    for trigger in ('product_fts_ai', 'product_fts_ad', 'product_fts_au'):
+        op.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+    op.execute("DROP TABLE IF EXISTS product_fts")
@@ -0,0 +1,41 @@
+"""sync job queue
+
+Revision ID: c7e9f1a24d68
+Revises: 8b41d7e2c5a3
+Create Date: 2026-10-17 11:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c7e9f1a24d68'
+down_revision = '8b41d7e2c5a3'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    if 'sync_job' in sa.inspect(op.get_bind()).get_table_names():
+        return
+    op.create_table(
+        'sync_job',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('trigger', sa.String(length=20), nullable=False),
+        sa.Column('status', sa.String(length=20), nullable=False),
+        sa.Column('progress', sa.String(length=120), nullable=True),
+        sa.Column('created', sa.DateTime(), nullable=True),
+        sa.Column('started', sa.DateTime(), nullable=True),
+        sa.Column('finished', sa.DateTime(), nullable=True),
+        sa.Column('duration', sa.Float(), nullable=True),
+        sa.Column('stats', sa.Text(), nullable=True),
+        sa.Column('errors', sa.Text(), nullable=True),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_sync_job_status', 'sync_job', ['status'])
+
+
+def downgrade():
+    op.drop_index('ix_sync_job_status', table_name='sync_job')
+    op.drop_table('sync_job')
@@ -0,0 +1,67 @@
+"""sync change log (outbox) replaces the push table scan
+
+Revision ID: e4f1a7c3d925
+Revises: 9a6c2e4b1f30
+Create Date: 2026-10-17 14:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e4f1a7c3d925'
+down_revision = '9a6c2e4b1f30'
+branch_labels = None
+depends_on = None
+
+SYNCED_TABLES = {
+    'User': 'user',
+    'Product': 'product',
+    'Expense': 'expense',
+    'Sale': 'sale',
+    'SaleTransaction': 'sale_transaction',
+}
+
+
+def upgrade():
+    bind = op.get_bind()
+    if 'change_log' not in sa.inspect(bind).get_table_names():
+        op.create_table(
+            'change_log',
+            sa.Column('seq', sa.Integer(), nullable=False),
+            sa.Column('model_name', sa.String(length=40), nullable=False),
+            sa.Column('row_uuid', sa.String(length=36), nullable=False),
+            sa.Column('op', sa.String(length=10), nullable=False),
+            sa.Column('changed_at', sa.DateTime(), nullable=True),
+            sa.PrimaryKeyConstraint('seq'),
+            sqlite_autoincrement=True
+        )
+        op.create_index('ix_change_log_model_seq', 'change_log', ['model_name', 'seq'], unique=False)
+
+    # Queue what the old scan-based push would still have sent
+    change_log = sa.table('change_log', sa.column('model_name'), sa.column('row_uuid'), sa.column('op'))
+    sync_meta = sa.table('sync_meta', sa.column('model_name'), sa.column('last_sync'))
+    for model_name, table_name in SYNCED_TABLES.items():
+        table = sa.table(table_name, sa.column('uuid'), sa.column('synced'), sa.column('last_modified'))
+        last_sync = sa.select(sa.func.max(sync_meta.c.last_sync)).where(sync_meta.c.model_name == model_name) \
+            .scalar_subquery()
+        pending = sa.select(sa.literal(model_name), table.c.uuid, sa.literal('upsert')).where(
+            sa.or_(table.c.synced.is_not(sa.true()), table.c.last_modified > last_sync)
+        )
+        op.execute(change_log.insert().from_select(['model_name', 'row_uuid', 'op'], pending))
+
+    # push_cursor now holds a change_log seq; the pass start time is gone
+    columns = {c['name'] for c in sa.inspect(bind).get_columns('sync_meta')}
+    op.execute(sa.table('sync_meta', sa.column('push_cursor')).update().values(push_cursor=0))
+    if 'push_started' in columns:
+        with op.batch_alter_table('sync_meta') as batch_op:
+            batch_op.drop_column('push_started')
+
+
+def downgrade():
+    with op.batch_alter_table('sync_meta') as batch_op:
+        batch_op.add_column(sa.Column('push_started', sa.DateTime(), nullable=True))
+    op.execute(sa.table('sync_meta', sa.column('push_cursor')).update().values(push_cursor=0))
+    op.drop_index('ix_change_log_model_seq', table_name='change_log')
+    op.drop_table('change_log')
@@ -16,8 +16,13 @@ class User(db.Model, UserMixin):
     role = db.Column(db.String(20), nullable=False, default='user')  # roles: admin, approver, user
     is_approved = db.Column(db.Boolean, default=False)
     timestamp = db.Column(db.DateTime, default=datetime.utcnow)
-    last_modified = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    last_modified = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, index=True)
     synced = db.Column(db.Boolean, default=False)
+
+    __table_args__ = (
+        db.Index('ix_user_synced_last_modified', 'synced', 'last_modified'),
+    )
+
     def is_admin(self):
         return self.role == 'admin'
 
@@ -33,11 +38,16 @@ class Product(db.Model):
     price = db.Column(db.Float, nullable=False)
     cost_price = db.Column(db.Float, nullable=False)
     timestamp = db.Column(db.DateTime, default=datetime.utcnow)
-    last_modified = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    last_modified = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, index=True)
     synced = db.Column(db.Boolean, default=False)
     
     # Optional: Add relationship for reverse lookup
     sales = db.relationship('Sale', backref='product', lazy=True)
+
+    __table_args__ = (
+        db.Index('ix_product_synced_last_modified', 'synced', 'last_modified'),
+        db.Index('ix_product_name_lower', db.func.lower(name)),  # case-insensitive name search
+    )
     
 
 class Expense(db.Model):
@@ -45,15 +55,19 @@ class Expense(db.Model):
     uuid = db.Column(db.String(36), unique=True, default=lambda: str(uuid.uuid4()))
     description = db.Column(db.String(200), nullable=False)
     amount = db.Column(db.Float, nullable=False)
-    expense_date = db.Column(db.DateTime, nullable=False)
+    expense_date = db.Column(db.DateTime, nullable=False, index=True)
     timestamp = db.Column(db.DateTime, default=datetime.utcnow)
-    last_modified = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    last_modified = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, index=True)
     synced = db.Column(db.Boolean, default=False)
 
+    __table_args__ = (
+        db.Index('ix_expense_synced_last_modified', 'synced', 'last_modified'),
+    )
+
 class Sale(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     uuid = db.Column(db.String(36), unique=True, default=lambda: str(uuid.uuid4()))
-    product_id = db.Column(db.Integer, db.ForeignKey('product.id'), nullable=False)
+    product_id = db.Column(db.Integer, db.ForeignKey('product.id'), nullable=False, index=True)
     quantity = db.Column(db.Integer, nullable=False)
     cost_price = db.Column(db.Float, nullable=False)  # <-- Add this line
     unit_price = db.Column(db.Float, nullable=False)
@@ -62,8 +76,8 @@ class Sale(db.Model):
     customer_name = db.Column(db.String(100), nullable=True)
     payment_type = db.Column(db.String(50), nullable=True)  # e.g., Cash, Card, Mobile Money
     comments = db.Column(db.String(300), nullable=True)
-    timestamp = db.Column(db.DateTime, default=datetime.utcnow)
-    last_modified = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    timestamp = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+    last_modified = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, index=True)
     synced = db.Column(db.Boolean, default=False)
     
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'))  # Link to User
@@ -73,21 +87,117 @@ class Sale(db.Model):
     transaction_id = db.Column(db.Integer, db.ForeignKey('sale_transaction.id'), nullable=True)
     # The relationship now refers back as sale.sale_transaction
 
+    __table_args__ = (
+        db.Index('ix_sale_synced_last_modified', 'synced', 'last_modified'),
+        db.Index('ix_sale_transaction_id_timestamp', 'transaction_id', 'timestamp'),  # sales_list grouping, receipts
+    )
+
 class SaleTransaction(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     uuid = db.Column(db.String(36), unique=True, default=lambda: str(uuid.uuid4()))
     customer_name = db.Column(db.String(120))
     payment_type = db.Column(db.String(50))
     comments = db.Column(db.Text)
-    timestamp = db.Column(db.DateTime, default=datetime.utcnow)
-    last_modified = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    timestamp = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+    last_modified = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, index=True)
     synced = db.Column(db.Boolean, default=False)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
     user = db.relationship('User', backref='transactions')
 
     sales = db.relationship('Sale', backref='sale_transaction', lazy=True)
-    
+
+    __table_args__ = (
+        db.Index('ix_sale_transaction_synced_last_modified', 'synced', 'last_modified'),
+    )
+
 class SyncMeta(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     last_sync = db.Column(db.DateTime)
-    model_name = db.Column(db.String)  # <- This must exist if you want to access it
\ No newline at end of file
+    model_name = db.Column(db.String, index=True)  # <- This must exist if you want to access it
+    # Push cursor: highest ChangeLog.seq of this model acknowledged by the server
+    push_cursor = db.Column(db.Integer, default=0)
+
+class SyncShadow(db.Model):
+    """
+    Per-column digests of each row as last pushed, used to send
+    field-level deltas (utils/sync_codec.py).
+    """
+    id = db.Column(db.Integer, primary_key=True)
+    model_name = db.Column(db.String(40), nullable=False)
+    uuid = db.Column(db.String(36), nullable=False)
+    digests = db.Column(db.Text, nullable=False)  # JSON list of CRC32s, one per column
+
+    __table_args__ = (
+        db.UniqueConstraint('model_name', 'uuid', name='uq_sync_shadow_row'),
+    )
+
+
+class ChangeLog(db.Model):
+    """
+    Outbox of local changes to the synced models, in commit order (see
+    utils/change_log.py). `seq` is AUTOINCREMENT so it is never reused
+    after acknowledged entries are deleted.
+    """
+    seq = db.Column(db.Integer, primary_key=True)
+    model_name = db.Column(db.String(40), nullable=False)
+    row_uuid = db.Column(db.String(36), nullable=False)
+    op = db.Column(db.String(10), nullable=False, default='upsert')  # upsert, delete (tombstone)
+    changed_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        db.Index('ix_change_log_model_seq', 'model_name', 'seq'),
+        {'sqlite_autoincrement': True},
+    )
+
+
+class SyncJob(db.Model):
+    """
+    A queued or finished background sync run (see utils/sync_worker.py).
+    """
+    id = db.Column(db.Integer, primary_key=True)
+    trigger = db.Column(db.String(20), nullable=False, default='manual')  # manual, auto
+    status = db.Column(db.String(20), nullable=False, default='queued', index=True)  # queued, running, done, failed
+    progress = db.Column(db.String(120))
+    created = db.Column(db.DateTime, default=datetime.utcnow)
+    started = db.Column(db.DateTime)
+    finished = db.Column(db.DateTime)
+    duration = db.Column(db.Float)
+    stats = db.Column(db.Text)    # JSON: {"push": {model: {...}}, "pull": {model: {...}}}
+    errors = db.Column(db.Text)   # JSON: {"push": {model: error}, "pull": {model: error}}
+
+
+class SalesRollup(db.Model):
+    """
+    Pre-aggregated sales per day/month bucket, product and payment type.
+    Maintained by utils/rollups.py on every flush that touches a Sale.
+    """
+    __tablename__ = 'sales_rollup'
+    id = db.Column(db.Integer, primary_key=True)
+    period = db.Column(db.String(5), nullable=False)    # 'day' or 'month'
+    bucket = db.Column(db.String(10), nullable=False)   # '2025-01-31' or '2025-01'
+    product_id = db.Column(db.Integer, nullable=False)
+    payment_type = db.Column(db.String(50), nullable=False, default='')
+    revenue = db.Column(db.Float, nullable=False, default=0)
+    cogs = db.Column(db.Float, nullable=False, default=0)
+    quantity = db.Column(db.Integer, nullable=False, default=0)
+    sale_count = db.Column(db.Integer, nullable=False, default=0)
+
+    __table_args__ = (
+        db.UniqueConstraint('period', 'bucket', 'product_id', 'payment_type', name='uq_sales_rollup_key'),
+    )
+
+
+class ExpenseRollup(db.Model):
+    """
+    Pre-aggregated expenses per day/month bucket.
+    """
+    __tablename__ = 'expense_rollup'
+    id = db.Column(db.Integer, primary_key=True)
+    period = db.Column(db.String(5), nullable=False)
+    bucket = db.Column(db.String(10), nullable=False)
+    amount = db.Column(db.Float, nullable=False, default=0)
+    expense_count = db.Column(db.Integer, nullable=False, default=0)
+
+    __table_args__ = (
+        db.UniqueConstraint('period', 'bucket', name='uq_expense_rollup_key'),
+    )
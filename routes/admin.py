@@ -1,8 +1,9 @@
-from flask import Blueprint, render_template, redirect, url_for, flash, request
+from flask import Blueprint, render_template, redirect, url_for, flash, request, Response
 from werkzeug.security import generate_password_hash, check_password_hash
 from flask_login import login_required
 from models import db, User
 from utils.decorators import admin_required, approver_required
+from utils.metrics import metrics
 
 bp = Blueprint('admin', __name__)
 
@@ -78,4 +79,12 @@ def edit_user(user_id):
 
         return redirect(url_for('admin.manage_users'))
     
-    return render_template('admin_edit_user.html', user=user)
\ No newline at end of file
+    return render_template('admin_edit_user.html', user=user)
+
+
+@bp.route('/metrics')
+@login_required
+@admin_required
+def metrics_page():
+    """Request, SQL and job timings in Prometheus text format."""
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
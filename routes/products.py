@@ -1,7 +1,12 @@
-from flask import Blueprint, render_template, redirect, url_for, flash, request, jsonify, current_app
+from flask import Blueprint, render_template, redirect, url_for, flash, request, jsonify, current_app, send_file, abort
 from flask_login import login_required, current_user
 from models import db, Product
-from utils.barcode import generate_barcode
+from utils.barcode import barcode_image, cache_key, can_encode, SIZES
+from utils.catalog import catalog
+from utils.decorators import admin_required
+from utils.product_import import import_products
+from utils.product_search import search_product_ids
+import tempfile
 import uuid
 import os
 
@@ -10,11 +15,12 @@ bp = Blueprint('product', __name__)
 @bp.route('/products')
 @login_required
 def index():
-    search = request.args.get('q')
+    search = request.args.get('q', '').strip()
+    snapshot = catalog.snapshot()
     if search:
-        products = Product.query.filter(Product.name.ilike(f"%{search}%")).all()
+        products = [snapshot.by_id[i] for i in search_product_ids(search) if i in snapshot.by_id]
     else:
-        products = Product.query.all()
+        products = snapshot.products
     low_stock_products = [p for p in products if p.quantity < 20]  # Set threshold as needed
     return render_template('index.html', products=products, low_stock_products=low_stock_products)
 
@@ -41,27 +47,45 @@ def add_product():
         db.session.add(new_product)
         db.session.commit()
 
-        # Generate barcode
-        barcode_path = generate_barcode(barcode_value)
-
-        # ✅ Ensure barcode image exists before rendering
-        abs_path = os.path.join(current_app.root_path, 'static', 'barcodes', f'{barcode_value}.png')
-        barcode_exists = os.path.exists(abs_path)
-
+        # The image itself is rendered on first request (barcode_png)
         return render_template(
             'add_success.html',
             barcode_value=barcode_value,
             product=new_product,
-            barcode_exists=barcode_exists,
+            barcode_exists=_barcode_renderable(barcode_value),
             from_view=False
         )
 
     return render_template('add_product.html')
 
+def _barcode_renderable(value):
+    return bool(value) and can_encode(value)
+
+
+@bp.route('/barcodes/<symbology>/<size>/<path:value>.png')
+@login_required
+def barcode_png(symbology, size, value):
+    """
+    Barcode image, rendered on first request. The URL fully determines the
+    image, so it can be cached by the browser (and any proxy) for a year.
+    Only product barcodes are rendered, so the cache cannot be filled with
+    arbitrary values.
+    """
+    if size not in SIZES or catalog.by_barcode(value) is None:
+        abort(404)
+    try:
+        path = barcode_image(value, symbology, size)
+    except ValueError:
+        abort(404)
+    response = send_file(path, mimetype='image/png', max_age=365 * 24 * 3600, etag=cache_key(value, symbology, size))
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
+
+
 @bp.route('/product/<barcode_value>/barcode')
 def view_barcode(barcode_value):
-    barcode_path = os.path.join('static', 'barcodes', f'{barcode_value}.png')
-    barcode_exists = os.path.exists(barcode_path)
+    barcode_exists = _barcode_renderable(barcode_value)
 
     product = Product.query.filter_by(barcode=barcode_value).first()
 
@@ -97,9 +121,6 @@ def edit_product(id):
 
         product.barcode = input_barcode
 
-        # ✅ Generate barcode image before saving
-        generate_barcode(input_barcode)
-
         db.session.commit()
         flash("Product edited successfully", "success")
         return redirect(url_for('product.index'))
@@ -116,26 +137,84 @@ def delete_product(id):
     flash("Product deleted successfully", "success")
     return redirect(url_for('product.index'))
 
+def _barcode_json(product):
+    return {
+        'id': product.id,
+        'name': product.name,
+        'price': product.price,
+        'cost_price': product.cost_price,
+        'quantity': product.quantity
+    }
+
+
 @bp.route('/product/barcode/<barcode>')
 @login_required
 def get_product_by_barcode(barcode):
-    product = Product.query.filter_by(barcode=barcode).first()
+    product = catalog.by_barcode(barcode)
     if not product:
         return jsonify({'error': 'Product not found'}), 404
 
-    return jsonify({
-        'id': product.id,
-        'name': product.name,
-        'price': product.price,
-        'cost_price': product.cost_price,
-        'quantity': product.quantity
-    })
-    
+    return jsonify(_barcode_json(product))
+
+
+@bp.route('/product/barcodes', methods=['POST'])
+@login_required
+def get_products_by_barcodes():
+    """
+    Resolve many barcodes in one request: {"barcodes": [...]} ->
+    {"products": {barcode: product}, "missing": [...]}.
+    """
+    barcodes = (request.get_json(silent=True) or {}).get('barcodes') or []
+    if not isinstance(barcodes, list):
+        return jsonify({'error': 'barcodes must be a list'}), 400
+
+    index = catalog.snapshot().by_barcode
+    products, missing = {}, []
+    for barcode in barcodes:
+        product = index.get(barcode)
+        if product:
+            products[barcode] = _barcode_json(product)
+        else:
+            missing.append(barcode)
+    return jsonify({'products': products, 'missing': missing})
+
+
+@bp.route('/product/barcodes.json')
+@login_required
+def barcode_index():
+    """
+    The whole barcode index for client-side scanning, revalidated with an
+    ETag so an unchanged catalog costs a 304.
+    """
+    index, etag = catalog.snapshot().barcode_index()
+    response = jsonify({'version': etag, 'barcodes': index})
+    response.set_etag(etag)
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
+
+
+
+@bp.route('/products/search')
+@login_required
+def search_products():
+    """
+    Typeahead: ?q=text&limit=n -> {"products": [...]} ranked best first
+    (exact barcode, then name prefix, then other substring matches).
+    """
+    search = request.args.get('q', '').strip()
+    limit = min(request.args.get('limit', 10, type=int) or 10, 50)
+    if not search:
+        return jsonify({'products': []})
+    snapshot = catalog.snapshot()
+    products = [snapshot.by_id[i] for i in search_product_ids(search, limit) if i in snapshot.by_id]
+    return jsonify({'products': [dict(_barcode_json(p), barcode=p.barcode) for p in products]})
+
 
 @bp.route('/restock', methods=['GET', 'POST'])
 @login_required
 def restock_product():
-    products = Product.query.all()
+    products = catalog.products()
     if request.method == 'POST':
         product_id = int(request.form['product_id'])
         additional_quantity = int(request.form['quantity'])
@@ -148,4 +227,69 @@ def restock_product():
         flash("Product restocked successfully!", "success")
         return redirect(url_for('index'))
 
-    return render_template('restock_product.html', products=products)
\ No newline at end of file
+    return render_template('restock_product.html', products=products)
+
+
+@bp.route('/products/catalog/stats')
+@login_required
+@admin_required
+def catalog_stats():
+    return jsonify(catalog.stats())
+
+
+def _import_dir():
+    path = os.path.join(current_app.instance_path, 'imports')
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+@bp.route('/products/import', methods=['GET', 'POST'])
+@login_required
+@admin_required
+def import_products_view():
+    """
+    Bulk add/restock products from a CSV or XLSX file.
+    """
+    result = None
+    if request.method == 'POST':
+        file = request.files.get('file')
+        if not file or not file.filename.lower().endswith(('.csv', '.xlsx')):
+            flash("Please upload a .csv or .xlsx file.", "danger")
+            return redirect(url_for('product.import_products_view'))
+
+        token = uuid.uuid4().hex
+        fd, upload = tempfile.mkstemp(suffix=os.path.splitext(file.filename)[1].lower(), dir=_import_dir())
+        os.close(fd)
+        try:
+            file.save(upload)
+            result = import_products(
+                upload,
+                stock_mode=request.form.get('stock_mode', 'add'),
+                error_report=os.path.join(_import_dir(), f'{token}-errors.csv'),
+            )
+        except Exception as e:
+            current_app.logger.exception("Product import failed")
+            flash(f"Import failed: {e}", "danger")
+            return redirect(url_for('product.import_products_view'))
+        finally:
+            os.remove(upload)
+
+        result['token'] = token
+        current_app.logger.info("Product import: %s", result)
+        flash(f"Imported {result['rows']} rows: {result['inserted']} added, {result['updated']} updated, "
+              f"{result['failed']} rejected ({result['rows_per_sec']} rows/s)",
+              "success" if not result['failed'] else "warning")
+
+    return render_template('import_products.html', result=result)
+
+
+@bp.route('/products/import/errors/<token>.csv')
+@login_required
+@admin_required
+def import_errors(token):
+    if not token.isalnum():
+        abort(404)
+    path = os.path.join(_import_dir(), f'{token}-errors.csv')
+    if not os.path.exists(path):
+        abort(404)
+    return send_file(path, mimetype='text/csv', as_attachment=True, download_name='import_errors.csv')
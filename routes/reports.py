@@ -1,9 +1,14 @@
-from flask import Blueprint, render_template, redirect, url_for, flash, send_file, request
-from models import db, Expense, Product, Sale, User
+from flask import Blueprint, render_template, redirect, url_for, flash, send_file, request, Response, \
+    stream_with_context, stream_template, get_flashed_messages
+from models import db, Expense, Product, Sale, User, SalesRollup
+from utils.rollups import sales_breakdown
+from utils.metrics import metrics
+from utils.xlsx_stream import stream_xlsx
 import pandas as pd
 from utils.decorators import admin_required, approver_required
 from flask_login import login_required
 from datetime import datetime, timedelta
+import csv
 import io
 
 bp = Blueprint('report', __name__)
@@ -12,16 +17,82 @@ bp = Blueprint('report', __name__)
 @bp.route('/export/products')
 @login_required
 def export_products():
-    products = Product.query.all()
-    data = [{'Name': p.name, 'Quantity': p.quantity, 'Price': p.price} for p in products]
-    df = pd.DataFrame(data)
-    output = io.BytesIO()
-    with pd.ExcelWriter(output, engine='openpyxl') as writer:
-        df.to_excel(writer, index=False, sheet_name='Products')
-    output.seek(0)
+    with metrics.time_job('export_products_xlsx'):
+        products = Product.query.all()
+        data = [{'Name': p.name, 'Quantity': p.quantity, 'Price': p.price} for p in products]
+        df = pd.DataFrame(data)
+        output = io.BytesIO()
+        with pd.ExcelWriter(output, engine='openpyxl') as writer:
+            df.to_excel(writer, index=False, sheet_name='Products')
+        output.seek(0)
     flash("Products exported successfully!", "success")
     return send_file(output, as_attachment=True, download_name='products.xlsx', mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
 
+SALES_EXPORT_HEADER = ['Sale Id', 'Transaction ID', 'Product', 'Quantity', 'Unit Price', 'Total Price',
+                       'Customer Name', 'Payment Type', 'Comments', 'Sold By', 'Timestamp']
+EXPORT_BATCH_SIZE = 1000
+
+
+def _sales_export_query(start_date=None, end_date=None):
+    """
+    Sale columns of the exports with product name and username joined in,
+    limited to the date range (end_date counts as a whole day).
+    """
+    query = db.session.query(
+        Sale.id, Sale.transaction_id, Product.name, Sale.quantity, Sale.unit_price, Sale.total_price,
+        Sale.customer_name, Sale.payment_type, Sale.comments, User.username, Sale.timestamp
+    ).outerjoin(Product, Sale.product_id == Product.id).outerjoin(User, Sale.user_id == User.id)
+
+    if start_date:
+        query = query.filter(Sale.timestamp >= start_date)
+    if end_date:
+        query = query.filter(Sale.timestamp < end_date + timedelta(days=1))
+    return query
+
+
+def _sales_export_rows(start_date=None, end_date=None):
+    """
+    Yield one list per sale for the export, read with a single joined query
+    in batches of EXPORT_BATCH_SIZE so memory stays flat for any date range.
+    """
+    query = _sales_export_query(start_date, end_date)
+    for row in query.order_by(Sale.id).execution_options(yield_per=EXPORT_BATCH_SIZE):
+        yield [
+            row.id,
+            row.transaction_id,
+            row.name or 'Unknown',
+            row.quantity,
+            row.unit_price,
+            row.total_price,
+            row.customer_name,
+            row.payment_type,
+            row.comments,
+            row.username or 'N/A',
+            row.timestamp.strftime('%Y-%m-%d %H:%M:%S') if row.timestamp else ''
+        ]
+
+
+def _stream_csv(rows):
+    # Timed until the last chunk is sent, i.e. the whole export
+    with metrics.time_job('export_sales_csv'):
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(SALES_EXPORT_HEADER)
+        for i, row in enumerate(rows, start=1):
+            writer.writerow(row)
+            if i % EXPORT_BATCH_SIZE == 0:
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+        yield buffer.getvalue()
+
+
+def _stream_sales_xlsx(rows):
+    # Timed until the last chunk is sent, i.e. the whole export
+    with metrics.time_job('export_sales_xlsx'):
+        yield from stream_xlsx(SALES_EXPORT_HEADER, rows, 'Sales')
+
+
 @bp.route('/export/sales')
 @login_required
 def export_sales():
@@ -34,37 +105,23 @@ def export_sales():
     except ValueError:
         start_date = end_date = None
 
-    sales_query = Sale.query
-    if start_date:
-        sales_query = sales_query.filter(Sale.timestamp >= start_date)
-    if end_date:
-        sales_query = sales_query.filter(Sale.timestamp < end_date + timedelta(days=1))
-
-    sales = sales_query.all()
-    data = []
-    for sale in sales:
-        product = Product.query.get(sale.product_id)
-        data.append({
-            'Sale Id': sale.id,
-            'Transaction ID': sale.transaction_id,  # ✅ Add this line
-            'Product': product.name if product else 'Unknown',
-            'Quantity': sale.quantity,
-            'Unit Price': sale.unit_price,
-            'Total Price': sale.total_price,
-            'Customer Name': sale.customer_name,
-            'Payment Type': sale.payment_type,
-            'Comments': sale.comments,
-            'Sold By': sale.user.username if sale.user else 'N/A',
-            'Timestamp': sale.timestamp.strftime('%Y-%m-%d %H:%M:%S')
-        })
-
-    df = pd.DataFrame(data)
-    output = io.BytesIO()
-    with pd.ExcelWriter(output, engine='openpyxl') as writer:
-        df.to_excel(writer, index=False, sheet_name='Sales')
-    output.seek(0)
     flash("Selected sales exported successfully!", "success")
-    return send_file(output, as_attachment=True, download_name='sales.xlsx', mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
+    rows = _sales_export_rows(start_date, end_date)
+
+    if request.args.get('format') == 'csv':
+        return Response(
+            stream_with_context(_stream_csv(rows)),
+            mimetype='text/csv',
+            headers={'Content-Disposition': 'attachment; filename=sales.csv'}
+        )
+
+    # Rows are written into the zipped sheet and sent as they are read:
+    # no temp file, and the download starts before the query finishes
+    return Response(
+        stream_with_context(_stream_sales_xlsx(rows)),
+        mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+        headers={'Content-Disposition': 'attachment; filename=sales.xlsx'}
+    )
 
 
 @bp.route('/export')
@@ -81,33 +138,34 @@ def export_reports():
     except ValueError:
         start_date = end_date = None  # Ignore bad format
 
-    # Base query
-    sales_query = Sale.query
-
-    # Apply date filter if available
-    if start_date:
-        sales_query = sales_query.filter(Sale.timestamp >= start_date)
-    if end_date:
-        # To include the end_date whole day, add one day and use less than that
-        sales_query = sales_query.filter(Sale.timestamp < end_date + timedelta(days=1))
-
-    #Order by latest first
-    sales_query = sales_query.order_by(Sale.timestamp.desc(), Sale.id.desc())
-    sales = sales_query.all()
-
-    sales_data = []
-    for s in sales:
-        product = Product.query.get(s.product_id)
-        sales_data.append({
-            'id': s.id,
-            'transaction_id': s.transaction_id,
-            'product_name': product.name if product else "Unknown Product",
-            'quantity': s.quantity,
-            'unit_price': s.unit_price,
-            'total_price': s.total_price,
-            'comments': s.comments,
-            'username': s.user.username if s.user else '',
-            'timestamp': s.timestamp.strftime("%Y-%m-%d") if s.timestamp else ''
-        })
-
-    return render_template('export_reports.html', sales=sales_data, start_date=start_date_str or '', end_date=end_date_str or '')
+    # Latest first, read in batches while the page is sent: the same
+    # streamed query as the downloads
+    sales_query = _sales_export_query(start_date, end_date) \
+        .order_by(Sale.timestamp.desc(), Sale.id.desc()) \
+        .execution_options(yield_per=EXPORT_BATCH_SIZE)
+    sales = ({
+        'id': row.id,
+        'transaction_id': row.transaction_id,
+        'product_name': row.name or "Unknown Product",
+        'quantity': row.quantity,
+        'unit_price': row.unit_price,
+        'total_price': row.total_price,
+        'comments': row.comments,
+        'username': row.username or '',
+        'timestamp': row.timestamp.strftime("%Y-%m-%d") if row.timestamp else ''
+    } for row in sales_query)
+
+    # Period summary straight from the rollup tables
+    product_names = dict(db.session.query(Product.id, Product.name).all())
+    product_summary = [
+        {'name': product_names.get(row.key, "Unknown Product"), 'quantity': row.quantity,
+         'revenue': row.revenue, 'cogs': row.cogs}
+        for row in sales_breakdown(SalesRollup.product_id, start_date, end_date)
+    ]
+    payment_summary = sales_breakdown(SalesRollup.payment_type, start_date, end_date)
+
+    # The session is saved before the body streams: take the flashes now
+    get_flashed_messages()
+    return Response(stream_template('export_reports.html', sales=sales, start_date=start_date_str or '',
+                                    end_date=end_date_str or '', product_summary=product_summary,
+                                    payment_summary=payment_summary))
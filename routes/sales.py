@@ -1,102 +1,144 @@
-from flask import Blueprint, render_template, redirect, url_for, flash, abort, request
+from flask import Blueprint, render_template, redirect, url_for, flash, abort, request, jsonify
 from flask_login import login_required, current_user
 from models import db, Product, Sale, SaleTransaction
 from utils.decorators import admin_required, approver_required
+from utils.checkout import checkout, parse_cart, CheckoutError
+from utils.catalog import catalog
+from utils.product_search import matching_ids_query
+from sqlalchemy.orm import joinedload
 from collections import defaultdict
 
 bp = Blueprint('sales', __name__)
 
 
-@bp.route('/sales')
-@login_required
-def sales_list():
-    search = request.args.get('q', '').strip()
-    sales_query = Sale.query.join(Product, Sale.product_id == Product.id)
-
+SALES_PAGE_SIZE = 50
+
+
+def _sale_row(s):
+    return {
+        'id': s.id,
+        'product_name': s.product.name if s.product else "Unknown",
+        'quantity': s.quantity,
+        'unit_price': s.unit_price,
+        'total_price': s.total_price,
+        'customer_name': s.customer_name,
+        'payment_type': s.payment_type,
+        'comments': s.comments,
+        'timestamp': s.timestamp,
+        'username': s.user.username if s.user else "-",
+    }
+
+
+def _sales_page(search='', cursor='', limit=SALES_PAGE_SIZE):
+    """
+    One page of the sales list, newest first: whole transactions, then the
+    sales that belong to no transaction, one row each. Keyset paginated on
+    SaleTransaction.id and then Sale.id so every page costs the same few
+    queries however long the history is. The cursor is the last transaction
+    id, or 's' plus the last lone sale id once the transactions have run
+    out. Returns (grouped_sales, transaction_info, lone_sales, next_cursor).
+    """
     if search:
+        sale_filter = Sale.product_id.in_(matching_ids_query(search))
         if search.isdigit():
-            sales_query = sales_query.filter(
-                (Sale.transaction_id == int(search)) |
-                (Product.name.ilike(f"%{search}%"))
-            )
-        else:
-            sales_query = sales_query.filter(Product.name.ilike(f"%{search}%"))
-
-    sales_query = sales_query.order_by(Sale.transaction_id.desc(), Sale.timestamp.desc())
-    sales = sales_query.all()
+            sale_filter = (Sale.transaction_id == int(search)) | sale_filter
+    else:
+        sale_filter = None
+    lone_only = cursor.startswith('s')
+    after = cursor[1:] if lone_only else cursor
+    after = int(after) if after.isdigit() else None
+
+    transactions, next_cursor = [], None
+    if not lone_only:
+        tx_query = SaleTransaction.query.options(joinedload(SaleTransaction.user))
+        tx_query = tx_query.filter(
+            SaleTransaction.sales.any(sale_filter) if sale_filter is not None else SaleTransaction.sales.any()
+        )
+        if after:
+            tx_query = tx_query.filter(SaleTransaction.id < after)
+        transactions = tx_query.order_by(SaleTransaction.id.desc()).limit(limit + 1).all()
+        if len(transactions) > limit:
+            transactions = transactions[:limit]
+            next_cursor = str(transactions[-1].id)
+    transaction_info = {t.id: t for t in transactions}
 
-    # Group by transaction_id
     grouped_sales = defaultdict(list)
-    for s in sales:
-        grouped_sales[s.transaction_id].append({
-            'id': s.id,
-            'product_name': s.product.name if s.product else "Unknown",
-            'quantity': s.quantity,
-            'unit_price': s.unit_price,
-            'total_price': s.total_price,
-            'customer_name': s.customer_name,
-            'payment_type': s.payment_type,
-            'comments': s.comments,
-            'timestamp': s.timestamp,
-            'username': s.user.username if s.user else "-",
-        })
-
-    # Optional: Get transaction info per transaction_id
-    transactions = SaleTransaction.query.filter(SaleTransaction.id.in_(grouped_sales.keys())).all()
-    transaction_info = {t.id: t for t in transactions}
+    if transactions:
+        sales_query = Sale.query.options(joinedload(Sale.product), joinedload(Sale.user)) \
+            .filter(Sale.transaction_id.in_(transaction_info.keys()))
+        if sale_filter is not None:
+            sales_query = sales_query.filter(sale_filter)
+        # Group by transaction_id
+        for s in sales_query.order_by(Sale.transaction_id.desc(), Sale.timestamp.desc()):
+            grouped_sales[s.transaction_id].append(_sale_row(s))
+
+    # Sales without a transaction come after every transaction, in the
+    # room this page has left (none if the transactions filled it, but one
+    # is still looked for so the cursor can point at them)
+    lone_sales = []
+    if next_cursor is None:
+        room = limit - len(transactions)
+        lone_query = Sale.query.options(joinedload(Sale.product), joinedload(Sale.user)) \
+            .filter(Sale.transaction_id.is_(None))
+        if sale_filter is not None:
+            lone_query = lone_query.filter(sale_filter)
+        if lone_only and after:
+            lone_query = lone_query.filter(Sale.id < after)
+        lone = lone_query.order_by(Sale.id.desc()).limit(room + 1).all()
+        if len(lone) > room:
+            next_cursor = f's{lone[room - 1].id}' if room else 's'
+        lone_sales = [_sale_row(s) for s in lone[:room]]
+
+    return grouped_sales, transaction_info, lone_sales, next_cursor
 
-    return render_template('sales_list.html', grouped_sales=grouped_sales, transaction_info=transaction_info)
+
+@bp.route('/sales')
+@login_required
+def sales_list():
+    search = request.args.get('q', '').strip()
+    grouped_sales, transaction_info, lone_sales, next_cursor = _sales_page(search)
+    return render_template('sales_list.html', grouped_sales=grouped_sales, transaction_info=transaction_info,
+                           lone_sales=lone_sales, next_cursor=next_cursor, search=search)
+
+@bp.route('/sales/more')
+@login_required
+def sales_list_more():
+    """
+    "Load more" for the sales list: the next page of rows plus its cursor.
+    """
+    search = request.args.get('q', '').strip()
+    cursor = request.args.get('cursor', '')
+    grouped_sales, transaction_info, lone_sales, next_cursor = _sales_page(search, cursor)
+    html = render_template('_sales_rows.html', grouped_sales=grouped_sales, transaction_info=transaction_info,
+                           lone_sales=lone_sales)
+    return jsonify({'html': html, 'next_cursor': next_cursor})
 
 @bp.route('/sale', methods=['GET', 'POST'])
 @login_required
 def record_sale():
-    products = Product.query.all()
+    products = catalog.products()
     if request.method == 'POST':
-        product_ids = request.form.getlist('product_id[]')
-        quantities = request.form.getlist('quantity[]')
-        cost_prices = request.form.getlist('cost_price[]')
-        unit_prices = request.form.getlist('unit_price[]')
-
         customer_name = request.form.get('customer_name', '').strip()
         payment_type = request.form.get('payment_type', 'Cash')
         comments = request.form.get('comments', '').strip()
 
-        # Create the transaction header
-        transaction = SaleTransaction(
-            customer_name=customer_name or None,
-            payment_type=payment_type,
-            comments=comments or None,
-            user_id=current_user.id
-        )
-        db.session.add(transaction)
-        db.session.flush()  # Flush to get transaction.id
-
-        for i in range(len(product_ids)):
-            product = Product.query.get_or_404(int(product_ids[i]))
-            quantity = int(quantities[i])
-            cost_price = float(cost_prices[i])
-            unit_price = float(unit_prices[i])
-
-            if product.quantity < quantity:
-                db.session.rollback()
-                return f"Insufficient stock for product: {product.name}", 400
-
-            sale = Sale(
-                product_id=product.id,
-                quantity=quantity,
-                cost_price=cost_price,
-                unit_price=unit_price,
-                total_price=unit_price * quantity,
-                customer_name=customer_name or None,
-                payment_type=payment_type,
-                comments=comments or None,
+        try:
+            lines = parse_cart(request.form)
+            transaction = checkout(
+                lines,
                 user_id=current_user.id,
-                transaction_id=transaction.id
+                customer_name=customer_name,
+                payment_type=payment_type,
+                comments=comments
             )
-            product.quantity -= quantity
-            db.session.add(sale)
+        except CheckoutError as e:
+            if request.accept_mimetypes.best == 'application/json':
+                return jsonify({'message': "Sale not recorded", 'failures': e.failures}), 400
+            for failure in e.failures:
+                prefix = f"Line {failure['line']}: " if failure['line'] else ""
+                flash(prefix + failure['error'], "danger")
+            return render_template('record_sale.html', products=products), 400
 
-        db.session.commit()
         flash("Sales recorded successfully!", "success")
         return redirect(url_for('sales.sales_list', transaction_id=transaction.id)) #q=transaction.id
 
@@ -127,7 +169,7 @@ def view_transaction_receipt(transaction_id):
 @admin_required
 def edit_sale(sale_id):
     sale = Sale.query.get_or_404(sale_id)
-    products = Product.query.all()
+    products = catalog.products()
 
     if request.method == 'POST':
         product_id = int(request.form['product_id'])
@@ -182,13 +224,18 @@ def edit_sale(sale_id):
 def edit_transaction(transaction_id):
     sales = Sale.query.filter_by(transaction_id=transaction_id).all()
     transaction = SaleTransaction.query.get_or_404(transaction_id)
-    products = Product.query.all()
+    products = catalog.products()
 
     if not sales:
         flash("Transaction not found.", "danger")
         return redirect(url_for('sales.sales_list'))
 
     if request.method == 'POST':
+        # Old and new products of every line in one query
+        product_ids = {sale.product_id for sale in sales}
+        product_ids |= {int(request.form.get(f'sale_{sale.id}_product_id', sale.product_id)) for sale in sales}
+        products_by_id = {p.id: p for p in Product.query.filter(Product.id.in_(product_ids))}
+
         for sale in sales:
             form_prefix = f"sale_{sale.id}"
             product_id = int(request.form.get(f'{form_prefix}_product_id', sale.product_id))
@@ -198,11 +245,13 @@ def edit_transaction(transaction_id):
             customer_name = request.form.get(f'{form_prefix}_customer_name', sale.customer_name)
             payment_type = request.form.get(f'{form_prefix}_payment_type', sale.payment_type)
 
-            product = Product.query.get_or_404(product_id)
+            product = products_by_id.get(product_id)
+            if product is None:
+                abort(404)
 
             # Stock adjustment logic
             if sale.product_id != product_id:
-                old_product = Product.query.get(sale.product_id)
+                old_product = products_by_id.get(sale.product_id)
                 if old_product:
                     old_product.quantity += sale.quantity
 
@@ -268,8 +317,11 @@ def delete_transaction(transaction_id):
         flash("Transaction not found.", "danger")
         return redirect(url_for('sales.sales_list'))
 
+    # One query for the products; a get() per line would also autoflush the
+    # previous delete each time
+    products = {p.id: p for p in Product.query.filter(Product.id.in_({s.product_id for s in sales}))}
     for sale in sales:
-        product = Product.query.get(sale.product_id)
+        product = products.get(sale.product_id)
         if product:
             product.quantity += sale.quantity
         db.session.delete(sale)
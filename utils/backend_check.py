@@ -0,0 +1,151 @@
+"""
+Run the same end-to-end checks against every supported database backend.
+
+    python -m utils.backend_check
+    python -m utils.backend_check --database-url sqlite:////tmp/check.db \
+        --database-url postgresql://postgres:pw@localhost:5432/inventory_check
+
+Each URL must point at an empty database; the default is a temporary
+SQLite file. A local PostgreSQL stand-in is enough, e.g.
+
+    docker run --rm -e POSTGRES_PASSWORD=pw -e POSTGRES_DB=inventory_check -p 5432:5432 postgres:16
+
+Every backend runs in its own process (settings are read from the
+environment when app.py is imported) and the results are printed as a
+matrix. Exits non-zero if any check fails.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import traceback
+
+CHECKS = []
+
+
+def check(fn):
+    CHECKS.append(fn)
+    return fn
+
+
+@check
+def checkout_and_rollups(app, client):
+    from models import db, Product, Sale, SalesRollup
+    from utils.rollups import rebuild_rollups, monthly_sales
+
+    for ids in ([1, 2], [2, 3, 4], [5]):
+        response = client.post('/sale', data={
+            'customer_name': 'check', 'payment_type': 'Card',
+            'product_id[]': ids, 'quantity[]': [2] * len(ids),
+            'cost_price[]': [60.0] * len(ids), 'unit_price[]': [100.0] * len(ids),
+        })
+        assert response.status_code == 302, response.status_code
+
+    with app.app_context():
+        assert db.session.get(Product, 2).quantity == 10 ** 9 - 4
+        incremental = sorted(tuple(r) for r in db.session.query(
+            SalesRollup.period, SalesRollup.bucket, SalesRollup.product_id, SalesRollup.payment_type,
+            SalesRollup.quantity, SalesRollup.sale_count))
+        rebuild_rollups()
+        rebuilt = sorted(tuple(r) for r in db.session.query(
+            SalesRollup.period, SalesRollup.bucket, SalesRollup.product_id, SalesRollup.payment_type,
+            SalesRollup.quantity, SalesRollup.sale_count))
+        assert incremental == rebuilt, "incremental rollups differ from a rebuild"
+        total = sum(row.monthly_sales for row in monthly_sales())
+        expected = db.session.query(db.func.sum(Sale.total_price)).scalar()
+        assert abs(total - expected) < 0.01, (total, expected)
+
+
+@check
+def pages(app, client):
+    for url in ('/dashboard', '/dashboard?start=2000-01-01&end=2100-01-01', '/sales', '/sales?q=Bench',
+                '/products', '/export'):
+        response = client.get(url)
+        assert response.status_code == 200, f"{url}: {response.status_code}"
+
+
+@check
+def csv_export(app, client):
+    from models import Sale
+    response = client.get('/export/sales?format=csv')
+    assert response.status_code == 200, response.status_code
+    lines = response.get_data(as_text=True).strip().splitlines()
+    with app.app_context():
+        assert len(lines) == Sale.query.count() + 1, len(lines)
+
+
+@check
+def query_plans(app, client):
+    from utils.query_plans import explain_hot_queries
+    with app.app_context():
+        assert explain_hot_queries()
+
+
+@check
+def backup(app, client):
+    from backup import write_backup
+    with app.app_context():
+        metrics = write_backup()
+    assert metrics['gz_bytes'] > 0
+    response = client.get('/backup/export')
+    assert response.status_code == 200 and response.data, response.status_code
+
+
+def run_checks(database_url):
+    """
+    Seed `database_url` and run every check. Returns {check: error or None}.
+    """
+    os.environ['DATABASE_URL'] = database_url
+    from app import app
+    from models import db
+    from utils.db_bench import seed_database
+
+    app.config['PROPAGATE_EXCEPTIONS'] = True
+    user_id = seed_database(app, db, products=20, history=500)
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['_user_id'] = str(user_id)
+        session['_fresh'] = True
+
+    results = {}
+    for fn in CHECKS:
+        try:
+            fn(app, client)
+            results[fn.__name__] = None
+        except Exception as e:
+            traceback.print_exc(file=sys.stderr)
+            results[fn.__name__] = f"{type(e).__name__}: {e}"
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--database-url', action='append', help='backend to check (repeatable)')
+    parser.add_argument('--run', help=argparse.SUPPRESS)  # child process: one backend, JSON out
+    args = parser.parse_args(argv)
+
+    if args.run:
+        print(json.dumps(run_checks(args.run)))
+        return
+
+    urls = args.database_url or ['sqlite:///' + os.path.join(tempfile.mkdtemp(prefix='backend-check-'), 'check.db')]
+    failed = False
+    for url in urls:
+        proc = subprocess.run([sys.executable, '-m', 'utils.backend_check', '--run', url],
+                              capture_output=True, text=True)
+        try:
+            results = json.loads(proc.stdout.strip().splitlines()[-1])
+        except (IndexError, ValueError):
+            results = {'setup': (proc.stderr.strip().splitlines() or ['no output'])[-1]}
+        print(url)
+        for name, error in results.items():
+            print(f"  {'FAIL' if error else 'ok  '} {name}{'  ' + error if error else ''}")
+        failed = failed or any(results.values())
+    if failed:
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
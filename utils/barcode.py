@@ -1,18 +1,121 @@
-import barcode
+"""
+Barcode images, rendered lazily and cached on disk.
+
+Images are content-addressed by (symbology, value, size): the file name is
+a hash of the three, so an image never needs to be re-rendered or
+invalidated and can be served with far-future cache headers. Files live
+under BARCODE_CACHE_DIR (default <instance>/barcodes), independent of the
+working directory.
+"""
+import hashlib
+import io
 import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+import barcode
+from barcode.errors import BarcodeError
 from barcode.writer import ImageWriter
+from flask import current_app
+
+# Code128 because it supports letters and numbers
+DEFAULT_SYMBOLOGY = 'code128'
+
+# ImageWriter options per size preset; 'screen' is the writer's defaults
+SIZES = {
+    'screen': {},
+    'label': {'module_width': 0.25, 'module_height': 8.0, 'font_size': 8, 'text_distance': 3.0, 'quiet_zone': 2.0},
+}
+
+
+def barcode_cache_dir():
+    path = current_app.config.get('BARCODE_CACHE_DIR') or os.path.join(current_app.instance_path, 'barcodes')
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def cache_key(value, symbology=DEFAULT_SYMBOLOGY, size='screen'):
+    return hashlib.sha256(f'{symbology}\0{size}\0{value}'.encode()).hexdigest()[:32]
+
+
+def cache_path(value, symbology=DEFAULT_SYMBOLOGY, size='screen', root=None):
+    key = cache_key(value, symbology, size)
+    return os.path.join(root or barcode_cache_dir(), key[:2], f'{key}.png')
+
+
+def render_png(value, symbology=DEFAULT_SYMBOLOGY, size='screen'):
+    """
+    PNG bytes for `value`. Raises ValueError for an unknown symbology or
+    size, or a value the symbology cannot encode.
+    """
+    if size not in SIZES:
+        raise ValueError(f"Unknown barcode size: {size}")
+    try:
+        code = barcode.get(symbology, value, writer=ImageWriter())
+        buffer = io.BytesIO()
+        code.write(buffer, options=SIZES[size])
+    except (BarcodeError, KeyError) as e:
+        raise ValueError(f"Cannot render {symbology} barcode for {value!r}: {e}") from e
+    return buffer.getvalue()
+
+
+def can_encode(value, symbology=DEFAULT_SYMBOLOGY):
+    """
+    Whether the symbology accepts `value`, checked without rendering or
+    writing the image.
+    """
+    try:
+        barcode.get(symbology, value)
+    except (BarcodeError, KeyError):
+        return False
+    return True
+
+
+def _write_atomic(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # A unique temp file per writer: threads of one process may render the
+    # same image at once
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.chmod(tmp, 0o644)
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+
+def barcode_image(value, symbology=DEFAULT_SYMBOLOGY, size='screen'):
+    """
+    Path of the cached PNG for `value`, rendering it on first use.
+    """
+    path = cache_path(value, symbology, size)
+    if not os.path.exists(path):
+        _write_atomic(path, render_png(value, symbology, size))
+    return path
+
 
-def generate_barcode(data, filename=None, folder='static/barcodes'):
-    if not os.path.exists(folder):
-        os.makedirs(folder)
+def _prerender_one(job):
+    # Runs in a worker process: no app context, the path is precomputed
+    value, symbology, size, path = job
+    if os.path.exists(path):
+        return 'cached'
+    try:
+        _write_atomic(path, render_png(value, symbology, size))
+    except ValueError:
+        return 'failed'
+    return 'rendered'
 
-    # Use Code128 because it supports letters and numbers
-    code128 = barcode.get('code128', data, writer=ImageWriter())
 
-    if not filename:
-        filename = f"{data}.png"
-    filepath = os.path.join(folder, filename)
-    
-    code128.save(filepath.replace('.png', ''))  # `save()` auto-appends `.png`
-    
-    return filepath
\ No newline at end of file
+def prerender(values, symbology=DEFAULT_SYMBOLOGY, size='screen', workers=None):
+    """
+    Render every missing image for `values` with a process pool (rendering
+    is CPU bound). Returns counts of rendered/cached/failed images.
+    """
+    root = barcode_cache_dir()
+    jobs = [(v, symbology, size, cache_path(v, symbology, size, root)) for v in values]
+    counts = {'rendered': 0, 'cached': 0, 'failed': 0}
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for outcome in pool.map(_prerender_one, jobs, chunksize=64):
+            counts[outcome] += 1
+    return counts
@@ -0,0 +1,230 @@
+"""
+In-process product catalog cache.
+
+The sale, restock and product list screens need every product's
+id/name/barcode/price/cost/quantity on each load. Instead of hydrating
+Product ORM objects per request they read an immutable CatalogSnapshot,
+rebuilt from one Core query when missing and patched in place after
+product writes:
+
+* ORM changes to Product are picked up by session events and the changed
+  rows are re-read and patched in after the commit.
+* Core/bulk writes that bypass the ORM call `catalog.mark_changed(session,
+  ids)` (rows re-read after commit) or `catalog.invalidate()` (full reload
+  on next use).
+
+Every new snapshot gets the next version number, so callers can tell
+whether the catalog changed. A cold load reads on a connection of its own
+and re-reads any product refreshed while it ran before installing, so a
+commit racing the load cannot leave stale prices or stock behind.
+"""
+import hashlib
+import json
+import threading
+from collections import namedtuple
+from types import MappingProxyType
+from sqlalchemy import event, select
+from sqlalchemy.orm import Session
+from models import db, Product
+
+CatalogEntry = namedtuple('CatalogEntry', 'id name barcode price cost_price quantity last_modified')
+
+_COLUMNS = [getattr(Product.__table__.c, field) for field in CatalogEntry._fields]
+
+
+class CatalogSnapshot:
+    """
+    Immutable view of the catalog: `products` ordered by id, plus hash
+    indexes `by_id` and `by_barcode`.
+    """
+    __slots__ = ('version', 'products', 'by_id', 'by_barcode', '_barcode_index')
+
+    def __init__(self, version, by_id):
+        self.version = version
+        self.products = tuple(by_id[k] for k in sorted(by_id))
+        self.by_id = MappingProxyType(by_id)
+        self.by_barcode = MappingProxyType({p.barcode: p for p in self.products if p.barcode})
+        self._barcode_index = None
+
+    def barcode_index(self):
+        """
+        Compact {barcode: [id, price, cost_price]} for the cashier page and
+        a hash of it for the ETag, built once per snapshot. The hash only
+        changes when barcodes or prices do, not on every stock movement.
+        """
+        if self._barcode_index is None:
+            index = {b: [p.id, p.price, p.cost_price] for b, p in self.by_barcode.items()}
+            digest = hashlib.sha1(json.dumps(index, sort_keys=True).encode()).hexdigest()[:16]
+            self._barcode_index = (index, digest)
+        return self._barcode_index
+
+
+class ProductCatalog:
+    def __init__(self):
+        self._lock = threading.Lock()         # guards the state below
+        self._load_lock = threading.Lock()    # one cold load at a time
+        self._snapshot = None
+        self._version = 0
+        # While a cold load runs: ids refreshed meanwhile, to re-read before
+        # installing (True = invalidated, reload everything); else None
+        self._changed_during_load = None
+        self.hits = 0
+        self.misses = 0
+        self.patches = 0
+        self.invalidations = 0
+
+    # ------------------------------------------------------------------
+    # Reads
+    # ------------------------------------------------------------------
+    def snapshot(self):
+        snapshot = self._snapshot
+        if snapshot is not None:
+            self.hits += 1
+            return snapshot
+        with self._load_lock:
+            snapshot = self._snapshot
+            if snapshot is not None:
+                self.hits += 1
+                return snapshot
+            self.misses += 1
+            return self._load()
+
+    def _load(self):
+        """
+        Read the whole catalog on a connection of its own (the request's
+        session may be in a read transaction older than a recent commit),
+        then re-read whatever was refreshed while loading, until nothing
+        is left, and install it. Caller holds the load lock.
+        """
+        with self._lock:
+            self._changed_during_load = set()
+        by_id = _read()
+        while True:
+            with self._lock:
+                changed = self._changed_during_load
+                if changed is True:
+                    self._changed_during_load = set()
+                elif not changed:
+                    self._changed_during_load = None
+                    self._install(by_id)
+                    return self._snapshot
+                else:
+                    self._changed_during_load = set()
+            if changed is True:
+                by_id = _read()
+            else:
+                fresh = _read(changed)
+                for product_id in changed:
+                    if product_id in fresh:
+                        by_id[product_id] = fresh[product_id]
+                    else:
+                        by_id.pop(product_id, None)
+
+    def products(self):
+        return self.snapshot().products
+
+    def get(self, product_id):
+        return self.snapshot().by_id.get(product_id)
+
+    def by_barcode(self, barcode):
+        return self.snapshot().by_barcode.get(barcode)
+
+    def stats(self):
+        snapshot = self._snapshot
+        return {
+            'version': self._version,
+            'loaded': snapshot is not None,
+            'products': len(snapshot.products) if snapshot else 0,
+            'hits': self.hits,
+            'misses': self.misses,
+            'patches': self.patches,
+            'invalidations': self.invalidations,
+        }
+
+    # ------------------------------------------------------------------
+    # Writes
+    # ------------------------------------------------------------------
+    def _install(self, by_id):
+        # Caller holds the lock
+        self._version += 1
+        self._snapshot = CatalogSnapshot(self._version, by_id)
+
+    def _note_changed(self, product_ids):
+        # Caller holds the lock
+        if isinstance(self._changed_during_load, set):
+            self._changed_during_load.update(product_ids)
+
+    def invalidate(self):
+        """Drop the snapshot; the next read reloads it."""
+        with self._lock:
+            self.invalidations += 1
+            self._version += 1
+            self._snapshot = None
+            if self._changed_during_load is not None:
+                self._changed_during_load = True
+
+    def mark_changed(self, session, product_ids):
+        """Re-read these products once `session` commits."""
+        session.info.setdefault('catalog_changed', set()).update(product_ids)
+
+    def refresh(self, product_ids):
+        """
+        Re-read `product_ids` from the database and patch them into the
+        snapshot (products no longer found are removed). A row is only
+        replaced by a version at least as new, so refreshes finishing out
+        of order cannot bring back an older row.
+        """
+        if not product_ids:
+            return
+        with self._lock:
+            if self._snapshot is None:
+                # Nothing to patch; a load in progress re-reads them
+                self._note_changed(product_ids)
+                return
+        fresh = _read(product_ids)
+
+        with self._lock:
+            if self._snapshot is None:
+                self._note_changed(product_ids)
+                return
+            by_id = dict(self._snapshot.by_id)
+            for product_id in product_ids:
+                entry, current = fresh.get(product_id), by_id.get(product_id)
+                if entry is None:
+                    by_id.pop(product_id, None)
+                elif current is None or not (entry.last_modified and current.last_modified) \
+                        or entry.last_modified >= current.last_modified:
+                    by_id[product_id] = entry
+            self.patches += 1
+            self._install(by_id)
+
+
+def _read(product_ids=None):
+    """{id: CatalogEntry} for `product_ids` (all products if None), on a fresh connection."""
+    query = select(*_COLUMNS)
+    if product_ids is not None:
+        query = query.where(Product.id.in_(product_ids))
+    with db.engine.connect() as conn:
+        return {row.id: CatalogEntry(*row) for row in conn.execute(query)}
+
+
+catalog = ProductCatalog()
+
+
+@event.listens_for(Session, 'after_flush')
+def _collect_product_changes(session, flush_context):
+    ids = {obj.id for obj in (*session.new, *session.dirty, *session.deleted) if isinstance(obj, Product)}
+    if ids:
+        catalog.mark_changed(session, ids)
+
+
+@event.listens_for(Session, 'after_commit')
+def _refresh_catalog(session):
+    ids = session.info.pop('catalog_changed', None)
+    if ids:
+        catalog.refresh(ids)
+
+
+@event.listens_for(Session, 'after_soft_rollback')
+def _discard_product_changes(session, previous_transaction):
+    session.info.pop('catalog_changed', None)
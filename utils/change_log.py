@@ -0,0 +1,133 @@
+"""
+Change-data-capture outbox for sync.
+
+Every insert, update and delete of a synced model appends a ChangeLog
+entry (model, row uuid, upsert/delete) in the same transaction as the
+change, so push only has to read `seq > cursor` in order: its cost follows
+the number of changes, not the size of the tables.
+
+* ORM changes are captured by an after_flush listener.
+* Core/bulk writes that bypass the ORM call `record_ids` or `record_uuids`
+  themselves (checkout, product import).
+* Rows written by pull come from the server and are not logged.
+
+`seq` has to follow commit order or a push could move its cursor past an
+entry that commits later. SQLite serialises writers, so that holds as is;
+on PostgreSQL writers take a transaction-level advisory lock before
+appending. Acknowledged entries are deleted (`compact`).
+"""
+from sqlalchemy import event, func, literal, select, text
+from sqlalchemy.orm import Session
+from models import db, User, Product, Expense, Sale, SaleTransaction, SyncMeta, ChangeLog
+
+CAPTURED_MODELS = (User, Product, Expense, Sale, SaleTransaction)
+
+# Arbitrary key for pg_advisory_xact_lock, shared by every change-log writer
+_PG_LOCK_KEY = 0x53594E43
+
+
+def _serialise_writers(connection):
+    if connection.dialect.name == 'postgresql':
+        connection.execute(text('SELECT pg_advisory_xact_lock(:key)'), {'key': _PG_LOCK_KEY})
+
+
+def record_uuids(connection, model_name, uuids, op='upsert'):
+    """Append one entry per uuid (one executemany)."""
+    uuids = [u for u in uuids if u]
+    if not uuids:
+        return
+    _serialise_writers(connection)
+    connection.execute(ChangeLog.__table__.insert(),
+                       [{'model_name': model_name, 'row_uuid': u, 'op': op} for u in uuids])
+
+
+def _record_select(connection, model_cls, condition):
+    _serialise_writers(connection)
+    table = model_cls.__table__
+    source = select(literal(model_cls.__name__), table.c.uuid, literal('upsert')).where(condition)
+    return connection.execute(ChangeLog.__table__.insert().from_select(['model_name', 'row_uuid', 'op'], source)).rowcount
+
+
+def record_ids(session, model_cls, ids):
+    """
+    Log rows changed by a Core UPDATE/INSERT, by primary key, with a
+    single INSERT ... SELECT.
+    """
+    ids = list(ids)
+    if ids:
+        _record_select(session.connection(), model_cls, model_cls.__table__.c.id.in_(ids))
+
+
+def pending(model_name, cursor, limit):
+    """The next `limit` entries of `model_name` after `cursor`, in seq order."""
+    return db.session.execute(
+        select(ChangeLog.seq, ChangeLog.row_uuid, ChangeLog.op)
+        .where(ChangeLog.model_name == model_name, ChangeLog.seq > cursor)
+        .order_by(ChangeLog.seq)
+        .limit(limit)
+    ).all()
+
+
+def pending_deletes(model_name):
+    """Uuids of `model_name` whose delete has not been pushed yet."""
+    cursor = db.session.query(SyncMeta.push_cursor).filter_by(model_name=model_name).scalar() or 0
+    return set(db.session.execute(
+        select(ChangeLog.row_uuid)
+        .where(ChangeLog.model_name == model_name, ChangeLog.seq > cursor, ChangeLog.op == 'delete')
+    ).scalars())
+
+
+def compact(model_name, acknowledged):
+    """Drop entries of `model_name` up to the acknowledged seq."""
+    table = ChangeLog.__table__
+    db.session.execute(table.delete().where(table.c.model_name == model_name, table.c.seq <= acknowledged))
+
+
+def backlog():
+    """{model_name: entries not yet pushed}"""
+    rows = db.session.execute(
+        select(ChangeLog.model_name, func.count())
+        .outerjoin(SyncMeta, SyncMeta.model_name == ChangeLog.model_name)
+        .where(ChangeLog.seq > func.coalesce(SyncMeta.push_cursor, 0))
+        .group_by(ChangeLog.model_name)
+    ).all()
+    return dict(rows)
+
+
+def enqueue_unsynced(model_classes=CAPTURED_MODELS, everything=False):
+    """
+    Log every row the old scan-based push would have sent (not flagged as
+    synced, or modified since the last sync), or every row, e.g. after
+    pointing the app at a new server. Returns {model_name: rows queued}.
+    """
+    queued = {}
+    for model_cls in model_classes:
+        table = model_cls.__table__
+        if everything:
+            condition = table.c.id.isnot(None)
+        else:
+            last_sync = db.session.query(SyncMeta.last_sync).filter_by(model_name=model_cls.__name__).scalar()
+            condition = table.c.synced.isnot(True)
+            if last_sync:
+                condition = condition | (table.c.last_modified > last_sync)
+        queued[model_cls.__name__] = _record_select(db.session.connection(), model_cls, condition)
+    db.session.commit()
+    return queued
+
+
+@event.listens_for(Session, 'after_flush')
+def _capture_changes(session, flush_context):
+    entries = {}
+    for obj in session.new:
+        if isinstance(obj, CAPTURED_MODELS):
+            entries.setdefault((type(obj).__name__, 'upsert'), []).append(obj.uuid)
+    for obj in session.dirty:
+        if isinstance(obj, CAPTURED_MODELS) and session.is_modified(obj, include_collections=False):
+            entries.setdefault((type(obj).__name__, 'upsert'), []).append(obj.uuid)
+    for obj in session.deleted:
+        if isinstance(obj, CAPTURED_MODELS):
+            entries.setdefault((type(obj).__name__, 'delete'), []).append(obj.uuid)
+    if entries:
+        connection = session.connection()
+        for (model_name, op), uuids in entries.items():
+            record_uuids(connection, model_name, uuids, op)
@@ -0,0 +1,136 @@
+from collections import OrderedDict
+from datetime import datetime
+from sqlalchemy import bindparam
+from models import db, Product, Sale, SaleTransaction
+from utils.catalog import catalog
+from utils import change_log
+
+
+class CheckoutError(Exception):
+    """
+    Raised when a basket cannot be sold. `failures` holds one dict per
+    offending cart line: {'line': <1-based index>, 'product_id': ..., 'error': ...}
+    """
+    def __init__(self, failures):
+        super().__init__("Checkout failed")
+        self.failures = failures
+
+
+def parse_cart(form):
+    """
+    Turn the parallel product_id[]/quantity[]/cost_price[]/unit_price[] form
+    lists into cart lines. Lines that cannot be parsed are reported as failures,
+    and lists of different lengths reject the whole cart.
+    """
+    product_ids = form.getlist('product_id[]')
+    quantities = form.getlist('quantity[]')
+    cost_prices = form.getlist('cost_price[]')
+    unit_prices = form.getlist('unit_price[]')
+    if not len(product_ids) == len(quantities) == len(cost_prices) == len(unit_prices):
+        # zip() would silently drop the extra lines and sell part of the basket
+        raise CheckoutError([{'line': 0, 'product_id': None, 'error': "Cart lines are incomplete"}])
+
+    lines, failures = [], []
+    for i, raw in enumerate(zip(product_ids, quantities, cost_prices, unit_prices), start=1):
+        try:
+            lines.append({
+                'product_id': int(raw[0]),
+                'quantity': int(raw[1]),
+                'cost_price': float(raw[2]),
+                'unit_price': float(raw[3]),
+            })
+        except (TypeError, ValueError):
+            failures.append({'line': i, 'product_id': raw[0], 'error': "Invalid product, quantity or price"})
+
+    if not lines and not failures:
+        failures.append({'line': 0, 'product_id': None, 'error': "Cart is empty"})
+    if failures:
+        raise CheckoutError(failures)
+    return lines
+
+
+def checkout(lines, user_id, customer_name=None, payment_type='Cash', comments=None):
+    """
+    Sell a whole basket in one transaction.
+
+    All products are loaded with a single IN query (row-locked where the
+    backend supports it), the basket is validated as a whole, and stock is
+    decremented with one conditional UPDATE ... WHERE quantity >= ? per
+    product so two tills can never oversell the same SKU.
+    Returns the new SaleTransaction or raises CheckoutError.
+    """
+    # Quantities requested per product (the same SKU may appear on several lines)
+    requested = OrderedDict()
+    for line in lines:
+        requested[line['product_id']] = requested.get(line['product_id'], 0) + line['quantity']
+
+    products = {
+        p.id: p for p in Product.query
+        .filter(Product.id.in_(requested.keys()))
+        .with_for_update()
+        .all()
+    }
+
+    failures = []
+    for i, line in enumerate(lines, start=1):
+        product = products.get(line['product_id'])
+        if product is None:
+            failures.append({'line': i, 'product_id': line['product_id'], 'error': "Product not found"})
+        elif line['quantity'] < 1:
+            failures.append({'line': i, 'product_id': product.id, 'error': f"Invalid quantity for product: {product.name}"})
+        elif product.quantity < requested[product.id]:
+            failures.append({
+                'line': i,
+                'product_id': product.id,
+                'error': f"Insufficient stock for product: {product.name} "
+                         f"({product.quantity} left, {requested[product.id]} requested)",
+            })
+    if failures:
+        db.session.rollback()
+        raise CheckoutError(failures)
+
+    # Conditional decrement for the whole basket in a single executemany;
+    # a short rowcount means another till took the stock since we read it.
+    table = Product.__table__
+    stmt = (
+        table.update()
+        .where(table.c.id == bindparam('pid'), table.c.quantity >= bindparam('qty'))
+        .values(quantity=table.c.quantity - bindparam('qty'), last_modified=datetime.utcnow())
+    )
+    result = db.session.execute(stmt, [{'pid': pid, 'qty': qty} for pid, qty in requested.items()])
+    if result.rowcount != len(requested):
+        db.session.rollback()
+        raise CheckoutError([{'line': 0, 'product_id': None, 'error': "Stock changed during checkout, please try again"}])
+
+    for product in products.values():
+        db.session.expire(product, ['quantity', 'last_modified'])
+    # The Core UPDATE skips the ORM events
+    catalog.mark_changed(db.session, requested.keys())
+    change_log.record_ids(db.session, Product, requested.keys())
+
+    transaction = SaleTransaction(
+        customer_name=customer_name or None,
+        payment_type=payment_type,
+        comments=comments or None,
+        user_id=user_id
+    )
+    db.session.add(transaction)
+    db.session.flush()  # Flush to get transaction.id
+
+    db.session.add_all([
+        Sale(
+            product_id=line['product_id'],
+            quantity=line['quantity'],
+            cost_price=line['cost_price'],
+            unit_price=line['unit_price'],
+            total_price=line['unit_price'] * line['quantity'],
+            customer_name=customer_name or None,
+            payment_type=payment_type,
+            comments=comments or None,
+            user_id=user_id,
+            transaction_id=transaction.id
+        )
+        for line in lines
+    ])
+    db.session.commit()
+    return transaction
@@ -0,0 +1,88 @@
+"""
+Checkout latency by basket size: how utils.checkout.checkout scales from a
+single line to a hundred.
+
+    python -m utils.checkout_bench
+    python -m utils.checkout_bench --sizes 1 10 40 100 200 --runs 500
+
+Seeds a scratch SQLite database (utils/db_bench.py) and sells baskets of
+each size straight through checkout(), each line a different product,
+--runs times per size after a short warm-up. Prints p50/p95/p99 latency,
+the cost per line and the SQL statements per checkout for every size. A
+checkout that fails stops the run with its error.
+"""
+import argparse
+import os
+import random
+import statistics
+import tempfile
+import time
+from utils.db_bench import percentile, seed_database
+from utils.query_budget import QueryCounter
+
+SIZES = (1, 10, 40, 100)
+WARMUP = 5
+
+
+def _basket(rng, products, size):
+    return [{'product_id': pid, 'quantity': 1, 'cost_price': 60.0, 'unit_price': 100.0}
+            for pid in rng.sample(range(1, products + 1), size)]
+
+
+def measure(app, db, user_id, products, size, runs, rng):
+    """Latencies in ms of `runs` checkouts of `size` lines, and statements per checkout."""
+    from utils.checkout import checkout
+
+    latencies = []
+    with app.app_context():
+        for _ in range(WARMUP):
+            checkout(_basket(rng, products, size), user_id)
+        with QueryCounter(db.engine) as counter:
+            checkout(_basket(rng, products, size), user_id)
+        for _ in range(runs):
+            lines = _basket(rng, products, size)
+            started = time.perf_counter()
+            checkout(lines, user_id)
+            latencies.append((time.perf_counter() - started) * 1000)
+    return latencies, counter.count
+
+
+def run(sizes, runs, products, history, seed):
+    from app import app
+    from models import db
+
+    if max(sizes) > products:
+        raise SystemExit(f"--products must be at least the largest basket ({max(sizes)})")
+    user_id = seed_database(app, db, products, history)
+    rng = random.Random(seed)
+
+    print(f"{app.config['SQLALCHEMY_DATABASE_URI']}  products={products} history={history} runs={runs}")
+    baseline = None
+    for size in sizes:
+        ms, statements = measure(app, db, user_id, products, size, runs, rng)
+        p50 = percentile(ms, 50)
+        baseline = baseline or p50
+        print(f"  {size:>4} lines  p50 {p50:>7.2f} ms  p95 {percentile(ms, 95):>7.2f} ms  "
+              f"p99 {percentile(ms, 99):>7.2f} ms  mean {statistics.fmean(ms):>7.2f} ms  "
+              f"{p50 / size:>6.3f} ms/line  x{p50 / baseline:>5.1f}  {statements} statements")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=list(SIZES), help='basket sizes to measure')
+    parser.add_argument('--runs', type=int, default=200, help='checkouts per size')
+    parser.add_argument('--products', type=int, default=500)
+    parser.add_argument('--history', type=int, default=20000, help='sales to seed before the run')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args(argv)
+
+    # Settings are read from the environment when app.py is imported
+    scratch = tempfile.mkdtemp(prefix='checkout-bench-')
+    os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(scratch, 'bench.db')
+
+    run(args.sizes, args.runs, args.products, args.history, args.seed)
+    print(f"  scratch database left in {scratch}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,155 @@
+"""
+Dashboard latency benchmark with a budget: seeds a scratch database with a
+million sales and fails if loading the dashboard gets slower than that.
+
+    python -m utils.dashboard_bench
+    python -m utils.dashboard_bench --sales 200000 --budget-ms 100
+
+Sales are spread evenly over --years of history, one to three lines per
+transaction, plus a few expenses a day; they go in with bulk Core inserts
+and the rollups are rebuilt once at the end, as utils/load_data.py does.
+The dashboard is then loaded --runs times for the whole history and for
+the last 90 days. Prints p50/p95/max per view; exits non-zero if any
+load failed or any p95 is over --budget-ms.
+"""
+import argparse
+import os
+import shutil
+import tempfile
+import time
+import uuid
+from datetime import datetime, timedelta
+from utils.db_bench import percentile
+
+BATCH = 50000
+
+# View name: days of history it filters on (None for no filter)
+VIEWS = {
+    'all history': None,
+    'last 90 days': 90,
+}
+
+
+def seed(app, db, sales, products, years):
+    """
+    Create the schema, an admin and `products` products, then `sales` sales
+    in transactions spread over `years`. Returns the user id.
+    """
+    from werkzeug.security import generate_password_hash
+    from models import User, Product, Sale, SaleTransaction, Expense
+    from utils.rollups import rebuild_rollups
+
+    now = datetime.utcnow().replace(microsecond=0)
+    span = timedelta(days=365 * years).total_seconds()
+
+    def stamp(ts):
+        return {'uuid': str(uuid.uuid4()), 'timestamp': ts, 'last_modified': ts, 'synced': True}
+
+    with app.app_context():
+        db.create_all()
+        db.session.execute(User.__table__.insert(), [dict(
+            stamp(now), id=1, username='bench', full_name='Bench', email='bench@example.com',
+            password=generate_password_hash('bench'), role='admin', is_approved=True)])
+        db.session.execute(Product.__table__.insert(), [
+            dict(stamp(now), id=i + 1, name=f'Bench product {i}', barcode=f'BENCH{i:06d}',
+                 quantity=10 ** 6, price=100.0, cost_price=60.0)
+            for i in range(products)
+        ])
+
+        written, tx_id = 0, 0
+        while written < sales:
+            transactions, lines = [], []
+            while len(lines) < BATCH and written + len(lines) < sales:
+                tx_id += 1
+                ts = now - timedelta(seconds=span * (1 - (written + len(lines)) / sales))
+                payment = ('Cash', 'Card', 'Mobile Money')[tx_id % 3]
+                transactions.append(dict(stamp(ts), id=tx_id, user_id=1, payment_type=payment))
+                for line in range(min(tx_id % 3 + 1, sales - written - len(lines))):
+                    quantity = line + 1
+                    lines.append(dict(stamp(ts), product_id=(tx_id * 7 + line) % products + 1, quantity=quantity,
+                                      unit_price=100.0, cost_price=60.0, total_price=100.0 * quantity,
+                                      payment_type=payment, user_id=1, transaction_id=tx_id))
+            db.session.execute(SaleTransaction.__table__.insert(), transactions)
+            db.session.execute(Sale.__table__.insert(), lines)
+            db.session.commit()
+            written += len(lines)
+
+        days = int(365 * years)
+        db.session.execute(Expense.__table__.insert(), [
+            dict(stamp(now - timedelta(days=d, hours=n)), description='Bench expense', amount=50.0,
+                 expense_date=now - timedelta(days=d, hours=n))
+            for d in range(days) for n in range(3)
+        ])
+        db.session.commit()
+        rebuild_rollups()
+        return 1
+
+
+def measure(client, query_string, runs):
+    """Latencies in ms of `runs` dashboard loads after one warm-up; None if a load failed."""
+    client.get('/dashboard', query_string=query_string)
+    latencies = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        response = client.get('/dashboard', query_string=query_string)
+        latencies.append((time.perf_counter() - started) * 1000)
+        if response.status_code != 200:
+            return None
+    return latencies
+
+
+def run(sales, products, years, runs, budget_ms):
+    from app import app
+    from models import db, Sale
+
+    started = time.monotonic()
+    user_id = seed(app, db, sales, products, years)
+    with app.app_context():
+        seeded = db.session.query(Sale).count()
+    print(f"seeded {seeded} sales in {time.monotonic() - started:.0f} s; budget p95 <= {budget_ms:g} ms")
+
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['_user_id'] = str(user_id)
+        session['_fresh'] = True
+
+    failures = []
+    today = datetime.utcnow().date()
+    for name, days in VIEWS.items():
+        query_string = {} if days is None else {
+            'start': (today - timedelta(days=days)).isoformat(), 'end': today.isoformat()}
+        ms = measure(client, query_string, runs)
+        if ms is None:
+            failures.append(f"{name}: dashboard did not return 200")
+            continue
+        p95 = percentile(ms, 95)
+        print(f"  {name:<14} {runs:>4} loads  p50 {percentile(ms, 50):>7.1f} ms  "
+              f"p95 {p95:>7.1f} ms  max {max(ms):>7.1f} ms")
+        if p95 > budget_ms:
+            failures.append(f"{name}: p95 {p95:.1f} ms is over the {budget_ms:g} ms budget")
+    return failures
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sales', type=int, default=1000000)
+    parser.add_argument('--products', type=int, default=2000)
+    parser.add_argument('--years', type=float, default=3.0, help='history the sales are spread over')
+    parser.add_argument('--runs', type=int, default=50, help='dashboard loads per view')
+    parser.add_argument('--budget-ms', type=float, default=150.0, help='p95 latency budget per view')
+    args = parser.parse_args(argv)
+
+    # Settings are read from the environment when app.py is imported
+    scratch = tempfile.mkdtemp(prefix='dashboard-bench-')
+    os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(scratch, 'bench.db')
+
+    failures = run(args.sales, args.products, args.years, args.runs, args.budget_ms)
+    for failure in failures:
+        print("FAIL", failure)
+    shutil.rmtree(scratch)
+    if failures:
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,155 @@
+"""
+Database engine configuration.
+
+Settings come from app.config, which is seeded from the environment:
+
+    DATABASE_URL            SQLAlchemy URL (default sqlite:///inventory.db)
+    WAITRESS_THREADS        request threads served by run.py (default 8)
+    DB_POOL_SIZE            pooled connections (default 0: threads + background workers)
+    DB_POOL_TIMEOUT         seconds to wait for a pooled connection (default 30)
+    SQLITE_JOURNAL_MODE     default WAL, so readers never wait for a writer
+    SQLITE_SYNCHRONOUS      default NORMAL (durable at checkpoint in WAL mode)
+    SQLITE_BUSY_TIMEOUT     milliseconds a writer waits for the lock (default 5000)
+    SQLITE_CACHE_SIZE       page cache per connection, negative = KiB (default -32000)
+    SQLITE_MMAP_SIZE        bytes of the file memory-mapped (default 256 MB)
+
+The SQLite pragmas are applied to every new pooled connection.
+
+SQLite and PostgreSQL (DATABASE_URL=postgresql://..., needs psycopg2) run
+the same code; the few SQL constructs that differ between them are built
+with the helpers at the bottom of this module.
+"""
+import os
+import sqlite3
+from sqlalchemy import event, String
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.functions import FunctionElement
+
+# Background threads holding a connection besides the request threads:
+# the sync worker thread plus its per-model workers (SYNC_WORKERS).
+BACKGROUND_CONNECTIONS = 4
+
+DEFAULTS = {
+    'DATABASE_URL': 'sqlite:///inventory.db',
+    'WAITRESS_THREADS': 8,
+    'DB_POOL_SIZE': 0,
+    'DB_POOL_TIMEOUT': 30,
+    'SQLITE_JOURNAL_MODE': 'WAL',
+    'SQLITE_SYNCHRONOUS': 'NORMAL',
+    'SQLITE_BUSY_TIMEOUT': 5000,
+    'SQLITE_CACHE_SIZE': -32000,
+    'SQLITE_MMAP_SIZE': 256 * 1024 * 1024,
+}
+
+
+def _from_env(key, default):
+    value = os.environ.get(key)
+    if value is None:
+        return default
+    return int(value) if isinstance(default, int) else value
+
+
+def configure_database(app):
+    """
+    Fill in database settings from the environment (explicit app.config
+    values win) and derive the engine options. Call before db.init_app().
+    """
+    for key, default in DEFAULTS.items():
+        app.config.setdefault(key, _from_env(key, default))
+
+    app.config.setdefault('SQLALCHEMY_DATABASE_URI', app.config['DATABASE_URL'])
+
+    threads = app.config['WAITRESS_THREADS']
+    pool_size = app.config['DB_POOL_SIZE'] or threads + BACKGROUND_CONNECTIONS
+    options = app.config.setdefault('SQLALCHEMY_ENGINE_OPTIONS', {})
+    if app.config['SQLALCHEMY_DATABASE_URI'] not in ('sqlite://', 'sqlite:///:memory:'):
+        options.setdefault('pool_size', pool_size)
+        options.setdefault('max_overflow', threads)
+        options.setdefault('pool_timeout', app.config['DB_POOL_TIMEOUT'])
+
+
+def sqlite_pragmas(config):
+    return [
+        f"PRAGMA journal_mode = {config['SQLITE_JOURNAL_MODE']}",
+        f"PRAGMA synchronous = {config['SQLITE_SYNCHRONOUS']}",
+        f"PRAGMA busy_timeout = {int(config['SQLITE_BUSY_TIMEOUT'])}",
+        f"PRAGMA cache_size = {int(config['SQLITE_CACHE_SIZE'])}",
+        f"PRAGMA mmap_size = {int(config['SQLITE_MMAP_SIZE'])}",
+    ]
+
+
+def init_engine(app, db):
+    """
+    Register the per-connection pragmas on the app's engine. Call after
+    db.init_app().
+    """
+    with app.app_context():
+        engine = db.engine
+    if engine.dialect.name != 'sqlite':
+        return
+
+    pragmas = sqlite_pragmas(app.config)
+
+    @event.listens_for(engine, 'connect')
+    def _set_sqlite_pragmas(dbapi_connection, connection_record):
+        if not isinstance(dbapi_connection, sqlite3.Connection):
+            return
+        cursor = dbapi_connection.cursor()
+        for pragma in pragmas:
+            cursor.execute(pragma)
+        cursor.close()
+
+
+# ----------------------------------------------------------------------
+# Dialect-neutral SQL
+# ----------------------------------------------------------------------
+class _Bucket(FunctionElement):
+    type = String()
+    inherit_cache = True
+    formats = None  # (strftime format, to_char format)
+
+
+class day_bucket(_Bucket):
+    """'YYYY-MM-DD' text of a datetime column."""
+    inherit_cache = True  # not inherited from _Bucket
+    formats = ('%Y-%m-%d', 'YYYY-MM-DD')
+
+
+class month_bucket(_Bucket):
+    """'YYYY-MM' text of a datetime column."""
+    inherit_cache = True
+    formats = ('%Y-%m', 'YYYY-MM')
+
+
+@compiles(_Bucket, 'sqlite')
+def _bucket_sqlite(element, compiler, **kw):
+    return f"strftime('{element.formats[0]}', {compiler.process(element.clauses, **kw)})"
+
+
+@compiles(_Bucket, 'postgresql')
+def _bucket_postgresql(element, compiler, **kw):
+    return f"to_char({compiler.process(element.clauses, **kw)}, '{element.formats[1]}')"
+
+
+BUCKETS = {'day': day_bucket, 'month': month_bucket}
+
+
+def period_bucket(column, period):
+    """
+    Bucket label of `column` for a rollup period ('day' or 'month'), in the
+    same format as datetime.strftime('%Y-%m-%d' / '%Y-%m').
+    """
+    return BUCKETS[period](column)
+
+
+def upsert(connection, table):
+    """
+    INSERT for `table` supporting .on_conflict_do_update() on the
+    connection's backend.
+    """
+    dialects = {'sqlite': sqlite, 'postgresql': postgresql}
+    try:
+        return dialects[connection.dialect.name].insert(table)
+    except KeyError:
+        raise NotImplementedError(f"Upserts are not supported on {connection.dialect.name}")
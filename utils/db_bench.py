@@ -0,0 +1,159 @@
+"""
+Concurrency benchmark: N tills recording sales while M users load the
+dashboard, against a scratch database.
+
+    python -m utils.db_bench --tills 4 --readers 8 --seconds 20
+    python -m utils.db_bench --journal-mode DELETE      # compare with rollback journal
+
+Reports p50/p99 latency per role and how many requests failed with
+`database is locked`. The database is a temporary SQLite file unless
+--database-url is given; it is seeded with products and some history.
+"""
+import argparse
+import os
+import random
+import statistics
+import tempfile
+import threading
+import time
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))]
+
+
+def seed_database(app, db, products, history):
+    """
+    Create the schema, a bench admin user, `products` products with
+    unlimited stock and `history` single-line sales. Returns the user id.
+    """
+    from datetime import datetime, timedelta
+    from werkzeug.security import generate_password_hash
+    from models import User, Product, Sale, SaleTransaction
+    from utils.rollups import rebuild_rollups
+
+    with app.app_context():
+        db.create_all()
+        user = User(full_name='Bench', email='bench@example.com', username='bench',
+                    password=generate_password_hash('bench'), role='admin', is_approved=True)
+        db.session.add(user)
+        db.session.add_all([
+            Product(name=f'Bench product {i}', quantity=10 ** 9, price=100.0, cost_price=60.0, barcode=f'BENCH{i:06d}')
+            for i in range(products)
+        ])
+        db.session.commit()
+
+        now = datetime.utcnow()
+        for start in range(0, history, 1000):
+            txs = [SaleTransaction(user_id=user.id, timestamp=now - timedelta(minutes=i))
+                   for i in range(start, min(history, start + 1000))]
+            db.session.add_all(txs)
+            db.session.flush()
+            db.session.add_all([
+                Sale(product_id=random.randint(1, products), quantity=1, unit_price=100.0, cost_price=60.0,
+                     total_price=100.0, user_id=user.id, transaction_id=tx.id, timestamp=tx.timestamp,
+                     payment_type='Cash')
+                for tx in txs
+            ])
+            db.session.commit()
+        rebuild_rollups()
+        return user.id
+
+
+def _worker(app, user_id, role, products, deadline, results, lock):
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['_user_id'] = str(user_id)
+        session['_fresh'] = True
+
+    latencies, errors, locked = [], 0, 0
+    while time.monotonic() < deadline:
+        started = time.perf_counter()
+        try:
+            if role == 'till':
+                ids = random.sample(range(1, products + 1), 3)
+                response = client.post('/sale', data={
+                    'customer_name': 'bench',
+                    'payment_type': 'Cash',
+                    'product_id[]': ids,
+                    'quantity[]': [1] * len(ids),
+                    'cost_price[]': [60.0] * len(ids),
+                    'unit_price[]': [100.0] * len(ids),
+                })
+                ok = response.status_code == 302
+            else:
+                ok = client.get('/dashboard').status_code == 200
+        except Exception as e:
+            ok = False
+            locked += 'database is locked' in str(e)
+        latencies.append(time.perf_counter() - started)
+        errors += not ok
+
+    with lock:
+        bucket = results.setdefault(role, {'latencies': [], 'errors': 0, 'locked': 0})
+        bucket['latencies'].extend(latencies)
+        bucket['errors'] += errors
+        bucket['locked'] += locked
+
+
+def run(tills, readers, seconds, products, history):
+    from app import app
+    from models import db
+
+    app.config['PROPAGATE_EXCEPTIONS'] = True
+    user_id = seed_database(app, db, products, history)
+
+    results, lock = {}, threading.Lock()
+    deadline = time.monotonic() + seconds
+    threads = [
+        threading.Thread(target=_worker, args=(app, user_id, role, products, deadline, results, lock))
+        for role in ['till'] * tills + ['dashboard'] * readers
+    ]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    print(f"{app.config['SQLALCHEMY_DATABASE_URI']}  journal_mode={app.config['SQLITE_JOURNAL_MODE']}  "
+          f"tills={tills} readers={readers} seconds={seconds}")
+    for role, r in sorted(results.items()):
+        ms = [v * 1000 for v in r['latencies']]
+        print(f"  {role:<10} {len(ms):>6} req  {len(ms) / seconds:>7.1f}/s  "
+              f"p50 {percentile(ms, 50):>7.1f} ms  p99 {percentile(ms, 99):>7.1f} ms  "
+              f"mean {statistics.fmean(ms) if ms else 0:>7.1f} ms  "
+              f"errors {r['errors']}  locked {r['locked']}")
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--tills', type=int, default=4)
+    parser.add_argument('--readers', type=int, default=8)
+    parser.add_argument('--seconds', type=int, default=20)
+    parser.add_argument('--products', type=int, default=200)
+    parser.add_argument('--history', type=int, default=20000, help='sales to seed before the run')
+    parser.add_argument('--journal-mode', help='override SQLITE_JOURNAL_MODE (e.g. DELETE to compare)')
+    parser.add_argument('--database-url', help='run against this (empty) database instead of a temp file')
+    args = parser.parse_args(argv)
+
+    # Settings are read from the environment when app.py is imported
+    scratch = None
+    if args.database_url:
+        os.environ['DATABASE_URL'] = args.database_url
+    else:
+        scratch = tempfile.mkdtemp(prefix='db-bench-')
+        os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(scratch, 'bench.db')
+    if args.journal_mode:
+        os.environ['SQLITE_JOURNAL_MODE'] = args.journal_mode
+    os.environ.setdefault('WAITRESS_THREADS', str(args.tills + args.readers))
+
+    run(args.tills, args.readers, args.seconds, args.products, args.history)
+    if scratch:
+        print(f"  scratch database left in {scratch}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,104 @@
+"""
+Sales export benchmark: rows/s, time to first byte and peak memory for
+the CSV and XLSX downloads.
+
+    python -m utils.export_bench                     # generate a year of history first
+    python -m utils.export_bench --data loadtest.db  # database made by utils.load_data
+
+Each format runs in its own process against a copy of the data, through
+the Flask test client with the body consumed chunk by chunk as a client
+would. Peak RSS is the process high-water mark, reported with the RSS
+before the request so the export's own share is visible.
+"""
+import argparse
+import json
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+FORMATS = {'csv': {'format': 'csv'}, 'xlsx': {}}
+
+
+def _rss_mb():
+    # ru_maxrss is in KiB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def measure(fmt):
+    """Export every sale in `fmt`; runs in the child process."""
+    from app import app
+    from models import Sale
+    from utils.load_data import LOAD_PASSWORD
+
+    with app.app_context():
+        rows = Sale.query.count()
+    client = app.test_client()
+    client.post('/login', data={'username': 'loadadmin', 'password': LOAD_PASSWORD})
+    before = _rss_mb()
+
+    started = time.perf_counter()
+    response = client.get('/export/sales', query_string=FORMATS[fmt], buffered=False)
+    first_byte, size = None, 0
+    for chunk in response.response:
+        if first_byte is None:
+            first_byte = time.perf_counter() - started
+        size += len(chunk)
+    response.close()
+    elapsed = time.perf_counter() - started
+    return {
+        'format': fmt,
+        'status': response.status_code,
+        'rows': rows,
+        'bytes': size,
+        'seconds': round(elapsed, 2),
+        'rows_per_second': round(rows / elapsed),
+        'first_byte_ms': round((first_byte or elapsed) * 1000, 1),
+        'rss_before_mb': round(before, 1),
+        'peak_rss_mb': round(_rss_mb(), 1),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--data', help='database made by utils.load_data (default: generate one)')
+    parser.add_argument('--years', type=float, default=1.0, help='history to generate without --data')
+    parser.add_argument('--child', choices=sorted(FORMATS), help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.child:
+        print(json.dumps(measure(args.child)))
+        return
+
+    workdir = tempfile.mkdtemp(prefix='export-bench-')
+    data = args.data
+    if not data:
+        data = os.path.join(workdir, 'generated.db')
+        subprocess.run([sys.executable, '-m', 'utils.load_data', '--out', data, '--years', str(args.years)],
+                       check=True, stderr=subprocess.DEVNULL)
+    failed = False
+    for fmt in sorted(FORMATS):
+        path = os.path.join(workdir, f'{fmt}.db')
+        shutil.copyfile(data, path)
+        child = subprocess.run([sys.executable, '-m', 'utils.export_bench', '--child', fmt],
+                               env=dict(os.environ, DATABASE_URL='sqlite:///' + path),
+                               capture_output=True, text=True)
+        if child.returncode:
+            print(f"  {fmt}: failed\n{child.stderr[-2000:]}")
+            failed = True
+            continue
+        r = json.loads(child.stdout.strip().splitlines()[-1])
+        failed |= r['status'] != 200
+        print(f"  {fmt:<5} {r['rows']:>8} rows  {r['rows_per_second']:>8}/s  {r['seconds']:>6.2f} s  "
+              f"first byte {r['first_byte_ms']:>7.1f} ms  {r['bytes'] / 1e6:>6.1f} MB  "
+              f"RSS {r['rss_before_mb']:.0f} -> {r['peak_rss_mb']:.0f} MB")
+    shutil.rmtree(workdir)
+    if failed:
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
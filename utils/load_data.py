@@ -0,0 +1,155 @@
+"""
+Synthetic shop data for load tests: products with barcodes, cashiers and
+years of transaction, sale and expense history.
+
+    python -m utils.load_data --out loadtest.db
+    python -m utils.load_data --out big.db --products 20000 --years 5 --per-day 600
+
+Writes a new SQLite database (an existing --out file is refused). The
+history is shaped like a real till: transactions during opening hours
+with 1-5 lines each, a few popular products taking most of the sales, a
+busier weekend, and a handful of expenses per day. Rows go in with bulk
+Core inserts and are marked as synced, so the database looks like a shop
+whose history the server already has; rollups and the search index are
+rebuilt at the end.
+
+Every user's password is LOAD_PASSWORD; the admin is `loadadmin`, the
+cashiers `cashier0`, `cashier1`, ... utils/load_test.py runs its workload
+against a copy of this file.
+"""
+import argparse
+import os
+import random
+import sys
+import time
+import uuid
+from datetime import datetime, timedelta
+
+LOAD_PASSWORD = 'loadtest'
+PAYMENT_TYPES = ('Cash', 'Cash', 'Cash', 'Card', 'Card', 'Mobile Money')
+OPENING_HOURS = (8, 20)
+BATCH = 5000
+
+
+def _ean13(number):
+    """12-digit number plus its EAN-13 check digit."""
+    digits = f'{number:012d}'
+    total = sum(int(d) * (3 if i % 2 else 1) for i, d in enumerate(digits))
+    return digits + str((10 - total % 10) % 10)
+
+
+def _insert(db, table, rows):
+    for i in range(0, len(rows), BATCH):
+        db.session.execute(table.insert(), rows[i:i + BATCH])
+
+
+def generate(app, db, products=2000, cashiers=8, years=2.0, per_day=250, seed=1):
+    """
+    Create the schema and fill it. Returns the number of rows per table.
+    """
+    from werkzeug.security import generate_password_hash
+    from models import User, Product, Sale, SaleTransaction, Expense
+    from utils.product_search import rebuild_search_index
+    from utils.rollups import rebuild_rollups
+
+    rng = random.Random(seed)
+    now = datetime.utcnow().replace(microsecond=0)
+    start = now - timedelta(days=int(365 * years))
+
+    def stamp(ts):
+        return {'uuid': str(uuid.UUID(int=rng.getrandbits(128), version=4)), 'timestamp': ts,
+                'last_modified': ts, 'synced': True}
+
+    with app.app_context():
+        db.create_all()
+        password = generate_password_hash(LOAD_PASSWORD)
+        users = [dict(stamp(start), id=1, username='loadadmin', full_name='Load admin',
+                      email='loadadmin@example.com', password=password, role='admin', is_approved=True)]
+        users += [dict(stamp(start), id=i + 2, username=f'cashier{i}', full_name=f'Cashier {i}',
+                       email=f'cashier{i}@example.com', password=password, role='user', is_approved=True)
+                  for i in range(cashiers)]
+        _insert(db, User.__table__, users)
+
+        catalogue = []
+        for i in range(products):
+            price = round(rng.uniform(0.5, 200), 2)
+            catalogue.append(dict(stamp(start), id=i + 1, barcode=_ean13(600000000000 + i),
+                                  name=f'{rng.choice(_ADJECTIVES)} {rng.choice(_NOUNS)} {i}',
+                                  quantity=10 ** 6, price=price, cost_price=round(price * rng.uniform(0.5, 0.8), 2)))
+        _insert(db, Product.__table__, catalogue)
+        # Roughly Zipf: product k is picked with weight 1/k
+        weights = [1 / (k + 1) for k in range(products)]
+
+        counts = {'user': len(users), 'product': len(catalogue), 'sale_transaction': 0, 'sale': 0, 'expense': 0}
+        transactions, sales, expenses = [], [], []
+        day = start
+        while day < now:
+            busy = 1.3 if day.weekday() >= 5 else 1.0
+            for _ in range(int(rng.gauss(per_day * busy, per_day * 0.1))):
+                ts = day + timedelta(seconds=rng.randint(OPENING_HOURS[0] * 3600, OPENING_HOURS[1] * 3600 - 1))
+                if ts >= now:
+                    continue
+                cashier = rng.randint(2, len(users)) if cashiers else 1
+                payment = rng.choice(PAYMENT_TYPES)
+                tx_id = counts['sale_transaction'] + len(transactions) + 1
+                transactions.append(dict(stamp(ts), id=tx_id, user_id=cashier, payment_type=payment,
+                                         customer_name=None, comments=None))
+                for product in rng.choices(catalogue, weights, k=min(rng.choice((1, 1, 2, 2, 3, 4, 5)), products)):
+                    quantity = rng.choice((1, 1, 1, 2, 3))
+                    sales.append(dict(stamp(ts), product_id=product['id'], quantity=quantity,
+                                      cost_price=product['cost_price'], unit_price=product['price'],
+                                      total_price=round(product['price'] * quantity, 2), customer_name=None,
+                                      payment_type=payment, comments=None, user_id=cashier, transaction_id=tx_id))
+            for _ in range(rng.randint(0, 4)):
+                ts = day + timedelta(hours=rng.randint(*OPENING_HOURS))
+                expenses.append(dict(stamp(ts), description=rng.choice(_EXPENSES),
+                                     amount=round(rng.uniform(5, 500), 2), expense_date=ts))
+            if len(sales) >= BATCH:
+                for table, rows in (('sale_transaction', transactions), ('sale', sales), ('expense', expenses)):
+                    _insert(db, db.metadata.tables[table], rows)
+                    counts[table] += len(rows)
+                    rows.clear()
+                db.session.commit()
+            day += timedelta(days=1)
+        for table, rows in (('sale_transaction', transactions), ('sale', sales), ('expense', expenses)):
+            _insert(db, db.metadata.tables[table], rows)
+            counts[table] += len(rows)
+        db.session.commit()
+
+        rebuild_rollups()
+        rebuild_search_index()
+        return counts
+
+
+_ADJECTIVES = ('Fresh', 'Large', 'Small', 'Organic', 'Family', 'Classic', 'Premium', 'Value', 'Spicy', 'Sweet')
+_NOUNS = ('Rice', 'Sugar', 'Milk', 'Bread', 'Soap', 'Tea', 'Coffee', 'Flour', 'Oil', 'Biscuits', 'Juice',
+          'Beans', 'Salt', 'Eggs', 'Butter', 'Water', 'Soda', 'Candles', 'Matches', 'Batteries')
+_EXPENSES = ('Electricity', 'Water bill', 'Transport', 'Cleaning', 'Repairs', 'Airtime', 'Packaging', 'Security')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--out', required=True, help='SQLite file to create')
+    parser.add_argument('--products', type=int, default=2000)
+    parser.add_argument('--cashiers', type=int, default=8)
+    parser.add_argument('--years', type=float, default=2.0, help='years of history')
+    parser.add_argument('--per-day', type=int, default=250, help='transactions per weekday')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args(argv)
+
+    path = os.path.abspath(args.out)
+    if os.path.exists(path):
+        sys.exit(f"{path} already exists")
+    # Settings are read from the environment when app.py is imported
+    os.environ['DATABASE_URL'] = 'sqlite:///' + path
+    from app import app
+    from models import db
+
+    started = time.monotonic()
+    counts = generate(app, db, args.products, args.cashiers, args.years, args.per_day, args.seed)
+    print(f"{path}  {', '.join(f'{table}={n}' for table, n in counts.items())}  "
+          f"({time.monotonic() - started:.0f} s)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,310 @@
+"""
+End-to-end load test: cashiers and back-office users against a real
+waitress server, with sync to a local stand-in.
+
+    python -m utils.load_test                        # small generated dataset, 4 tills, 60 s
+    python -m utils.load_test --data loadtest.db --tills 8 --office 2 --seconds 300
+    python -m utils.load_test --compare load-results/<earlier run>.json
+
+--data is a database made by utils/load_data.py; without it a small one is
+generated first. Each run works on copies of it in a scratch directory: the
+shop database served by waitress with the app's own settings (as run.py
+does) and the stand-in server's database (utils/sync_standin.py), which
+starts out holding the same history.
+
+Workload, closed loop with optional think time:
+  till      scans 1-5 barcodes (popular products more often), records the
+            sale and loads the page the redirect leads to
+  office    dashboard, sales list, product search and date-range exports,
+            weighted by OFFICE_MIX
+  sync      one pusher calling /sync/push every --sync-every seconds
+
+Prints throughput and p50/p95/p99 latency per request type after the
+--warmup seconds, with checkouts also broken down by basket size
+(checkout_1 .. checkout_5), and saves them as JSON under load-results/
+(with the commit, settings and dataset size) so runs can be compared.
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import socket
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+from utils.db_bench import percentile
+from utils.load_data import LOAD_PASSWORD
+from utils.sync_standin import free_port, start_standin
+
+# (weight, request type) for back-office users
+OFFICE_MIX = [
+    (40, 'dashboard'),
+    (20, 'sales_list'),
+    (20, 'product_search'),
+    (10, 'export_csv'),
+    (5, 'export_xlsx'),
+    (5, 'export_products'),
+]
+SEARCH_TERMS = ('rice', 'milk', 'soap', 'tea', 'fresh', 'premium', 'oil', 'juice')
+
+
+def serve(port, sync_server, threads):
+    """Run the app under waitress, as run.py does (child process)."""
+    from waitress import serve as waitress_serve
+    from app import app
+    app.config['SYNC_SERVER_URL'] = sync_server
+    app.config['SYNC_INTERVAL'] = 0  # the workload's pusher drives sync
+    waitress_serve(app, host='127.0.0.1', port=port, threads=threads or app.config['WAITRESS_THREADS'])
+
+
+def _start_app(database_url, port, sync_server, threads):
+    env = dict(os.environ, DATABASE_URL=database_url)
+    proc = subprocess.Popen([sys.executable, '-m', 'utils.load_test', '--serve', '--port', str(port),
+                             '--sync-server', sync_server, '--threads', str(threads)],
+                            env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.time() + 60
+    while time.time() < deadline:
+        if proc.poll() is not None:
+            raise SystemExit("App server exited on startup")
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=0.5).close()
+            return proc
+        except OSError:
+            time.sleep(0.2)
+    proc.kill()
+    raise SystemExit("App server did not start")
+
+
+class Recorder:
+    """Latencies and errors per request type, ignoring the warm-up."""
+    def __init__(self, measure_from):
+        self.measure_from = measure_from
+        self.lock = threading.Lock()
+        self.latencies = {}
+        self.errors = {}
+
+    def timed(self, kind, send, *also):
+        """Time `send()` as `kind` and as each of `also`; the response, or None on failure."""
+        started = time.perf_counter()
+        try:
+            response = send()
+            ok = response.status_code < 400
+        except Exception:
+            response, ok = None, False
+        elapsed = time.perf_counter() - started
+        if time.monotonic() >= self.measure_from:
+            with self.lock:
+                for name in (kind,) + also:
+                    self.latencies.setdefault(name, []).append(elapsed)
+                    self.errors[name] = self.errors.get(name, 0) + (not ok)
+        return response if ok else None
+
+
+def _login(base, username):
+    import requests
+    http = requests.Session()
+    r = http.post(f'{base}/login', data={'username': username, 'password': LOAD_PASSWORD}, allow_redirects=False)
+    if r.status_code != 302 or 'session' not in http.cookies:
+        raise SystemExit(f"Could not log in as {username}")
+    return http
+
+
+def _till(base, username, catalogue, weights, recorder, deadline, think, rng):
+    http = _login(base, username)
+    while time.monotonic() < deadline:
+        lines = []
+        for product in rng.choices(catalogue, weights, k=rng.choice((1, 1, 2, 2, 3, 4, 5))):
+            r = recorder.timed('scan', lambda: http.get(f"{base}/product/barcode/{product['barcode']}"))
+            if r is not None:
+                lines.append(r.json())
+            time.sleep(think)
+        if not lines:
+            continue
+        r = recorder.timed('checkout', lambda: http.post(f'{base}/sale', allow_redirects=False, data={
+            'payment_type': rng.choice(('Cash', 'Card', 'Mobile Money')),
+            'product_id[]': [p['id'] for p in lines],
+            'quantity[]': [1] * len(lines),
+            'cost_price[]': [p['cost_price'] for p in lines],
+            'unit_price[]': [p['price'] for p in lines],
+        }), f'checkout_{len(lines)}')
+        if r is not None and r.status_code == 302:
+            recorder.timed('after_checkout', lambda: http.get(base + r.headers['Location']))
+        time.sleep(think)
+
+
+def _office(base, recorder, deadline, think, rng):
+    http = _login(base, 'loadadmin')
+    kinds, weights = zip(*((kind, weight) for weight, kind in OFFICE_MIX))
+    while time.monotonic() < deadline:
+        kind = rng.choices(kinds, weights)[0]
+        end = datetime.utcnow().date()
+        month = {'start_date': (end - timedelta(days=30)).isoformat(), 'end_date': end.isoformat()}
+        url, params = {
+            'dashboard': ('/dashboard', {}),
+            'sales_list': ('/sales', {}),
+            'product_search': ('/products', {'q': rng.choice(SEARCH_TERMS)}),
+            'export_csv': ('/export/sales', dict(month, format='csv')),
+            'export_xlsx': ('/export/sales', month),
+            'export_products': ('/export/products', {}),
+        }[kind]
+        recorder.timed(kind, lambda: http.get(base + url, params=params))
+        time.sleep(think)
+
+
+def _sync(base, recorder, deadline, every):
+    http = _login(base, 'loadadmin')
+    while time.monotonic() + every < deadline:
+        time.sleep(every)
+        recorder.timed('sync_push', lambda: http.post(f'{base}/sync/push'))
+
+
+def _git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _dataset(path):
+    with sqlite3.connect(path) as conn:
+        counts = {table: conn.execute(f'SELECT COUNT(*) FROM "{table}"').fetchone()[0]
+                  for table in ('product', 'sale_transaction', 'sale', 'expense')}
+        catalogue = [{'id': r[0], 'barcode': r[1]}
+                     for r in conn.execute('SELECT id, barcode FROM product WHERE barcode IS NOT NULL ORDER BY id')]
+        cashiers = [r[0] for r in conn.execute("SELECT username FROM user WHERE username LIKE 'cashier%' ORDER BY id")]
+    return counts, catalogue, cashiers
+
+
+def summarise(recorder, seconds):
+    """{request type: {requests, errors, per_second, p50_ms, p95_ms, p99_ms, mean_ms}}"""
+    summary = {}
+    for kind, latencies in sorted(recorder.latencies.items()):
+        ms = [v * 1000 for v in latencies]
+        summary[kind] = {
+            'requests': len(ms),
+            'errors': recorder.errors[kind],
+            'per_second': round(len(ms) / seconds, 2),
+            'p50_ms': round(percentile(ms, 50), 1),
+            'p95_ms': round(percentile(ms, 95), 1),
+            'p99_ms': round(percentile(ms, 99), 1),
+            'mean_ms': round(sum(ms) / len(ms), 1),
+        }
+    return summary
+
+
+def print_results(results, baseline=None):
+    print(f"commit {results['commit']}  tills={results['settings']['tills']} office={results['settings']['office']}  "
+          f"{results['settings']['seconds']} s  {', '.join(f'{t}={n}' for t, n in results['dataset'].items())}")
+    print(f"  {'request':<16} {'count':>7} {'err':>5} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+    for kind, r in results['endpoints'].items():
+        line = (f"  {kind:<16} {r['requests']:>7} {r['errors']:>5} {r['per_second']:>8.1f} "
+                f"{r['p50_ms']:>8.1f} {r['p95_ms']:>8.1f} {r['p99_ms']:>8.1f}")
+        before = (baseline or {}).get('endpoints', {}).get(kind)
+        if before:
+            line += (f"   was {before['per_second']:.1f}/s p95 {before['p95_ms']:.1f} "
+                     f"({(r['p95_ms'] - before['p95_ms']) / (before['p95_ms'] or 1) * 100:+.0f}%)")
+        print(line)
+
+
+def run(args):
+    workdir = tempfile.mkdtemp(prefix='load-test-')
+    data = args.data
+    if not data:
+        data = os.path.join(workdir, 'generated.db')
+        subprocess.run([sys.executable, '-m', 'utils.load_data', '--out', data, '--years', '0.5',
+                        '--products', '500', '--seed', str(args.seed)], check=True, stderr=subprocess.DEVNULL)
+    shop_db, server_db = os.path.join(workdir, 'shop.db'), os.path.join(workdir, 'server.db')
+    shutil.copyfile(data, shop_db)
+    shutil.copyfile(data, server_db)
+    counts, catalogue, cashiers = _dataset(shop_db)
+    if not catalogue or not cashiers:
+        raise SystemExit(f"{data} has no products with barcodes or no cashiers; make it with utils.load_data")
+
+    standin_port, app_port = free_port(), free_port()
+    standin = start_standin('sqlite:///' + server_db, standin_port)
+    server = None
+    try:
+        server = _start_app('sqlite:///' + shop_db, app_port, f'http://127.0.0.1:{standin_port}/api/sync',
+                            args.threads)
+        base = f'http://127.0.0.1:{app_port}'
+        weights = [1 / (k + 1) for k in range(len(catalogue))]
+        think = args.think / 1000
+        started = time.monotonic()
+        recorder = Recorder(started + args.warmup)
+        deadline = started + args.warmup + args.seconds
+
+        threads = [threading.Thread(target=_till, args=(base, cashiers[i % len(cashiers)], catalogue, weights,
+                                                         recorder, deadline, think, random.Random(args.seed + i)))
+                   for i in range(args.tills)]
+        threads += [threading.Thread(target=_office, args=(base, recorder, deadline, think,
+                                                           random.Random(args.seed + 1000 + i)))
+                    for i in range(args.office)]
+        if args.sync_every:
+            threads.append(threading.Thread(target=_sync, args=(base, recorder, deadline, args.sync_every)))
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+    finally:
+        for proc in (server, standin):
+            if proc is not None:
+                proc.terminate()
+                proc.wait()
+
+    return {
+        'commit': _git_commit(),
+        'finished': datetime.utcnow().isoformat(timespec='seconds'),
+        'settings': {k: getattr(args, k) for k in ('tills', 'office', 'seconds', 'warmup', 'think', 'sync_every',
+                                                   'threads', 'seed')},
+        'dataset': counts,
+        'endpoints': summarise(recorder, args.seconds),
+    }, workdir
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--data', help='database made by utils.load_data (default: generate a small one)')
+    parser.add_argument('--tills', type=int, default=4)
+    parser.add_argument('--office', type=int, default=1, help='back-office users')
+    parser.add_argument('--seconds', type=int, default=60, help='measured duration')
+    parser.add_argument('--warmup', type=int, default=5, help='seconds run before measuring')
+    parser.add_argument('--think', type=int, default=0, help='milliseconds between a user\'s requests')
+    parser.add_argument('--sync-every', type=int, default=15, help='seconds between pushes, 0 = no sync')
+    parser.add_argument('--threads', type=int, default=0, help='waitress threads (default WAITRESS_THREADS)')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--out', help='results file (default load-results/<time>-<commit>.json)')
+    parser.add_argument('--compare', help='earlier results file to compare with')
+    parser.add_argument('--serve', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--port', type=int, help=argparse.SUPPRESS)
+    parser.add_argument('--sync-server', help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.serve:
+        serve(args.port, args.sync_server, args.threads)
+        return
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    results, workdir = run(args)
+    print_results(results, baseline)
+
+    out = args.out or os.path.join(
+        'load-results', f"{datetime.utcnow():%Y%m%d-%H%M%S}-{results['commit'] or 'nogit'}.json")
+    os.makedirs(os.path.dirname(out) or '.', exist_ok=True)
+    with open(out, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f"  saved {out}; scratch databases in {workdir}")
+    if any(r['errors'] for r in results['endpoints'].values()):
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,230 @@
+"""
+Request and job instrumentation, exposed in Prometheus text format.
+
+Per request (labelled by endpoint) it records total latency, number of SQL
+statements, time spent in SQL and time spent rendering templates; SQL is
+timed by engine before/after_cursor_execute hooks, the rest by Flask's
+request and template signals. Background work (sync jobs, exports,
+backups) reports durations with `metrics.time_job()` or
+`metrics.observe_job()`.
+
+Requests slower than SLOW_REQUEST_MS (default 1000, 0 disables) are logged
+with their slowest statements and any statement repeated within the
+request, which is what an N+1 query looks like.
+
+Counters live in process memory and reset on restart.
+"""
+import logging
+import os
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from flask import g, has_request_context, request, request_finished, request_started, \
+    before_render_template, template_rendered
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500)
+JOB_BUCKETS = (0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0, 300.0, 600.0, 1800.0)
+
+# Statements kept per request for the slow-request log
+MAX_CAPTURED_STATEMENTS = 500
+
+
+class Histogram:
+    __slots__ = ('buckets', 'counts', 'sum', 'count')
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+        self.sum += value
+        self.count += 1
+
+
+class RequestStats:
+    __slots__ = ('started', 'queries', 'sql_seconds', 'render_seconds', 'render_started', 'statements')
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.sql_seconds = 0.0
+        self.render_seconds = 0.0
+        self.render_started = None
+        self.statements = []
+
+    def add_query(self, statement, seconds):
+        self.queries += 1
+        self.sql_seconds += seconds
+        if len(self.statements) < MAX_CAPTURED_STATEMENTS:
+            self.statements.append((seconds, statement))
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{k}="{_escape(v)}"' for k, v in labels) + '}'
+
+
+class Metrics:
+    def __init__(self, app=None):
+        self._lock = threading.Lock()
+        self._families = {}   # name -> (type, help, buckets)
+        self._series = {}     # name -> {labels tuple: Histogram or count}
+        self.histogram('http_request_duration_seconds', 'Request latency by endpoint.', LATENCY_BUCKETS)
+        self.histogram('http_request_db_queries', 'SQL statements per request.', QUERY_BUCKETS)
+        self.histogram('http_request_db_seconds', 'Time in SQL per request.', LATENCY_BUCKETS)
+        self.histogram('http_request_render_seconds', 'Template rendering time per request.', LATENCY_BUCKETS)
+        self.counter('http_requests_total', 'Requests by endpoint, method and status.')
+        self.counter('http_slow_requests_total', 'Requests over SLOW_REQUEST_MS.')
+        self.histogram('job_duration_seconds', 'Sync, export and backup job durations.', JOB_BUCKETS)
+        if app is not None:
+            self.init_app(app)
+
+    # ------------------------------------------------------------------
+    # Registry
+    # ------------------------------------------------------------------
+    def histogram(self, name, help, buckets):
+        self._families[name] = ('histogram', help, buckets)
+        self._series.setdefault(name, {})
+
+    def counter(self, name, help):
+        self._families[name] = ('counter', help, None)
+        self._series.setdefault(name, {})
+
+    def observe(self, name, value, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._series[name]
+            if key not in series:
+                series[key] = Histogram(self._families[name][2])
+            series[key].observe(value)
+
+    def inc(self, name, amount=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._series[name]
+            series[key] = series.get(key, 0) + amount
+
+    def observe_job(self, job, seconds, status='done'):
+        self.observe('job_duration_seconds', seconds, job=job, status=status)
+
+    @contextmanager
+    def time_job(self, job):
+        """Time the block as job `job`; an exception is recorded as status=failed."""
+        started = time.perf_counter()
+        status = 'failed'
+        try:
+            yield
+            status = 'done'
+        finally:
+            self.observe_job(job, time.perf_counter() - started, status)
+
+    def render(self):
+        """All series in Prometheus text exposition format (0.0.4)."""
+        lines = []
+        with self._lock:
+            for name, (kind, help, buckets) in self._families.items():
+                lines.append(f'# HELP {name} {help}')
+                lines.append(f'# TYPE {name} {kind}')
+                for labels, value in sorted(self._series[name].items()):
+                    if kind == 'counter':
+                        lines.append(f'{name}{_format_labels(labels)} {value}')
+                        continue
+                    for bound, count in zip(buckets, value.counts):
+                        lines.append(f'{name}_bucket{_format_labels(labels + (("le", bound),))} {count}')
+                    lines.append(f'{name}_bucket{_format_labels(labels + (("le", "+Inf"),))} {value.count}')
+                    lines.append(f'{name}_sum{_format_labels(labels)} {value.sum:.6f}')
+                    lines.append(f'{name}_count{_format_labels(labels)} {value.count}')
+        return '\n'.join(lines) + '\n'
+
+    # ------------------------------------------------------------------
+    # Flask / SQLAlchemy hooks
+    # ------------------------------------------------------------------
+    def init_app(self, app):
+        app.config.setdefault('SLOW_REQUEST_MS', int(os.environ.get('SLOW_REQUEST_MS', 1000)))
+        app.config.setdefault('SLOW_REQUEST_STATEMENTS', 10)  # statements shown per slow request
+        request_started.connect(self._request_started, app)
+        request_finished.connect(self._request_finished, app)
+        before_render_template.connect(self._render_started, app)
+        template_rendered.connect(self._render_finished, app)
+
+    def _request_started(self, app, **extra):
+        g._request_stats = RequestStats()
+
+    def _render_started(self, app, template, context, **extra):
+        stats = g.get('_request_stats')
+        if stats is not None:
+            stats.render_started = time.perf_counter()
+
+    def _render_finished(self, app, template, context, **extra):
+        stats = g.get('_request_stats')
+        if stats is not None and stats.render_started is not None:
+            stats.render_seconds += time.perf_counter() - stats.render_started
+            stats.render_started = None
+
+    def _request_finished(self, app, response, **extra):
+        stats = g.pop('_request_stats', None)
+        if stats is None:
+            return
+        elapsed = time.perf_counter() - stats.started
+        endpoint = request.endpoint or 'unmatched'
+        self.observe('http_request_duration_seconds', elapsed, endpoint=endpoint)
+        self.observe('http_request_db_queries', stats.queries, endpoint=endpoint)
+        self.observe('http_request_db_seconds', stats.sql_seconds, endpoint=endpoint)
+        self.observe('http_request_render_seconds', stats.render_seconds, endpoint=endpoint)
+        self.inc('http_requests_total', endpoint=endpoint, method=request.method, status=response.status_code)
+
+        threshold = app.config['SLOW_REQUEST_MS']
+        if threshold and elapsed * 1000 >= threshold:
+            self.inc('http_slow_requests_total', endpoint=endpoint)
+            self._log_slow(app, stats, elapsed)
+
+    def _log_slow(self, app, stats, elapsed):
+        limit = app.config['SLOW_REQUEST_STATEMENTS']
+        lines = [f"Slow request {request.method} {request.full_path.rstrip('?')} ({request.endpoint}): "
+                 f"{elapsed * 1000:.0f} ms total, {stats.queries} queries in {stats.sql_seconds * 1000:.0f} ms, "
+                 f"render {stats.render_seconds * 1000:.0f} ms"]
+        repeated = [(n, sql) for sql, n in Counter(sql for _, sql in stats.statements).most_common(limit) if n > 1]
+        for n, sql in repeated:
+            lines.append(f"  repeated {n}x: {' '.join(sql.split())}")
+        for seconds, sql in sorted(stats.statements, key=lambda s: s[0], reverse=True)[:limit]:
+            lines.append(f"  {seconds * 1000:8.1f} ms  {' '.join(sql.split())}")
+        logger.warning('\n'.join(lines))
+
+
+metrics = Metrics()
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _query_started(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _query_finished(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info['query_started'].pop()
+    if has_request_context():
+        stats = g.get('_request_stats')
+        if stats is not None:
+            stats.add_query(statement, time.perf_counter() - started)
+
+
+@event.listens_for(Engine, 'handle_error')
+def _query_failed(context):
+    if context.connection is not None and context.connection.info.get('query_started'):
+        context.connection.info['query_started'].pop()
@@ -0,0 +1,243 @@
+"""
+Bulk product import / restock from CSV or XLSX.
+
+The file is read in chunks of IMPORT_CHUNK_SIZE rows. Each chunk is
+validated column-wise with pandas, then applied in one transaction: new
+barcodes are inserted with a single executemany INSERT and existing ones
+updated with a single executemany UPDATE. Rejected rows are collected into
+an error report instead of failing the whole file.
+
+Columns (header names are case-insensitive): barcode (required), name,
+price, cost_price, quantity. New products need name, price and cost_price;
+for existing products blank cells keep the current value. Quantity is
+added to the current stock (stock_mode='add', a restock) or replaces it
+(stock_mode='set').
+"""
+import csv
+import time
+import uuid
+from datetime import datetime
+import pandas as pd
+from openpyxl import load_workbook
+from sqlalchemy import bindparam, func
+from models import db, Product
+from utils.catalog import catalog
+from utils import change_log
+
+IMPORT_CHUNK_SIZE = 2000
+
+COLUMNS = ['barcode', 'name', 'price', 'cost_price', 'quantity']
+ALIASES = {
+    'sku': 'barcode',
+    'product': 'name',
+    'product_name': 'name',
+    'unit_price': 'price',
+    'selling_price': 'price',
+    'cost': 'cost_price',
+    'qty': 'quantity',
+    'stock': 'quantity',
+}
+ERROR_REPORT_HEADER = ['row', 'barcode', 'error']
+
+
+def _normalise_header(name):
+    key = str(name or '').strip().lower().replace(' ', '_')
+    return ALIASES.get(key, key)
+
+
+def read_chunks(path, chunk_size=IMPORT_CHUNK_SIZE):
+    """
+    Yield DataFrames of at most `chunk_size` rows with COLUMNS as string
+    columns ('' for blank) and the spreadsheet row number as the index.
+    """
+    if path.lower().endswith('.xlsx'):
+        chunks = _xlsx_chunks(path, chunk_size)
+    else:
+        chunks = pd.read_csv(path, dtype=str, keep_default_na=False, chunksize=chunk_size,
+                             skipinitialspace=True)
+
+    first_row = 2  # row 1 is the header
+    for chunk in chunks:
+        chunk = chunk.rename(columns=_normalise_header)
+        for column in COLUMNS:
+            if column not in chunk.columns:
+                chunk[column] = ''
+        chunk = chunk[COLUMNS].fillna('').astype(str).apply(lambda s: s.str.strip())
+        chunk.index = range(first_row, first_row + len(chunk))
+        first_row += len(chunk)
+        yield chunk
+
+
+def _xlsx_chunks(path, chunk_size):
+    workbook = load_workbook(path, read_only=True, data_only=True)
+    try:
+        rows = workbook.active.iter_rows(values_only=True)
+        header = next(rows, None)
+        if header is None:
+            return
+        batch = []
+        for row in rows:
+            batch.append(['' if v is None else v for v in row])
+            if len(batch) == chunk_size:
+                yield pd.DataFrame(batch, columns=header)
+                batch = []
+        if batch:
+            yield pd.DataFrame(batch, columns=header)
+    finally:
+        workbook.close()
+
+
+def validate_chunk(chunk, seen, existing):
+    """
+    Vectorised checks on one chunk. `seen` maps barcodes from earlier rows
+    of the file to their row number; `existing` maps barcodes already in
+    the database to product ids. Returns (valid rows DataFrame with parsed
+    numbers, list of error dicts).
+    """
+    errors = pd.Series('', index=chunk.index, dtype=object)
+
+    def reject(mask, message):
+        mask = mask & (errors == '')
+        errors[mask] = message if isinstance(message, str) else message[mask]
+
+    barcode = chunk['barcode']
+    reject(barcode == '', "Missing barcode")
+
+    earlier = barcode.map(seen)
+    reject(earlier.notna(), "Duplicate barcode (first seen on row " + earlier.astype('Int64').astype(str) + ")")
+    first_in_chunk = pd.Series(chunk.index, index=chunk.index).groupby(barcode).transform('first')
+    reject(barcode.duplicated(keep='first') & (barcode != ''),
+           "Duplicate barcode (first seen on row " + first_in_chunk.astype(str) + ")")
+
+    is_new = ~barcode.isin(list(existing))
+    numbers = {}
+    for column, label in (('price', 'price'), ('cost_price', 'cost price')):
+        raw = chunk[column]
+        value = pd.to_numeric(raw, errors='coerce')
+        reject((raw != '') & value.isna(), f"Invalid {label}")
+        reject(value < 0, f"Negative {label}")
+        reject(is_new & (raw == ''), f"Missing {label} for new product")
+        numbers[column] = value
+
+    raw = chunk['quantity']
+    quantity = pd.to_numeric(raw, errors='coerce')
+    reject((raw != '') & (quantity.isna() | (quantity % 1 != 0)), "Invalid quantity")
+    reject(quantity < 0, "Negative quantity")
+    reject(is_new & (chunk['name'] == ''), "Missing name for new product")
+    numbers['quantity'] = quantity
+
+    # The first row with each barcode claims it, valid or not, so later
+    # duplicates are reported against it
+    claims = barcode[(barcode != '') & ~barcode.duplicated() & earlier.isna()]
+    seen.update(zip(claims.values, claims.index))
+
+    valid = chunk.assign(**numbers)[errors == '']
+    failed = [{'row': row, 'barcode': chunk.at[row, 'barcode'], 'error': message}
+              for row, message in errors[errors != ''].items()]
+    return valid, failed
+
+
+def _optional(value):
+    return None if pd.isna(value) else value
+
+
+def apply_chunk(valid, existing, stock_mode='add'):
+    """
+    Insert new barcodes and update existing ones in one transaction.
+    Returns (inserted, updated).
+    """
+    now = datetime.utcnow()
+    table = Product.__table__
+    inserts, updates = [], []
+    for row in valid.itertuples(index=False):
+        quantity = _optional(row.quantity)
+        if row.barcode in existing:
+            updates.append({
+                'pid': existing[row.barcode],
+                'new_name': row.name or None,
+                'new_price': _optional(row.price),
+                'new_cost': _optional(row.cost_price),
+                'qty': int(quantity) if quantity is not None else None,
+            })
+        else:
+            inserts.append({
+                'uuid': str(uuid.uuid4()),
+                'barcode': row.barcode,
+                'name': row.name,
+                'price': float(row.price),
+                'cost_price': float(row.cost_price),
+                'quantity': int(quantity) if quantity is not None else 0,
+                'timestamp': now,
+                'last_modified': now,
+                'synced': False,
+            })
+
+    try:
+        _write(table, inserts, updates, now, stock_mode)
+    except Exception:
+        db.session.rollback()
+        raise
+    return len(inserts), len(updates)
+
+
+def _write(table, inserts, updates, now, stock_mode):
+    if inserts:
+        db.session.execute(table.insert(), inserts)
+        change_log.record_uuids(db.session.connection(), 'Product', [row['uuid'] for row in inserts])
+    if updates:
+        if stock_mode == 'set':
+            new_quantity = func.coalesce(bindparam('qty'), table.c.quantity)
+        else:
+            new_quantity = table.c.quantity + func.coalesce(bindparam('qty'), 0)
+        db.session.execute(
+            table.update().where(table.c.id == bindparam('pid')).values(
+                name=func.coalesce(bindparam('new_name'), table.c.name),
+                price=func.coalesce(bindparam('new_price'), table.c.price),
+                cost_price=func.coalesce(bindparam('new_cost'), table.c.cost_price),
+                quantity=new_quantity,
+                last_modified=now,
+                synced=False,
+            ),
+            updates
+        )
+        catalog.mark_changed(db.session, [u['pid'] for u in updates])
+        change_log.record_ids(db.session, Product, [u['pid'] for u in updates])
+    db.session.commit()
+
+
+def import_products(path, stock_mode='add', chunk_size=IMPORT_CHUNK_SIZE, error_report=None):
+    """
+    Import the file at `path`. Rows that fail validation are written to
+    `error_report` (a CSV path) when given. Returns metrics for the run.
+    """
+    started = time.perf_counter()
+    seen = {}
+    metrics = {'rows': 0, 'inserted': 0, 'updated': 0, 'failed': 0, 'chunks': 0}
+    report = open(error_report, 'w', newline='') if error_report else None
+    writer = csv.DictWriter(report, fieldnames=ERROR_REPORT_HEADER) if report else None
+    if writer:
+        writer.writeheader()
+    try:
+        for chunk in read_chunks(path, chunk_size):
+            barcodes = [b for b in chunk['barcode'].unique() if b]
+            existing = dict(db.session.query(Product.barcode, Product.id).filter(Product.barcode.in_(barcodes)))
+
+            valid, failed = validate_chunk(chunk, seen, existing)
+            inserted, updated = apply_chunk(valid, existing, stock_mode)
+
+            metrics['rows'] += len(chunk)
+            metrics['inserted'] += inserted
+            metrics['updated'] += updated
+            metrics['failed'] += len(failed)
+            metrics['chunks'] += 1
+            if writer:
+                writer.writerows(failed)
+    finally:
+        if report:
+            report.close()
+        if metrics['inserted']:
+            catalog.invalidate()  # new ids are not known to the catalog
+
+    metrics['seconds'] = round(time.perf_counter() - started, 3)
+    metrics['rows_per_sec'] = round(metrics['rows'] / metrics['seconds']) if metrics['seconds'] else metrics['rows']
+    return metrics
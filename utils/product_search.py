@@ -0,0 +1,95 @@
+"""
+Product name/barcode search.
+
+On SQLite the product table is mirrored into an FTS5 index with the
+trigram tokenizer (product_fts), so substring searches are index lookups
+instead of a leading-wildcard LIKE over every row. Triggers keep it in
+sync with every write to product, including Core/bulk writes and backup
+restores. The index is created together with the product table
+(db.create_all) or by the migration for existing databases.
+
+Queries shorter than three characters cannot use trigrams and, like other
+backends, fall back to ILIKE.
+"""
+from sqlalchemy import DDL, Integer, column, event, func, select, table, text
+from models import db, Product
+
+FTS_TABLE = 'product_fts'
+MIN_TRIGRAM = 3
+
+_fts = table(FTS_TABLE, column('rowid', Integer), column('rank'))
+
+FTS_DDL = [
+    f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5("
+    f"name, barcode, content='product', content_rowid='id', tokenize='trigram')",
+    f"""CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ai AFTER INSERT ON product BEGIN
+        INSERT INTO {FTS_TABLE}(rowid, name, barcode) VALUES (new.id, new.name, new.barcode);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ad AFTER DELETE ON product BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, name, barcode) VALUES ('delete', old.id, old.name, old.barcode);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_au AFTER UPDATE OF name, barcode ON product BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, name, barcode) VALUES ('delete', old.id, old.name, old.barcode);
+        INSERT INTO {FTS_TABLE}(rowid, name, barcode) VALUES (new.id, new.name, new.barcode);
+    END""",
+]
+
+for _statement in FTS_DDL:
+    event.listen(Product.__table__, 'after_create', DDL(_statement).execute_if(dialect='sqlite'))
+
+
+def _fts_available():
+    return db.engine.dialect.name == 'sqlite'
+
+
+def _fts_phrase(text_):
+    # One quoted phrase: trigram FTS then matches it as a substring
+    return '"' + text_.replace('"', '""') + '"'
+
+
+def _match(text_):
+    return text(f'{FTS_TABLE} MATCH :fts_query').bindparams(fts_query=_fts_phrase(text_))
+
+
+def matching_ids_query(text_):
+    """
+    SELECT of the ids of products whose name or barcode contains `text_`,
+    for use as a subquery (e.g. Sale.product_id.in_(...)).
+    """
+    if _fts_available() and len(text_) >= MIN_TRIGRAM:
+        return select(_fts.c.rowid).where(_match(text_))
+    pattern = f'%{text_}%'
+    return select(Product.id).where(Product.name.ilike(pattern) | Product.barcode.ilike(pattern))
+
+
+def search_product_ids(text_, limit=None):
+    """
+    Ids of matching products, best first: exact barcode, then names
+    starting with `text_`, then other matches by FTS rank (by name
+    elsewhere).
+    """
+    text_ = text_.strip()
+    if not text_:
+        return []
+    prefix = func.lower(Product.name).startswith(text_.lower(), autoescape=True)
+    order = [(Product.barcode == text_).desc(), prefix.desc()]
+
+    if _fts_available() and len(text_) >= MIN_TRIGRAM:
+        query = select(Product.id).join(_fts, _fts.c.rowid == Product.id).where(_match(text_)) \
+            .order_by(*order, _fts.c.rank)
+    else:
+        query = select(Product.id).where(Product.id.in_(matching_ids_query(text_))) \
+            .order_by(*order, Product.name)
+    if limit:
+        query = query.limit(limit)
+    return list(db.session.execute(query).scalars())
+
+
+def rebuild_search_index():
+    """Recreate the FTS index from the product table (SQLite only)."""
+    if not _fts_available():
+        return
+    for statement in FTS_DDL:
+        db.session.execute(text(statement))
+    db.session.execute(text(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')"))
+    db.session.commit()
@@ -0,0 +1,238 @@
+"""
+Query budgets for the routes: an N+1 guard.
+
+    python -m utils.query_budget
+    python -m utils.query_budget --report      # print the counts, never fail
+
+Boots the app against a scratch SQLite database, seeds it and requests
+every route in ROUTES as an admin, counting the SQL statements each one
+executes (streamed bodies included). Then it seeds SCALE times more data
+(more products, users, sales and bigger transactions) and measures again.
+
+A route fails if it executes more statements than its budget, or if its
+count changes with the amount of data: a constant-query route stays the
+same however many rows it shows, while a lazy load per row (s.product in a
+loop, Product.query.get per line) grows with it. Writes that the ORM
+flushes one row at a time (an INSERT per sale line) declare a `per_line`
+allowance instead. Exits non-zero on failure.
+
+Add new routes to ROUTES with the count they need today as the budget.
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+from collections import Counter
+from datetime import datetime, timedelta
+
+SCALE = 4
+
+# (method, url, budget[, options]). {sale}, {transaction}, {product},
+# {expense}, {user} and {barcode} are filled in from the seeded data; the
+# transaction is the newest, which has the most lines, and the cart has as
+# many. Options: 'json' body, 'form': 'cart' to post the cart or 'edit' to
+# move every line of the transaction to a cart product, and 'per_line'
+# statements allowed per extra line. Mutating routes run last,
+# in this order.
+ROUTES = [
+    ('GET', '/dashboard', 6),
+    ('GET', '/products', 2),
+    ('GET', '/products/search?q=Budget', 3),
+    ('GET', '/product/barcode/{barcode}', 1),
+    ('GET', '/product/barcodes.json', 1),
+    ('GET', '/sale', 2),
+    ('GET', '/sales', 4),
+    ('GET', '/sales?q=Budget', 4),
+    ('GET', '/sales/more?cursor={transaction}', 4),
+    ('GET', '/receipt/{sale}', 4),
+    ('GET', '/receipt/transaction/{transaction}', 3),
+    ('GET', '/sale/{sale}/edit', 3),
+    ('GET', '/transaction/{transaction}/edit', 3),
+    ('GET', '/edit/{product}', 2),
+    ('GET', '/restock', 2),
+    ('GET', '/expenses', 3),
+    ('GET', '/expenses/edit/{expense}', 2),
+    ('GET', '/export', 5),
+    ('GET', '/export/sales?format=csv', 2),
+    ('GET', '/export/sales', 2),
+    ('GET', '/export/products', 2),
+    ('GET', '/admin/users', 2),
+    ('GET', '/admin/pending_users', 2),
+    ('GET', '/admin/users/edit/{user}', 2),
+    ('GET', '/backup/', 2),
+    ('GET', '/sync/status', 5),
+    ('POST', '/product/barcodes', 1, {'json': {'barcodes': ['{barcode}', 'missing']}}),
+    ('POST', '/sale', 14, {'form': 'cart', 'per_line': 1}),
+    ('POST', '/transaction/{transaction}/edit', 12, {'form': 'edit'}),
+    ('POST', '/transaction/{transaction}/delete', 10),
+]
+
+
+class QueryCounter:
+    """Counts statements executed on `engine` inside the with block."""
+    def __init__(self, engine):
+        self.engine = engine
+        self.statements = []
+
+    def _record(self, conn, cursor, statement, parameters, context, executemany):
+        self.statements.append(statement)
+
+    def __enter__(self):
+        from sqlalchemy import event
+        event.listen(self.engine, 'before_cursor_execute', self._record)
+        return self
+
+    def __exit__(self, *exc):
+        from sqlalchemy import event
+        event.remove(self.engine, 'before_cursor_execute', self._record)
+
+    @property
+    def count(self):
+        return len(self.statements)
+
+
+def seed(app, db, scale, rng):
+    """
+    Add `scale` units of data: users, products, expenses and transactions,
+    the newest of which has 2 * scale lines. Returns the ids routes use.
+    """
+    from models import User, Product, Sale, SaleTransaction, Expense
+    from werkzeug.security import generate_password_hash
+
+    with app.app_context():
+        offset = User.query.count()
+        users = [User(full_name=f'Budget user {offset + i}', email=f'budget{offset + i}@example.com',
+                      username=f'budget{offset + i}', password=generate_password_hash('budget'),
+                      role='admin', is_approved=True) for i in range(2 * scale)]
+        db.session.add_all(users)
+        offset = Product.query.count()
+        products = [Product(name=f'Budget product {offset + i}', quantity=10 ** 6, price=100.0, cost_price=60.0,
+                            barcode=f'BUDGET{offset + i:06d}') for i in range(10 * scale)]
+        db.session.add_all(products)
+        db.session.add_all([Expense(description=f'Budget expense {i}', amount=10.0, expense_date=datetime.utcnow())
+                            for i in range(10 * scale)])
+        db.session.commit()
+
+        now = datetime.utcnow()
+        for i in range(30 * scale):
+            lines = 2 * scale if i == 30 * scale - 1 else rng.randint(1, 3)
+            user = rng.choice(users)
+            tx = SaleTransaction(user_id=user.id, payment_type='Cash', customer_name='Budget',
+                                 timestamp=now - timedelta(minutes=30 * scale - i))
+            db.session.add(tx)
+            db.session.flush()
+            for product in rng.sample(products, lines):
+                db.session.add(Sale(product_id=product.id, quantity=1, unit_price=100.0, cost_price=60.0,
+                                    total_price=100.0, user_id=user.id, transaction_id=tx.id,
+                                    timestamp=tx.timestamp, payment_type='Cash', customer_name='Budget'))
+        db.session.commit()
+
+        return {
+            'transaction': tx.id,
+            'sale': Sale.query.filter_by(transaction_id=tx.id).first().id,
+            'transaction_sales': [s.id for s in Sale.query.filter_by(transaction_id=tx.id).order_by(Sale.id)],
+            'product': products[0].id,
+            'barcode': products[0].barcode,
+            'expense': Expense.query.order_by(Expense.id.desc()).first().id,
+            'user': users[1].id,
+            'session_user': users[0].id,
+            'lines': 2 * scale,
+            'cart': [p.id for p in products[:2 * scale]],
+        }
+
+
+def _fill(value, ids):
+    if isinstance(value, str):
+        return value.format(**ids)
+    if isinstance(value, list):
+        return [_fill(v, ids) for v in value]
+    if isinstance(value, dict):
+        return {k: _fill(v, ids) for k, v in value.items()}
+    return value
+
+
+def measure(app, db, client, ids):
+    """{(method, url template): (statements executed, HTTP status)}"""
+    # Warm the per-process caches (catalog, search index) so the first
+    # route is not charged for them
+    for method, url, *_ in ROUTES:
+        if method == 'GET':
+            client.get(_fill(url, ids)).get_data()
+
+    counts = {}
+    for method, url, budget, *data in ROUTES:
+        kwargs = {}
+        if data and 'json' in data[0]:
+            kwargs['json'] = _fill(data[0]['json'], ids)
+        elif data and data[0].get('form') == 'cart':
+            cart = ids['cart']
+            kwargs['data'] = {'customer_name': 'Budget', 'payment_type': 'Card', 'product_id[]': cart,
+                              'quantity[]': [1] * len(cart), 'cost_price[]': [60.0] * len(cart),
+                              'unit_price[]': [100.0] * len(cart)}
+        elif data and data[0].get('form') == 'edit':
+            kwargs['data'] = {'transaction_comments': 'Budget edit'}
+            for sale_id, product_id in zip(ids['transaction_sales'], ids['cart']):
+                kwargs['data'].update({f'sale_{sale_id}_product_id': product_id, f'sale_{sale_id}_quantity': 2})
+        with app.app_context():
+            engine = db.engine
+        with QueryCounter(engine) as counter:
+            response = client.open(_fill(url, ids), method=method, **kwargs)
+            response.get_data()
+        counts[(method, url)] = (counter.statements, response.status_code)
+    return counts
+
+
+def run(report=False, seed_value=1):
+    os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(tempfile.mkdtemp(prefix='query-budget-'), 'budget.db')
+    from app import app
+    from models import db
+
+    app.config['SYNC_INTERVAL'] = 0
+    with app.app_context():
+        db.create_all()
+    rng = random.Random(seed_value)
+
+    small_ids = seed(app, db, 1, rng)
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['_user_id'] = str(small_ids['session_user'])
+        session['_fresh'] = True
+    small = measure(app, db, client, small_ids)
+    large_ids = seed(app, db, SCALE, rng)
+    large = measure(app, db, client, large_ids)
+    extra_lines = large_ids['lines'] - small_ids['lines']
+
+    failures = []
+    print(f"{'route':48} {'budget':>6} {'x1':>5} {'x' + str(SCALE):>5}")
+    for method, url, budget, *data in ROUTES:
+        per_line = data[0].get('per_line', 0) if data else 0
+        (statements_a, status_a), (statements_b, status_b) = small[(method, url)], large[(method, url)]
+        a, b = len(statements_a), len(statements_b)
+        problems = [f"HTTP {status}" for status in sorted({status_a, status_b}) if status >= 400]
+        if a > budget:
+            problems.append(f"over budget ({a} > {budget})")
+        if b - a > per_line * extra_lines:
+            problems.append(f"grows with data ({a} -> {b}, {per_line * extra_lines} allowed)")
+        print(f"{method + ' ' + url:48} {budget:>6} {a:>5} {b:>5}  {'; '.join(problems) or 'ok'}")
+        if problems:
+            failures.append(f"{method} {url}: {'; '.join(problems)}")
+            for sql, n in Counter(statements_b).most_common():
+                if n > 1:
+                    print(f"    repeated {n}x: {' '.join(sql.split())[:160]}")
+    return [] if report else failures
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--report', action='store_true', help='print counts without failing')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args(argv)
+    failures = run(args.report, args.seed)
+    if failures:
+        print(f"{len(failures)} route(s) failed", file=sys.stderr)
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+import re
+from contextlib import closing, contextmanager
+from datetime import datetime
+from sqlalchemy import event
+from models import db, Product, Sale, SalesRollup
+from utils import change_log
+from utils.product_search import search_product_ids
+from utils.rollups import monthly_sales, monthly_expenses, sales_breakdown
+
+
+def _first(rows):
+    # A streamed helper executes its query on the first row
+    with closing(rows):
+        return next(rows, None)
+
+
+def _hot_queries():
+    """
+    The hot route helpers, each called the way its route calls it. Their
+    plans are read from the statements they actually execute, so a change
+    to a helper's query is checked without touching this list.
+    """
+    from api import get_last_sync
+    from routes.reports import _sales_export_rows
+    from routes.sales import _sales_page
+
+    since, until = datetime(2000, 1, 1), datetime.utcnow()
+    return {
+        'dashboard: whole history': lambda: (monthly_sales(), monthly_expenses()),
+        'dashboard: date range': lambda: (monthly_sales(since, until), monthly_expenses(since, until)),
+        'reports: sales by product and payment': lambda: (
+            sales_breakdown(SalesRollup.product_id, since, until),
+            sales_breakdown(SalesRollup.payment_type, since, until)),
+        'export: sales in date range': lambda: _first(_sales_export_rows(since, until)),
+        'sales_list: first page': lambda: _sales_page(),
+        'sales_list: next page': lambda: _sales_page(cursor='1'),
+        'sales_list: sales without a transaction': lambda: _sales_page(cursor='s1'),
+        'sales_list: product search': lambda: _sales_page('bench'),
+        'sales_list: receipt number search': lambda: _sales_page('1001'),
+        'product search': lambda: search_product_ids('bench', limit=20),
+        # Routes that query inline, without a helper
+        'receipt: sales of a transaction': lambda: Sale.query.filter_by(transaction_id=1).all(),
+        'product: barcode lookup': lambda: Product.query.filter_by(barcode='0').first(),
+        'sync: last sync lookup': lambda: get_last_sync('Sale'),
+        'sync push: change log after cursor': lambda: change_log.pending('Sale', 0, 500),
+    }
+
+
+@contextmanager
+def _captured_selects():
+    """(statement, parameters) of every SELECT run inside the with block."""
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith(('SELECT', 'WITH')):
+            statements.append((statement, parameters))
+
+    event.listen(db.engine, 'before_cursor_execute', record)
+    try:
+        yield statements
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', record)
+
+
+def _explain(statement, parameters):
+    """
+    Plan lines for `statement` and the subset that are full table scans.
+    """
+    prefix = 'EXPLAIN ' if db.engine.dialect.name == 'postgresql' else 'EXPLAIN QUERY PLAN '
+    rows = db.session.connection().exec_driver_sql(prefix + statement, parameters)
+    if db.engine.dialect.name == 'postgresql':
+        plan = [row[0] for row in rows]
+        return plan, [step for step in plan if 'Seq Scan' in step]
+    plan = [row[-1] for row in rows]
+    # Not full scans: the outer loop walking the table in ORDER BY order
+    # (no sort step) stops at the LIMIT, and an FTS MATCH is a virtual
+    # table scan with an index number
+    walk = bool(re.search(r'\bLIMIT\b', statement)) and not any('FOR ORDER BY' in step for step in plan)
+    return plan, [step for i, step in enumerate(plan)
+                  if step.startswith('SCAN ') and ' USING ' not in step
+                  and ' VIRTUAL TABLE INDEX ' not in step and not (walk and i == 0)]
+
+
+def explain_hot_queries():
+    """
+    Run every hot helper and EXPLAIN (EXPLAIN QUERY PLAN on SQLite) each
+    SELECT it executed. Returns {label: (plan lines, list of full table
+    scans)}, numbering the labels of helpers that run several statements.
+    """
+    results = {}
+    for label, call in _hot_queries().items():
+        with _captured_selects() as statements:
+            call()
+        for i, (statement, parameters) in enumerate(statements, start=1):
+            results[f'{label} #{i}' if len(statements) > 1 else label] = _explain(statement, parameters)
+    return results
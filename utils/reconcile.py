@@ -0,0 +1,233 @@
+"""
+Merkle-tree reconciliation with the sync server.
+
+Both sides hash each synced row as (uuid, last_modified) and arrange the
+hashes per model into one tree per creation-month bucket (the row's
+`timestamp`, which never changes). Leaves are the rows whose md5(uuid)
+starts with the same LEAF_DEPTH hex digits; every inner node hashes its
+16 children. To compare, the client fetches the server's bucket roots and
+walks down only the subtrees whose hashes differ, then exchanges the
+(uuid, last_modified) lists of the differing leaves. Traffic is about
+O(differences * log n) instead of the whole table.
+
+Repair: rows newer (or only present) locally are queued in the change log
+and pushed; rows newer (or only present) on the server are fetched by uuid
+and applied like a pull. Deleted rows look like rows missing on one side,
+so they come back; tombstones (utils/change_log.py) are how deletes sync,
+and rows with a tombstone still queued locally are never pulled back.
+
+Protocol, one endpoint per model: POST <server>/<endpoint>/merkle with
+one of
+    {}                            -> {"roots": {bucket: hash}, "depth": n}
+    {"nodes": [[bucket, prefix]]} -> {"hashes": {"bucket/prefix": hash}}
+    {"ranges": [[bucket, prefix]]}-> {"rows": {"bucket/prefix": {uuid: version}}}
+    {"uuids": [...]}              -> {"rows": [row dicts]}
+`answer()` implements the server side (see utils/sync_standin.py).
+"""
+import hashlib
+import json
+from collections import defaultdict
+from flask import current_app
+from sqlalchemy import select
+from api import ENDPOINT_MAP, MODEL_MAP, SYNC_STAGES, get_http, pull_batch, push_model
+from models import db, Product
+from utils import change_log
+from utils.catalog import catalog
+
+LEAF_DEPTH = 2  # 256 leaves per bucket
+FANOUT = '0123456789abcdef'
+
+
+def _digest(text):
+    return hashlib.sha256(text.encode()).hexdigest()[:16]
+
+
+def _slot(uuid):
+    return hashlib.md5(uuid.encode()).hexdigest()
+
+
+def row_version(last_modified):
+    """Canonical last_modified used in the hashes (naive UTC, microseconds)."""
+    return last_modified.isoformat(timespec='microseconds') if last_modified else ''
+
+
+class MerkleForest:
+    """
+    Hash trees of one model's rows, one per bucket. Node hashes are
+    computed once up front; an empty subtree hashes to ''.
+    """
+    def __init__(self, rows, depth=LEAF_DEPTH):
+        self.depth = depth
+        self.leaves = defaultdict(dict)  # bucket -> slot prefix -> {uuid: version}
+        for uuid, timestamp, last_modified in rows:
+            bucket = timestamp.strftime('%Y-%m') if timestamp else 'none'
+            self.leaves[bucket].setdefault(_slot(uuid)[:depth], {})[uuid] = row_version(last_modified)
+        self.hashes = {}
+        for bucket in self.leaves:
+            self._hash(bucket, '')
+
+    def _hash(self, bucket, prefix):
+        if len(prefix) == self.depth:
+            rows = self.leaves[bucket].get(prefix)
+            value = _digest(''.join(f'{u}|{v}\n' for u, v in sorted(rows.items()))) if rows else ''
+        else:
+            children = [self._hash(bucket, prefix + c) for c in FANOUT]
+            value = _digest(''.join(children)) if any(children) else ''
+        if value:
+            self.hashes[(bucket, prefix)] = value
+        return value
+
+    def roots(self):
+        return {bucket: self.hashes[(bucket, '')] for bucket in self.leaves}
+
+    def node(self, bucket, prefix):
+        return self.hashes.get((bucket, prefix), '')
+
+    def range(self, bucket, prefix):
+        """{uuid: version} of every row under the node (bucket, prefix)."""
+        rows = {}
+        for slot, leaf in self.leaves.get(bucket, {}).items():
+            if slot.startswith(prefix):
+                rows.update(leaf)
+        return rows
+
+
+def build_forest(model_cls, depth=LEAF_DEPTH):
+    table = model_cls.__table__
+    rows = db.session.execute(select(table.c.uuid, table.c.timestamp, table.c.last_modified)).all()
+    return MerkleForest(((r.uuid, r.timestamp, r.last_modified) for r in rows if r.uuid), depth)
+
+
+def _key(bucket, prefix):
+    return f'{bucket}/{prefix}'
+
+
+def answer(model_cls, payload, row_to_dict):
+    """Server side of the protocol: the response to one /merkle request."""
+    if payload.get('uuids'):
+        rows = model_cls.query.filter(model_cls.uuid.in_(payload['uuids'])).all()
+        return {'rows': [row_to_dict(row) for row in rows]}
+    forest = build_forest(model_cls, payload.get('depth', LEAF_DEPTH))
+    if 'nodes' in payload:
+        return {'hashes': {_key(b, p): forest.node(b, p) for b, p in payload['nodes']}}
+    if 'ranges' in payload:
+        return {'rows': {_key(b, p): forest.range(b, p) for b, p in payload['ranges']}}
+    return {'roots': forest.roots(), 'depth': forest.depth}
+
+
+class _Remote:
+    """One model's /merkle endpoint, counting bytes both ways."""
+    def __init__(self, server, endpoint):
+        self.http = get_http()
+        self.url = f'{server}/{endpoint}/merkle'
+        self.requests = 0
+        self.bytes = 0
+
+    def ask(self, payload):
+        body = json.dumps(dict(payload, depth=LEAF_DEPTH), separators=(',', ':'))
+        r = self.http.post(self.url, data=body, headers={'Content-Type': 'application/json'},
+                           timeout=current_app.config.get('SYNC_TIMEOUT', 10))
+        r.raise_for_status()
+        self.requests += 1
+        self.bytes += len(body) + len(r.content)
+        return r.json()
+
+
+def compare(remote, local):
+    """
+    Walk both forests down to the differing ranges. Returns
+    (buckets compared, differing buckets, {uuid: local version},
+    {uuid: remote version}) restricted to the differing ranges.
+    """
+    remote_roots = remote.ask({})['roots']
+    buckets = sorted(set(remote_roots) | set(local.roots()))
+
+    # Descend where both sides have the subtree and it differs; a subtree
+    # missing on one side, or a leaf, is a range to compare row by row
+    frontier, ranges = [], []
+    for b in buckets:
+        mine, theirs = local.node(b, ''), remote_roots.get(b, '')
+        if mine != theirs:
+            (frontier if mine and theirs else ranges).append((b, ''))
+    differing_buckets = len(frontier) + len(ranges)
+
+    while frontier:
+        children = [(b, p + c) for b, p in frontier for c in FANOUT]
+        hashes = remote.ask({'nodes': children})['hashes']
+        frontier = []
+        for b, p in children:
+            mine, theirs = local.node(b, p), hashes.get(_key(b, p), '')
+            if mine == theirs:
+                continue
+            if mine and theirs and len(p) < local.depth:
+                frontier.append((b, p))
+            else:
+                ranges.append((b, p))
+
+    local_rows, remote_rows = {}, {}
+    if ranges:
+        answered = remote.ask({'ranges': ranges})['rows']
+        for b, p in ranges:
+            local_rows.update(local.range(b, p))
+            remote_rows.update(answered.get(_key(b, p), {}))
+    return len(buckets), differing_buckets, local_rows, remote_rows
+
+
+def reconcile_model(server, model_name, model_cls, repair=True, batch_size=500):
+    """
+    Compare one model with the server and, with `repair`, push the rows
+    the server is missing or has older and pull the ones it has newer.
+    """
+    remote = _Remote(server, ENDPOINT_MAP[model_name])
+    local = build_forest(model_cls)
+    buckets, differing, local_rows, remote_rows = compare(remote, local)
+    # Rows deleted here whose tombstone is still queued are missing locally
+    # on purpose; pulling them back would undo the delete
+    deleted = change_log.pending_deletes(model_name)
+    to_push = sorted(u for u, v in local_rows.items() if u not in remote_rows or v > remote_rows[u])
+    to_pull = sorted(u for u, v in remote_rows.items()
+                     if u not in deleted and (u not in local_rows or v > local_rows[u]))
+    stats = {
+        'rows': sum(len(leaf) for leaves in local.leaves.values() for leaf in leaves.values()),
+        'buckets': buckets,
+        'differing_buckets': differing,
+        'to_push': len(to_push),
+        'to_pull': len(to_pull),
+    }
+
+    if repair and (to_push or deleted):
+        # Also sends the pending tombstones, before anything is pulled
+        change_log.record_uuids(db.session.connection(), model_name, to_push)
+        db.session.commit()
+        rows, chunks, error = push_model(server, model_name, model_cls, batch_size)
+        if error:
+            raise RuntimeError(f"Push failed: {error}")
+    if repair and to_pull:
+        for i in range(0, len(to_pull), batch_size):
+            rows = remote.ask({'uuids': to_pull[i:i + batch_size]})['rows']
+            pull_batch(model_name, model_cls, rows)
+            db.session.commit()
+        if model_cls is Product:
+            catalog.invalidate()  # bulk writes skip the ORM events
+
+    stats['requests'] = remote.requests
+    stats['bytes'] = remote.bytes
+    return stats
+
+
+def reconcile(repair=True):
+    """
+    Reconcile every synced model with SYNC_SERVER_URL, parents first.
+    Returns ({model: stats}, {model: error}).
+    """
+    server = current_app.config.get('SYNC_SERVER_URL', "http://localhost:5001/api/sync")
+    batch_size = current_app.config.get('SYNC_CHUNK_SIZE', 500)
+    stats, errors = {}, {}
+    for stage in SYNC_STAGES:
+        for model_name in stage:
+            try:
+                stats[model_name] = reconcile_model(server, model_name, MODEL_MAP[model_name], repair, batch_size)
+            except Exception as e:
+                db.session.rollback()
+                errors[model_name] = str(e)
+    return stats, errors
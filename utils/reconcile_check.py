@@ -0,0 +1,148 @@
+"""
+End-to-end check of Merkle reconciliation against a local stand-in server.
+
+    python -m utils.reconcile_check
+    python -m utils.reconcile_check --products 200 --history 20000 --drift 25
+
+Seeds a scratch shop database, pushes it to a fresh stand-in server
+(utils/sync_standin.py), then introduces `--drift` deliberate differences
+of every kind: rows changed locally behind the change log's back, rows
+changed on the server, rows missing on either side, and rows deleted
+locally whose tombstone has not been pushed yet.
+Reconciliation must find and repair all of them without resurrecting
+the deleted rows, after which both databases hold the same
+(uuid, last_modified) for every row and a second pass finds nothing.
+Prints the traffic of each pass; exits non-zero on failure.
+"""
+import argparse
+import json
+import os
+import random
+import tempfile
+from datetime import datetime, timedelta
+from utils.sync_standin import free_port, start_standin
+
+
+def _drift(local_engine, server_engine, count, rng):
+    """
+    Make `count` differences of each kind. Returns what was changed.
+    """
+    from sqlalchemy import text
+    later = datetime.utcnow() + timedelta(hours=1)
+    made = {}
+    with local_engine.begin() as local, server_engine.begin() as server:
+        # Changed locally without a change-log entry (a lost push)
+        ids = [r[0] for r in local.execute(text("SELECT id FROM product ORDER BY id"))]
+        picked = rng.sample(ids, min(count, len(ids)))
+        for pid in picked:
+            local.execute(text("UPDATE product SET price = price + 1, last_modified = :t WHERE id = :id"),
+                          {'t': later, 'id': pid})
+        made['local_updates'] = len(picked)
+
+        # Changed on the server after the last pull
+        picked = rng.sample([i for i in ids if i not in picked], min(count, len(ids) - len(picked)))
+        for pid in picked:
+            server.execute(text("UPDATE product SET name = name || ' (server)', last_modified = :t WHERE id = :id"),
+                           {'t': later, 'id': pid})
+        made['server_updates'] = len(picked)
+
+        # Lost on the server / lost locally
+        sale_ids = [r[0] for r in local.execute(text("SELECT id FROM sale ORDER BY id"))]
+        picked = rng.sample(sale_ids, min(2 * count, len(sale_ids)))
+        lost_remote, lost_local = picked[:count], picked[count:]
+        server.execute(text(f"DELETE FROM sale WHERE id IN ({','.join(map(str, lost_remote))})"))
+        local.execute(text(f"DELETE FROM sale WHERE id IN ({','.join(map(str, lost_local))})"))
+        made['server_missing'] = len(lost_remote)
+        made['local_missing'] = len(lost_local)
+
+        # Deleted locally, tombstone not pushed yet: must stay deleted
+        from utils import change_log
+        kept = [i for i in sale_ids if i not in picked]
+        deleted = rng.sample(kept, min(count, len(kept)))
+        id_list = ','.join(map(str, deleted))
+        uuids = [r[0] for r in local.execute(text(f"SELECT uuid FROM sale WHERE id IN ({id_list})"))]
+        local.execute(text(f"DELETE FROM sale WHERE id IN ({id_list})"))
+        change_log.record_uuids(local, 'Sale', uuids, 'delete')
+        made['local_deleted'] = len(uuids)
+    return made
+
+
+def _versions(engine, table):
+    from sqlalchemy import text
+    with engine.connect() as conn:
+        return dict(conn.execute(text(f'SELECT uuid, last_modified FROM "{table}"')).all())
+
+
+def run(products, history, drift, seed):
+    workdir = tempfile.mkdtemp(prefix='reconcile-check-')
+    local_url = 'sqlite:///' + os.path.join(workdir, 'shop.db')
+    server_url = 'sqlite:///' + os.path.join(workdir, 'server.db')
+    port = free_port()
+
+    os.environ['DATABASE_URL'] = local_url
+    from app import app
+    from models import db
+    from sqlalchemy import create_engine
+    from api import push_changes
+    from utils.db_bench import seed_database
+    from utils.reconcile import reconcile
+
+    app.config['SYNC_SERVER_URL'] = f'http://127.0.0.1:{port}/api/sync'
+    seed_database(app, db, products=products, history=history)
+    standin = start_standin(server_url, port)
+    failures = []
+    try:
+        with app.app_context():
+            _, errors = push_changes()
+            assert not errors, errors
+
+            passes = {}
+            passes['in sync'] = reconcile(repair=False)
+            made = _drift(db.engine, create_engine(server_url), drift, random.Random(seed))
+            passes['repair'] = reconcile(repair=True)
+            passes['after repair'] = reconcile(repair=False)
+
+            for label, (stats, errors) in passes.items():
+                found = sum(s['to_push'] + s['to_pull'] for s in stats.values())
+                traffic = sum(s['bytes'] for s in stats.values())
+                requests = sum(s['requests'] for s in stats.values())
+                print(f"{label:13} differences={found:<6} requests={requests:<4} bytes={traffic}")
+                if errors:
+                    failures.append(f"{label}: {errors}")
+            print("drift:", json.dumps(made))
+
+            expected = made['local_updates'] + made['server_updates'] + made['server_missing'] + made['local_missing']
+            repaired = sum(s['to_push'] + s['to_pull'] for s in passes['repair'][0].values())
+            if repaired != expected:
+                failures.append(f"repair found {repaired} differences, expected {expected}")
+            for label in ('in sync', 'after repair'):
+                if any(s['to_push'] or s['to_pull'] for s in passes[label][0].values()):
+                    failures.append(f"{label}: differences remain")
+
+            for table in ('user', 'product', 'expense', 'sale', 'sale_transaction'):
+                if _versions(db.engine, table) != _versions(create_engine(server_url), table):
+                    failures.append(f"{table}: databases differ after repair")
+    finally:
+        standin.terminate()
+        standin.wait()
+    return failures
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--products', type=int, default=100)
+    parser.add_argument('--history', type=int, default=5000, help='sales to seed')
+    parser.add_argument('--drift', type=int, default=10, help='differences of each kind to introduce')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args(argv)
+
+    failures = run(args.products, args.history, args.drift, args.seed)
+    for failure in failures:
+        print("FAIL", failure)
+    if failures:
+        raise SystemExit(1)
+    print("ok")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,246 @@
+from collections import defaultdict
+from datetime import datetime
+from sqlalchemy import event, func, inspect
+from sqlalchemy.orm import Session
+from models import db, Sale, Expense, SalesRollup, ExpenseRollup
+from utils.database import period_bucket, upsert
+
+PERIOD_FORMATS = {
+    'day': '%Y-%m-%d',
+    'month': '%Y-%m',
+}
+
+
+def _buckets(ts):
+    ts = ts or datetime.utcnow()
+    return [(period, ts.strftime(fmt)) for period, fmt in PERIOD_FORMATS.items()]
+
+
+def _old_value(obj, attr):
+    """
+    Value of `attr` as it was before the pending change (or the current
+    value if it was not modified).
+    """
+    hist = inspect(obj).attrs[attr].history
+    if hist.deleted:
+        return hist.deleted[0]
+    if hist.unchanged:
+        return hist.unchanged[0]
+    return getattr(obj, attr)
+
+
+def _getter(obj, old=False):
+    if isinstance(obj, dict):
+        return obj.get
+    if old:
+        return lambda attr: _old_value(obj, attr)
+    return lambda attr: getattr(obj, attr)
+
+
+class _Deltas:
+    """
+    Signed bucket deltas for a batch of Sale/Expense changes. Rows can be
+    ORM objects or plain column dicts (as used by the bulk sync pull).
+    """
+    def __init__(self):
+        self.sales = defaultdict(lambda: [0.0, 0.0, 0, 0])
+        self.expenses = defaultdict(lambda: [0.0, 0])
+
+    def add_sale(self, get, sign):
+        quantity = get('quantity') or 0
+        revenue, cogs = get('total_price') or 0, (get('cost_price') or 0) * quantity
+        for period, bucket in _buckets(get('timestamp')):
+            d = self.sales[(period, bucket, get('product_id'), get('payment_type') or '')]
+            d[0] += sign * revenue
+            d[1] += sign * cogs
+            d[2] += sign * quantity
+            d[3] += sign
+
+    def add_expense(self, get, sign):
+        amount = get('amount') or 0
+        for key in _buckets(get('expense_date')):
+            d = self.expenses[key]
+            d[0] += sign * amount
+            d[1] += sign
+
+    def add(self, model_cls, row, sign, old=False):
+        if model_cls is Sale:
+            self.add_sale(_getter(row, old), sign)
+        elif model_cls is Expense:
+            self.add_expense(_getter(row, old), sign)
+
+
+def _collect_deltas(session):
+    deltas = _Deltas()
+
+    for obj in session.new:
+        deltas.add(type(obj), obj, 1)
+
+    for obj in session.dirty:
+        if isinstance(obj, (Sale, Expense)) and session.is_modified(obj, include_collections=False):
+            deltas.add(type(obj), obj, -1, old=True)
+            deltas.add(type(obj), obj, 1)
+
+    for obj in session.deleted:
+        deltas.add(type(obj), obj, -1, old=True)
+
+    return deltas.sales, deltas.expenses
+
+
+def _apply_deltas(connection, sales, expenses):
+    sales_rows = [
+        {'period': k[0], 'bucket': k[1], 'product_id': k[2], 'payment_type': k[3],
+         'revenue': v[0], 'cogs': v[1], 'quantity': v[2], 'sale_count': v[3]}
+        for k, v in sales.items() if any(v)
+    ]
+    if sales_rows:
+        stmt = upsert(connection, SalesRollup.__table__)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=['period', 'bucket', 'product_id', 'payment_type'],
+            set_={
+                'revenue': SalesRollup.__table__.c.revenue + stmt.excluded.revenue,
+                'cogs': SalesRollup.__table__.c.cogs + stmt.excluded.cogs,
+                'quantity': SalesRollup.__table__.c.quantity + stmt.excluded.quantity,
+                'sale_count': SalesRollup.__table__.c.sale_count + stmt.excluded.sale_count,
+            }
+        )
+        connection.execute(stmt, sales_rows)
+
+    expense_rows = [
+        {'period': k[0], 'bucket': k[1], 'amount': v[0], 'expense_count': v[1]}
+        for k, v in expenses.items() if any(v)
+    ]
+    if expense_rows:
+        stmt = upsert(connection, ExpenseRollup.__table__)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=['period', 'bucket'],
+            set_={
+                'amount': ExpenseRollup.__table__.c.amount + stmt.excluded.amount,
+                'expense_count': ExpenseRollup.__table__.c.expense_count + stmt.excluded.expense_count,
+            }
+        )
+        connection.execute(stmt, expense_rows)
+
+
+@event.listens_for(Session, 'after_flush')
+def _update_rollups(session, flush_context):
+    """
+    Fold every pending Sale/Expense insert, update and delete into the
+    rollup buckets inside the same transaction as the change itself.
+    """
+    sales, expenses = _collect_deltas(session)
+    if sales or expenses:
+        _apply_deltas(session.connection(), sales, expenses)
+
+
+def fold_rows(model_cls, old_rows, new_rows):
+    """
+    Apply rollup deltas for changes written outside the ORM unit of work
+    (bulk inserts/updates). `old_rows` are the replaced rows, `new_rows`
+    the written ones, both as column dicts.
+    """
+    if model_cls not in (Sale, Expense):
+        return
+    deltas = _Deltas()
+    for row in old_rows:
+        deltas.add(model_cls, row, -1)
+    for row in new_rows:
+        deltas.add(model_cls, row, 1)
+    _apply_deltas(db.session.connection(), deltas.sales, deltas.expenses)
+
+
+def rebuild_rollups():
+    """
+    Recompute every rollup bucket from the Sale and Expense tables.
+    """
+    db.session.query(SalesRollup).delete()
+    db.session.query(ExpenseRollup).delete()
+
+    for period in PERIOD_FORMATS:
+        bucket = period_bucket(Sale.timestamp, period)
+        payment_type = func.coalesce(Sale.payment_type, '')
+        rows = db.session.query(
+            bucket, Sale.product_id, payment_type,
+            func.sum(Sale.total_price), func.sum(Sale.cost_price * Sale.quantity),
+            func.sum(Sale.quantity), func.count(Sale.id)
+        ).group_by(bucket, Sale.product_id, payment_type).all()
+        if rows:
+            db.session.execute(SalesRollup.__table__.insert(), [
+                {'period': period, 'bucket': r[0], 'product_id': r[1], 'payment_type': r[2],
+                 'revenue': r[3] or 0, 'cogs': r[4] or 0, 'quantity': r[5] or 0, 'sale_count': r[6]}
+                for r in rows
+            ])
+
+        bucket = period_bucket(Expense.expense_date, period)
+        rows = db.session.query(
+            bucket, func.sum(Expense.amount), func.count(Expense.id)
+        ).group_by(bucket).all()
+        if rows:
+            db.session.execute(ExpenseRollup.__table__.insert(), [
+                {'period': period, 'bucket': r[0], 'amount': r[1] or 0, 'expense_count': r[2]}
+                for r in rows
+            ])
+
+    db.session.commit()
+
+
+def _bucket_range(query, model, start_date=None, end_date=None):
+    """
+    Whole history reads the month buckets; a date filter reads the day
+    buckets inside the range and folds them into months.
+    """
+    if start_date is None and end_date is None:
+        return query.filter(model.period == 'month'), model.bucket
+    query = query.filter(model.period == 'day')
+    if start_date:
+        query = query.filter(model.bucket >= start_date.strftime('%Y-%m-%d'))
+    if end_date:
+        query = query.filter(model.bucket <= end_date.strftime('%Y-%m-%d'))
+    return query, func.substr(model.bucket, 1, 7)
+
+
+def monthly_sales_query(start_date=None, end_date=None):
+    """
+    (month, monthly_sales, monthly_cogs) rows ordered by month.
+    """
+    query, month = _bucket_range(db.session.query(SalesRollup), SalesRollup, start_date, end_date)
+    return query.with_entities(
+        month.label('month'),
+        func.sum(SalesRollup.revenue).label('monthly_sales'),
+        func.sum(SalesRollup.cogs).label('monthly_cogs')
+    ).group_by(month).having(func.sum(SalesRollup.sale_count) > 0).order_by(month)
+
+
+def monthly_expenses_query(start_date=None, end_date=None):
+    """
+    (month, monthly_expenses) rows ordered by month.
+    """
+    query, month = _bucket_range(db.session.query(ExpenseRollup), ExpenseRollup, start_date, end_date)
+    return query.with_entities(
+        month.label('month'),
+        func.sum(ExpenseRollup.amount).label('monthly_expenses')
+    ).group_by(month).having(func.sum(ExpenseRollup.expense_count) > 0).order_by(month)
+
+
+def monthly_sales(start_date=None, end_date=None):
+    return monthly_sales_query(start_date, end_date).all()
+
+
+def monthly_expenses(start_date=None, end_date=None):
+    return monthly_expenses_query(start_date, end_date).all()
+
+
+def sales_breakdown(group_column, start_date=None, end_date=None):
+    """
+    Revenue, COGS, quantity and sale count per `group_column`
+    (SalesRollup.product_id or SalesRollup.payment_type).
+    """
+    query, _ = _bucket_range(db.session.query(SalesRollup), SalesRollup, start_date, end_date)
+    return query.with_entities(
+        group_column.label('key'),
+        func.sum(SalesRollup.revenue).label('revenue'),
+        func.sum(SalesRollup.cogs).label('cogs'),
+        func.sum(SalesRollup.quantity).label('quantity'),
+        func.sum(SalesRollup.sale_count).label('sale_count')
+    ).group_by(group_column).having(func.sum(SalesRollup.sale_count) > 0) \
+        .order_by(func.sum(SalesRollup.revenue).desc()).all()
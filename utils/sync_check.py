@@ -0,0 +1,169 @@
+"""
+End-to-end check of the staged, concurrent push against a local stand-in
+server, including its retry and failure handling.
+
+    python -m utils.sync_check
+    python -m utils.sync_check --products 500 --history 20000
+
+Seeds a scratch shop database and pushes it three times, each time to a
+fresh stand-in (utils/sync_standin.py) with the whole database queued
+again in the change log:
+
+  staged   every request delayed: the models of a stage must overlap, and
+           no stage may start before the previous one has finished
+  retry    the first requests to each URL answered with 503: the shared
+           session's Retry must absorb them and the push must succeed
+  failed   the products endpoint failing with 500: Product must fail, Sale
+           (which references it) must be skipped without a request, and
+           the other models must still arrive
+
+After each push the server must hold every row of the models that
+succeeded. Prints what each scenario saw; exits non-zero on failure.
+"""
+import argparse
+import os
+import tempfile
+from datetime import datetime
+from utils.sync_standin import free_port, start_standin
+
+DELAY_MS = 200
+FLAKY = 2
+
+
+def _uuids(engine, table):
+    from sqlalchemy import text
+    with engine.connect() as conn:
+        return {r[0] for r in conn.execute(text(f'SELECT uuid FROM "{table}"'))}
+
+
+def _push(app, workdir, name, *standin_args):
+    """Requeue everything, push to a fresh stand-in. Returns (stats, errors, request log, server url)."""
+    from api import get_http, push_changes
+    from utils import change_log
+
+    server_url = 'sqlite:///' + os.path.join(workdir, f'{name}.db')
+    port = free_port()
+    standin = start_standin(server_url, port, *standin_args)
+    try:
+        with app.app_context():
+            app.config['SYNC_SERVER_URL'] = f'http://127.0.0.1:{port}/api/sync'
+            change_log.enqueue_unsynced(everything=True)
+            stats, errors = push_changes()
+            log = get_http().get(f'http://127.0.0.1:{port}/api/sync/_requests', timeout=10).json()
+    finally:
+        standin.terminate()
+        standin.wait()
+    return stats, errors, log, server_url
+
+
+def _model_of(path):
+    from api import ENDPOINT_MAP
+    endpoint = path.split('/api/sync/', 1)[1].split('/', 1)[0]
+    return {v: k for k, v in ENDPOINT_MAP.items()}.get(endpoint)
+
+
+def _missing(app, db, server_url, models):
+    """Models whose rows are not all on the server."""
+    from sqlalchemy import create_engine
+    from api import MODEL_MAP
+    server = create_engine(server_url)
+    with app.app_context():
+        return [m for m in models
+                if _uuids(db.engine, MODEL_MAP[m].__tablename__) - _uuids(server, MODEL_MAP[m].__tablename__)]
+
+
+def check_staged(app, db, workdir):
+    from api import SYNC_STAGES
+    stats, errors, log, server_url = _push(app, workdir, 'staged', '--delay-ms', str(DELAY_MS))
+    failures = [f"push errors: {errors}"] if errors else []
+
+    spans = {}
+    for entry in log:
+        model = _model_of(entry['path'])
+        spans.setdefault(model, []).append((entry['started'], entry['finished']))
+    for before, after in zip(SYNC_STAGES, SYNC_STAGES[1:]):
+        done = max((f for m in before for _, f in spans.get(m, [])), default=None)
+        begun = min((s for m in after for s, _ in spans.get(m, [])), default=None)
+        if done is not None and begun is not None and begun < done:
+            failures.append(f"{after} started before {before} finished")
+    first = [spans[m] for m in SYNC_STAGES[0] if m in spans]
+    overlapped = any(s1 < f2 and s2 < f1
+                     for i, a in enumerate(first) for b in first[i + 1:] for s1, f1 in a for s2, f2 in b)
+    if not overlapped:
+        failures.append(f"models of {SYNC_STAGES[0]} did not run concurrently")
+    missing = _missing(app, db, server_url, stats)
+    if missing:
+        failures.append(f"rows missing on the server: {missing}")
+    print(f"staged   {len(log)} requests, "
+          f"{sum(s['rows'] for s in stats.values())} rows, first stage concurrent={overlapped}")
+    return failures
+
+
+def check_retry(app, db, workdir):
+    stats, errors, log, server_url = _push(app, workdir, 'retry', '--flaky', str(FLAKY))
+    failures = [f"push errors: {errors}"] if errors else []
+    retried = sum(1 for entry in log if entry['status'] == 503)
+    if not retried:
+        failures.append("the stand-in never answered 503")
+    missing = _missing(app, db, server_url, stats)
+    if missing:
+        failures.append(f"rows missing on the server: {missing}")
+    print(f"retry    {retried} x 503 absorbed, {len(log)} requests, "
+          f"{sum(s['rows'] for s in stats.values())} rows")
+    return failures
+
+
+def check_failed_parent(app, db, workdir):
+    from api import ENDPOINT_MAP
+    stats, errors, log, server_url = _push(app, workdir, 'failed', '--fail', ENDPOINT_MAP['Product'])
+    failures = []
+    if 'Product' not in errors:
+        failures.append("Product did not fail")
+    if not str(errors.get('Sale', '')).startswith('Skipped'):
+        failures.append(f"Sale was not skipped: {errors.get('Sale')}")
+    if any(_model_of(entry['path']) == 'Sale' for entry in log):
+        failures.append("Sale was pushed although Product failed")
+    if set(errors) - {'Product', 'Sale'}:
+        failures.append(f"unexpected errors: {errors}")
+    missing = _missing(app, db, server_url, [m for m in stats if m not in errors])
+    if missing:
+        failures.append(f"rows missing on the server: {missing}")
+    print(f"failed   errors={sorted(errors)}, pushed={sorted(m for m in stats if m not in errors)}")
+    return failures
+
+
+def run(products, history):
+    workdir = tempfile.mkdtemp(prefix='sync-check-')
+    os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(workdir, 'shop.db')
+    from app import app
+    from models import db, Expense
+    from utils.db_bench import seed_database
+
+    seed_database(app, db, products=products, history=history)
+    with app.app_context():
+        db.session.add_all([Expense(description=f'Check expense {i}', amount=10.0, expense_date=datetime.utcnow())
+                            for i in range(20)])
+        db.session.commit()
+
+    failures = []
+    for check in (check_staged, check_retry, check_failed_parent):
+        failures += [f"{check.__name__}: {f}" for f in check(app, db, workdir)]
+    return failures
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--products', type=int, default=100)
+    parser.add_argument('--history', type=int, default=2000, help='sales to seed')
+    args = parser.parse_args(argv)
+
+    failures = run(args.products, args.history)
+    for failure in failures:
+        print("FAIL", failure)
+    if failures:
+        raise SystemExit(1)
+    print("ok")
+
+
+if __name__ == '__main__':
+    main()
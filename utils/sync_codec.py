@@ -0,0 +1,173 @@
+"""
+Wire formats for sync payloads.
+
+JSON (the original format) sends a list of row dicts with ISO datetimes.
+The columnar format sends one column list per chunk and one value list per
+row, with datetimes as integer microseconds since the epoch:
+
+    {"columns": ["id", "uuid", ...], "datetimes": [5, 6], "rows": [[1, "ab..", ...], ...]}
+
+A row may instead be a field-level delta, {"i": [column indexes], "v": [values]},
+carrying only the changed columns (uuid and last_modified always included).
+Deltas are computed against per-column digests of what was last pushed
+(SyncShadow), so no old values need to be kept.
+Either format may be gzip or zstd compressed (zstd when the optional
+`zstandard` package is installed).
+"""
+import gzip
+import json
+import zlib
+from datetime import datetime, timedelta, timezone
+
+try:
+    import zstandard
+except ImportError:  # optional
+    zstandard = None
+
+JSON_TYPE = 'application/json'
+COLUMNAR_TYPE = 'application/x-sync-columnar+json'
+
+EPOCH = datetime(1970, 1, 1)
+
+
+def supported_encodings():
+    return ['zstd', 'gzip'] if zstandard else ['gzip']
+
+
+def _to_micros(value):
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return (value - EPOCH) // timedelta(microseconds=1)
+
+
+def _from_micros(value):
+    return EPOCH + timedelta(microseconds=value)
+
+
+def _row_values(table, row):
+    if isinstance(row, dict):
+        return [row.get(c.name) for c in table.columns]
+    return [getattr(row, c.name) for c in table.columns]
+
+
+def row_digests(table, row):
+    """
+    One CRC32 per column, used to tell which columns changed since a push.
+    """
+    return [zlib.crc32(repr(v).encode()) for v in _row_values(table, row)]
+
+
+def encode_columnar(table, rows, base=None):
+    """
+    Encode `rows` (ORM objects or column dicts) of `table` as a columnar
+    chunk. With `base` ({uuid: row_digests() at the last push}) rows found
+    there are sent as deltas of the columns whose digest changed.
+    """
+    columns = [c.name for c in table.columns]
+    datetimes = [i for i, c in enumerate(table.columns) if c.type.python_type is datetime]
+    uuid_idx = columns.index('uuid')
+    always = {uuid_idx, columns.index('last_modified')}
+    out = []
+    for row in rows:
+        values = _row_values(table, row)
+        previous = base.get(values[uuid_idx]) if base else None
+        if previous is not None:
+            digests = [zlib.crc32(repr(v).encode()) for v in values]
+            idx = [i for i in range(len(columns)) if i in always or digests[i] != previous[i]]
+        else:
+            idx = None
+
+        for i in datetimes:
+            if values[i] is not None:
+                values[i] = _to_micros(values[i])
+        out.append(values if idx is None else {'i': idx, 'v': [values[i] for i in idx]})
+    return {'columns': columns, 'datetimes': datetimes, 'rows': out}
+
+
+def decode_columnar(payload):
+    """
+    Back to a list of column dicts with datetime objects. Delta rows only
+    carry their changed columns and are flagged with '__delta__'.
+    """
+    columns = payload['columns']
+    datetimes = set(payload.get('datetimes', []))
+    rows = []
+    for values in payload['rows']:
+        if isinstance(values, dict):
+            idx, vals = values['i'], values['v']
+            row = {'__delta__': True}
+        else:
+            idx, vals = range(len(columns)), values
+            row = {}
+        for i, v in zip(idx, vals):
+            row[columns[i]] = _from_micros(v) if i in datetimes and v is not None else v
+        rows.append(row)
+    return rows
+
+
+def compress(body, encoding):
+    if encoding == 'zstd' and zstandard:
+        return zstandard.ZstdCompressor(level=3).compress(body)
+    if encoding == 'gzip':
+        return gzip.compress(body, compresslevel=6)
+    return body
+
+
+def decompress(body, encoding):
+    if encoding == 'zstd' and zstandard:
+        return zstandard.ZstdDecompressor().decompressobj().decompress(body)
+    if encoding == 'gzip':
+        return gzip.decompress(body)
+    return body
+
+
+def encode(table, rows, fmt='columnar', encoding=None, row_to_dict=None, base=None):
+    """
+    Serialise a chunk for the wire. Returns (body bytes, headers).
+    `row_to_dict` builds the JSON-format row (api.model_to_dict); `base`
+    enables deltas in the columnar format (see encode_columnar).
+    """
+    if fmt == 'columnar':
+        body = json.dumps(encode_columnar(table, rows, base), separators=(',', ':')).encode()
+        headers = {'Content-Type': COLUMNAR_TYPE}
+    else:
+        body = json.dumps([row_to_dict(r) for r in rows], separators=(',', ':')).encode()
+        headers = {'Content-Type': JSON_TYPE}
+    if encoding:
+        body = compress(body, encoding)
+        headers['Content-Encoding'] = encoding
+    return body, headers
+
+
+def decode(body, content_type, encoding=None):
+    """
+    Parse a payload in either format into a list of row dicts.
+    """
+    data = json.loads(decompress(body, encoding) if encoding else body)
+    if (content_type or '').split(';')[0].strip() == COLUMNAR_TYPE:
+        return decode_columnar(data)
+    return data
+
+
+def measure(table, rows, row_to_dict):
+    """
+    Bytes on the wire and encode/decode milliseconds for every
+    format/compression combination, for `flask sync-wire-stats`.
+    """
+    import time
+    results = []
+    for fmt in ('json', 'columnar'):
+        for encoding in [None] + supported_encodings():
+            started = time.perf_counter()
+            body, headers = encode(table, rows, fmt, encoding, row_to_dict)
+            encoded = time.perf_counter()
+            decode(body, headers['Content-Type'], encoding)
+            decoded = time.perf_counter()
+            results.append({
+                'format': fmt,
+                'encoding': encoding or 'identity',
+                'bytes': len(body),
+                'encode_ms': round((encoded - started) * 1000, 1),
+                'decode_ms': round((decoded - encoded) * 1000, 1),
+            })
+    return results
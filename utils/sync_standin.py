@@ -0,0 +1,159 @@
+"""
+Local stand-in for the central sync server, for end-to-end checks.
+
+    python -m utils.sync_standin --database-url sqlite:////tmp/server.db --port 5001
+
+Serves the endpoints the client uses under /api/sync, on its own database
+with the same schema:
+
+    POST /api/sync/<endpoint>          push (JSON or columnar, any encoding)
+    GET  /api/sync/<endpoint>?since=   pull, as JSON
+    POST /api/sync/<endpoint>/delete   tombstones
+    POST /api/sync/<endpoint>/merkle   reconciliation (utils/reconcile.py)
+
+Pushed rows are applied with the client's own pull_batch, so newer
+last_modified wins on both sides.
+
+For failure tests it can slow every request down (--delay-ms), answer the
+first --flaky requests to each URL with 503 (what the client's Retry
+absorbs) and fail every request to a --fail endpoint with 500. Every
+request is logged with its start and end time:
+
+    GET  /api/sync/_requests           [{path, method, status, started, finished}]
+
+Checks start it in a child process with `start_standin()`.
+"""
+import argparse
+import socket
+import subprocess
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+from flask import Flask, Blueprint, abort, g, jsonify, request
+
+
+def create_app(database_url, delay_ms=0, flaky=0, fail=()):
+    from api import ENDPOINT_MAP, MODEL_MAP, model_to_dict, pull_batch
+    from models import db
+    from utils import reconcile, sync_codec
+    from utils.database import configure_database, init_engine
+
+    models = {endpoint: (name, MODEL_MAP[name]) for name, endpoint in ENDPOINT_MAP.items()}
+    bp = Blueprint('standin', __name__, url_prefix='/api/sync')
+
+    log, lock, seen = [], threading.Lock(), Counter()
+
+    @bp.before_request
+    def inject_faults():
+        g.started = time.time()
+        if request.endpoint == 'standin.requests_log':
+            return
+        if delay_ms:
+            time.sleep(delay_ms / 1000)
+        with lock:
+            seen[request.path] += 1
+            attempt = seen[request.path]
+        if (request.view_args or {}).get('endpoint') in fail:
+            abort(500)
+        if attempt <= flaky:
+            abort(503)
+
+    @bp.after_request
+    def record(response):
+        with lock:
+            log.append({'path': request.path, 'method': request.method, 'status': response.status_code,
+                        'started': g.get('started', time.time()), 'finished': time.time()})
+        return response
+
+    @bp.route('/_requests', methods=['GET'])
+    def requests_log():
+        with lock:
+            return jsonify([entry for entry in log if not entry['path'].endswith('/_requests')])
+
+    def model_for(endpoint):
+        if endpoint not in models:
+            abort(404)
+        return models[endpoint]
+
+    @bp.route('/<endpoint>', methods=['POST'])
+    def push(endpoint):
+        model_name, model_cls = model_for(endpoint)
+        rows = sync_codec.decode(request.get_data(), request.content_type, request.headers.get('Content-Encoding'))
+        written = pull_batch(model_name, model_cls, rows)
+        db.session.commit()
+        return jsonify({'received': len(rows), 'written': written})
+
+    @bp.route('/<endpoint>', methods=['GET'])
+    def pull(endpoint):
+        model_name, model_cls = model_for(endpoint)
+        since = datetime.fromisoformat(request.args.get('since', '2000-01-01T00:00:00'))
+        rows = model_cls.query.filter(model_cls.last_modified > since).order_by(model_cls.id).all()
+        return jsonify([model_to_dict(row) for row in rows])
+
+    @bp.route('/<endpoint>/delete', methods=['POST'])
+    def delete(endpoint):
+        model_name, model_cls = model_for(endpoint)
+        uuids = (request.get_json(silent=True) or {}).get('deleted') or []
+        table = model_cls.__table__
+        deleted = db.session.execute(table.delete().where(table.c.uuid.in_(uuids))).rowcount if uuids else 0
+        db.session.commit()
+        return jsonify({'deleted': deleted})
+
+    @bp.route('/<endpoint>/merkle', methods=['POST'])
+    def merkle(endpoint):
+        model_name, model_cls = model_for(endpoint)
+        return jsonify(reconcile.answer(model_cls, request.get_json(silent=True) or {}, model_to_dict))
+
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = database_url
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    configure_database(app)
+    db.init_app(app)
+    init_engine(app, db)
+    app.register_blueprint(bp)
+    with app.app_context():
+        db.create_all()
+    return app
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_standin(database_url, port, *args):
+    """
+    Run the stand-in on `port` in a child process (extra command-line
+    `args` are passed on) and wait until it accepts connections.
+    """
+    proc = subprocess.Popen([sys.executable, '-m', 'utils.sync_standin', '--database-url', database_url,
+                             '--port', str(port), *args], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.time() + 20
+    while time.time() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=0.5).close()
+            return proc
+        except OSError:
+            time.sleep(0.1)
+    proc.kill()
+    raise SystemExit("Stand-in server did not start")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--database-url', required=True)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=5001)
+    parser.add_argument('--delay-ms', type=int, default=0, help='added to every request')
+    parser.add_argument('--flaky', type=int, default=0, help='503 for the first N requests to each URL')
+    parser.add_argument('--fail', action='append', default=[], help='500 for every request to this endpoint')
+    args = parser.parse_args(argv)
+    app = create_app(args.database_url, args.delay_ms, args.flaky, set(args.fail))
+    app.run(host=args.host, port=args.port, threaded=True)
+
+
+if __name__ == '__main__':
+    main()
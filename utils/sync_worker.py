@@ -0,0 +1,188 @@
+import json
+import logging
+import threading
+import time
+from datetime import datetime, timedelta
+from sqlalchemy import exists, insert, literal, select, text, update
+from sqlalchemy.orm import aliased
+from models import db, SyncJob
+from utils.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+ACTIVE_STATUSES = ('queued', 'running')
+
+# Arbitrary key for pg_advisory_xact_lock around enqueue
+_PG_ENQUEUE_KEY = 0x53594E51
+
+
+class SyncWorker:
+    """
+    In-process background sync. Jobs are rows in the sync_job table, so the
+    queue survives restarts and is shared by every worker process; a job is
+    claimed with a conditional UPDATE that only succeeds while no other job
+    is running, which keeps two triggers (or two processes) from ever
+    syncing at the same time.
+    """
+
+    def __init__(self, app=None, job=None):
+        self.app = None
+        self.job = job
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._last_auto = time.monotonic()
+        if app is not None:
+            self.init_app(app, job)
+
+    def init_app(self, app, job):
+        """
+        `job(progress)` runs one full sync and returns (stats, errors, ok);
+        `progress(message)` may be called to report where it is.
+        """
+        self.app = app
+        self.job = job
+        app.config.setdefault('SYNC_INTERVAL', 0)         # seconds between auto syncs, 0 = off
+        app.config.setdefault('SYNC_POLL_INTERVAL', 5)
+        app.config.setdefault('SYNC_STALE_AFTER', 3600)   # a 'running' job older than this is abandoned
+        app.extensions['sync_worker'] = self
+
+        @app.before_request
+        def _ensure_sync_worker():
+            self.start()
+
+    # ------------------------------------------------------------------
+    # Queue
+    # ------------------------------------------------------------------
+    def enqueue(self, trigger='manual'):
+        """
+        Queue a sync unless one is already queued or running; returns the
+        job that will cover this request.
+        """
+        # Check and insert in one statement so two requests cannot both
+        # queue a job; PostgreSQL also needs the lock, as under READ
+        # COMMITTED both NOT EXISTS checks could pass
+        if db.session.get_bind().dialect.name == 'postgresql':
+            db.session.execute(text('SELECT pg_advisory_xact_lock(:key)'), {'key': _PG_ENQUEUE_KEY})
+        active = exists().where(SyncJob.status.in_(ACTIVE_STATUSES))
+        db.session.execute(
+            insert(SyncJob).from_select(
+                ['trigger', 'status', 'progress', 'created'],
+                select(literal(trigger), literal('queued'), literal('Queued'), literal(datetime.utcnow()))
+                .where(~active)
+            )
+        )
+        db.session.commit()
+        job = SyncJob.query.filter(SyncJob.status.in_(ACTIVE_STATUSES)).order_by(SyncJob.id).first()
+        self.start()
+        self._wake.set()
+        return job
+
+    def _claim(self):
+        """
+        Atomically move the oldest queued job to running. Returns its id or None.
+        """
+        job = SyncJob.query.filter_by(status='queued').order_by(SyncJob.id).first()
+        if job is None:
+            return None
+        running = aliased(SyncJob)
+        result = db.session.execute(
+            update(SyncJob)
+            .where(SyncJob.id == job.id, SyncJob.status == 'queued')
+            .where(~exists().where(running.status == 'running'))
+            .values(status='running', started=datetime.utcnow(), progress='Starting')
+            .execution_options(synchronize_session=False)
+        )
+        db.session.commit()
+        return job.id if result.rowcount == 1 else None
+
+    def _expire_stale(self):
+        cutoff = datetime.utcnow() - timedelta(seconds=self.app.config['SYNC_STALE_AFTER'])
+        db.session.execute(
+            update(SyncJob)
+            .where(SyncJob.status == 'running', SyncJob.started < cutoff)
+            .values(status='failed', finished=datetime.utcnow(), progress='Interrupted')
+            .execution_options(synchronize_session=False)
+        )
+        db.session.commit()
+
+    # ------------------------------------------------------------------
+    # Worker thread
+    # ------------------------------------------------------------------
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._start_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._loop, name='sync-worker', daemon=True)
+                self._thread.start()
+
+    def _loop(self):
+        while True:
+            self._wake.wait(self.app.config['SYNC_POLL_INTERVAL'])
+            self._wake.clear()
+            try:
+                with self.app.app_context():
+                    self._tick()
+            except Exception:
+                logger.exception("Sync worker iteration failed")
+
+    def _tick(self):
+        self._expire_stale()
+
+        interval = self.app.config['SYNC_INTERVAL']
+        if interval and time.monotonic() - self._last_auto >= interval:
+            self._last_auto = time.monotonic()
+            self.enqueue(trigger='auto')
+
+        job_id = self._claim()
+        if job_id is not None:
+            self._run(job_id)
+
+    def _run(self, job_id):
+        started = time.perf_counter()
+
+        def progress(message):
+            db.session.execute(
+                update(SyncJob).where(SyncJob.id == job_id).values(progress=message)
+                .execution_options(synchronize_session=False)
+            )
+            db.session.commit()
+
+        try:
+            stats, errors, ok = self.job(progress)
+            status, message = ('done', 'Completed') if ok else ('failed', 'Failed')
+        except Exception as e:
+            db.session.rollback()
+            logger.exception("Sync job %s failed", job_id)
+            stats, errors, status, message = {}, {'sync': str(e)}, 'failed', 'Failed'
+
+        job = db.session.get(SyncJob, job_id)
+        job.status = status
+        job.progress = message
+        job.finished = datetime.utcnow()
+        job.duration = round(time.perf_counter() - started, 3)
+        metrics.observe_job(f'sync_{job.trigger}', job.duration, status)
+        job.stats = json.dumps(stats)
+        job.errors = json.dumps(errors) if errors else None
+        db.session.commit()
+
+
+def job_to_dict(job):
+    if job is None:
+        return None
+    return {
+        'id': job.id,
+        'trigger': job.trigger,
+        'status': job.status,
+        'progress': job.progress,
+        'created': job.created.isoformat() if job.created else None,
+        'started': job.started.isoformat() if job.started else None,
+        'finished': job.finished.isoformat() if job.finished else None,
+        'duration': job.duration,
+        'stats': json.loads(job.stats) if job.stats else {},
+        'errors': json.loads(job.errors) if job.errors else {},
+    }
+
+
+sync_worker = SyncWorker()
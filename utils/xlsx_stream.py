@@ -0,0 +1,137 @@
+"""
+Single-sheet XLSX written as a stream of bytes.
+
+An .xlsx file is a zip of XML parts. The fixed parts are tiny; the sheet is
+written row by row into a zip entry that is compressed on the fly, and the
+compressed bytes are handed to the caller as soon as they exist. The first
+bytes go out before the first row is read, nothing touches the disk and
+memory stays flat for any number of rows.
+
+Cells are numbers or inline strings (None leaves the cell empty; NaN and
+infinities become text), which is all the exports need; dates should
+already be formatted as text.
+"""
+import math
+import re
+import zipfile
+from xml.sax.saxutils import escape
+
+_CONTENT_TYPES = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+    '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+    '<Default Extension="xml" ContentType="application/xml"/>'
+    '<Override PartName="/xl/workbook.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+    '<Override PartName="/xl/worksheets/sheet1.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+    '</Types>'
+)
+_ROOT_RELS = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" '
+    'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" '
+    'Target="xl/workbook.xml"/>'
+    '</Relationships>'
+)
+_WORKBOOK = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+    'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+    '<sheets><sheet name="{name}" sheetId="1" r:id="rId1"/></sheets>'
+    '</workbook>'
+)
+_WORKBOOK_RELS = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" '
+    'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" '
+    'Target="worksheets/sheet1.xml"/>'
+    '</Relationships>'
+)
+_SHEET_START = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"><sheetData>'
+)
+_SHEET_END = '</sheetData></worksheet>'
+
+# Characters XML 1.0 does not allow, even escaped
+_ILLEGAL = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f]')
+
+# Rows buffered before they are compressed and yielded
+FLUSH_ROWS = 1000
+
+
+class _Sink:
+    """Unseekable file object collecting what zipfile writes."""
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def take(self):
+        data = b''.join(self.chunks)
+        self.chunks.clear()
+        return data
+
+
+def _column(index):
+    letters = ''
+    index += 1
+    while index:
+        index, rest = divmod(index - 1, 26)
+        letters = chr(65 + rest) + letters
+    return letters
+
+
+def _cell(ref, value):
+    if value is None:
+        return ''
+    if isinstance(value, bool):
+        return f'<c r="{ref}" t="b"><v>{int(value)}</v></c>'
+    # NaN and infinities have no number form in a sheet: they are written
+    # as text, the way the CSV export writes them
+    if isinstance(value, int) or isinstance(value, float) and math.isfinite(value):
+        return f'<c r="{ref}"><v>{value!r}</v></c>'
+    text = escape(_ILLEGAL.sub('', str(value)))
+    return f'<c r="{ref}" t="inlineStr"><is><t xml:space="preserve">{text}</t></is></c>'
+
+
+def _row(number, values, columns):
+    return f'<row r="{number}">' + ''.join(
+        _cell(f'{columns[i]}{number}', v) for i, v in enumerate(values)) + '</row>'
+
+
+def stream_xlsx(header, rows, sheet_name='Sheet1'):
+    """
+    Yield the bytes of an .xlsx with one sheet: `header`, then `rows`
+    (iterables of cell values, at most len(header) cells each).
+    """
+    columns = [_column(i) for i in range(len(header))]
+    sink = _Sink()
+    with zipfile.ZipFile(sink, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr('[Content_Types].xml', _CONTENT_TYPES)
+        archive.writestr('_rels/.rels', _ROOT_RELS)
+        archive.writestr('xl/workbook.xml', _WORKBOOK.format(name=escape(sheet_name, {'"': '&quot;'})))
+        archive.writestr('xl/_rels/workbook.xml.rels', _WORKBOOK_RELS)
+        yield sink.take()
+
+        with archive.open('xl/worksheets/sheet1.xml', 'w', force_zip64=True) as sheet:
+            pending = [_SHEET_START, _row(1, header, columns)]
+            for number, row in enumerate(rows, start=2):
+                pending.append(_row(number, row, columns))
+                if len(pending) >= FLUSH_ROWS:
+                    sheet.write(''.join(pending).encode())
+                    pending.clear()
+                    data = sink.take()
+                    if data:
+                        yield data
+            pending.append(_SHEET_END)
+            sheet.write(''.join(pending).encode())
+    yield sink.take()